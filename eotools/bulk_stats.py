@@ -21,6 +21,10 @@ from __future__ import print_function
 import numpy
 import numexpr
 
+# The approximate working memory of bulk_stats, as a multiple of the
+# input array in float32; see eotools.tiling.plan_tile_size
+MEMORY_COST = 5.0
+
 
 def bulk_stats(array, no_data=None, double=False, as_bip=False):
     """
@@ -0,0 +1,355 @@
+#!/usr/bin/env python
+
+# ===============================================================================
+# Copyright 2015 Geoscience Australia
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+"""
+A chunked, compressed array store following the Zarr (version 2)
+directory layout, as an alternative output to `TiledOutput`.
+
+The store is a directory containing:
+
+    * .zarray; the array shape [bands, lines, samples], chunk shape,
+      data type, fill value and compressor (zlib).
+    * .zattrs; the band descriptions, geotransform, CRS and no data
+      value. The CRS is also written as GDAL's _CRS attribute.
+    * One zlib compressed file per chunk, named <band>.<ychunk>.<xchunk>.
+
+Each chunk holds a single band of a single tile, so independent tiles
+(and bands) can be written by parallel workers without any locking.
+The store can be read with the zarr library, GDAL's Zarr driver, or
+`ChunkedStore`. GDAL picks up the CRS, but not the geotransform, which
+GDAL only derives from coordinate arrays that a single array store
+doesn't have; only `ChunkedStore` restores the full georeferencing.
+"""
+
+from __future__ import absolute_import
+import json
+import os
+from os.path import join as pjoin
+from os.path import exists
+import threading
+import zlib
+import numpy
+from osgeo import gdal
+from osgeo import gdal_array
+from eotools.instrumentation import NULL_STATS
+from eotools.tiling import crop_tile
+from eotools.tiling import split_tile
+
+# The format name used to select the chunked store as an output
+CHUNKED_FORMAT = 'ZARR'
+
+
+def _chunk_name(band, ychunk, xchunk):
+    """
+    The file name of a chunk; `band` is zero based.
+    """
+    return '{}.{}.{}'.format(band, ychunk, xchunk)
+
+
+class ChunkedOutput(object):
+
+    def __init__(self, out_fname, samples=None, lines=None, bands=1,
+                 geobox=None, nodata=None, dtype=gdal.GDT_Float32,
+                 chunks=(256, 256), level=1, band_names=None, stats=None):
+        """
+        Writes tiles into a chunked, compressed array store, using the
+        same interface as `TiledOutput`.
+
+        :param out_fname:
+            A string containing the full filepath name of the store
+            directory.
+
+        :param samples:
+            An integer indicating the number of samples/columns contained
+            in the entire image.
+
+        :param lines:
+            An integer indicating the number of lines/rows contained in
+            the entire image.
+
+        :param bands:
+            The number of bands contained in the image. Default is 1.
+
+        :param geobox:
+            An instance of a GriddedGeoBox object.
+
+        :param nodata:
+            The no data value for the image. It is also the value of
+            any chunk that is never written.
+
+        :param dtype:
+            An integer indicating the GDAL datatype for the output
+            image. Default is gdal.GDT_Float32.
+
+        :param chunks:
+            A tuple (ysize, xsize) of the chunk dimensions. This should
+            match the processing tiles; every tile written must be
+            aligned to the chunk grid. Default is (256, 256).
+
+        :param level:
+            The zlib compression level. Default is 1.
+
+        :param band_names:
+            An optional list of band descriptions, one for each band.
+
+        :param stats:
+            An optional instance of `eotools.instrumentation.IOStats`
+            used to record the counts, bytes and time of the writes.
+            Default is None (no instrumentation).
+        """
+        # Check we have the correct dimensions to create the store
+        if ((samples is None) or (lines is None)):
+            msg = ("Samples and lines are required inputs! Samples: {ns} "
+                   "Lines: {nl}").format(ns=samples, nl=lines)
+            raise TypeError(msg)
+
+        self.out_fname = out_fname
+        self.samples = samples
+        self.lines = lines
+        self.bands = bands
+        self.geobox = geobox
+        self.nodata = nodata
+        self.dtype = numpy.dtype(gdal_array.GDALTypeCodeToNumericTypeCode(
+            dtype))
+        self.chunks = tuple(int(c) for c in chunks)
+        self.level = level
+        self.band_names = band_names
+        self.stats = NULL_STATS if stats is None else stats
+
+        with self.stats.timer('create'):
+            if not exists(out_fname):
+                os.makedirs(out_fname)
+            self._write_metadata()
+
+        self.closed = False
+
+    def _write_metadata(self):
+        """
+        Write the .zarray and .zattrs documents.
+        """
+        fill_value = self.nodata
+        if fill_value is not None:
+            fill_value = float(fill_value)
+            if numpy.isnan(fill_value):
+                fill_value = 'NaN'
+            elif self.dtype.kind in 'iu':
+                fill_value = int(fill_value)
+
+        zarray = {'zarr_format': 2,
+                  'shape': [self.bands, self.lines, self.samples],
+                  'chunks': [1, self.chunks[0], self.chunks[1]],
+                  'dtype': self.dtype.str,
+                  'compressor': {'id': 'zlib', 'level': self.level},
+                  'fill_value': fill_value,
+                  'filters': None,
+                  'order': 'C'}
+
+        zattrs = {'nodata': fill_value}
+        if self.band_names is not None:
+            zattrs['band_names'] = list(self.band_names)
+        if self.geobox is not None:
+            wkt = self.geobox.crs.ExportToWkt()
+            zattrs['geotransform'] = list(self.geobox.affine.to_gdal())
+            zattrs['crs'] = wkt
+
+            # The CRS as understood by GDAL's Zarr driver
+            zattrs['_CRS'] = {'wkt': wkt}
+
+        with open(pjoin(self.out_fname, '.zarray'), 'w') as src:
+            json.dump(zarray, src, indent=4)
+        with open(pjoin(self.out_fname, '.zattrs'), 'w') as src:
+            json.dump(zattrs, src, indent=4)
+
+    def _write_chunk(self, data, band, ychunk, xchunk):
+        """
+        Compress and write a single chunk, padding partial chunks at
+        the image edges with the fill value. The chunk is written to a
+        temporary file and renamed so that readers never see a
+        partially written chunk.
+        """
+        ysize, xsize = self.chunks
+        if data.shape != (ysize, xsize):
+            fill = 0 if self.nodata is None else self.nodata
+            padded = numpy.empty((ysize, xsize), dtype=self.dtype)
+            padded.fill(fill)
+            padded[:data.shape[0], :data.shape[1]] = data
+            data = padded
+
+        data = numpy.ascontiguousarray(data, dtype=self.dtype)
+        fname = pjoin(self.out_fname, _chunk_name(band, ychunk, xchunk))
+        tmp_fname = '{}.{}.{}.tmp'.format(fname, os.getpid(),
+                                          threading.current_thread().ident)
+        with open(tmp_fname, 'wb') as src:
+            src.write(zlib.compress(data.tobytes(), self.level))
+        os.rename(tmp_fname, fname)
+
+    def write_tile(self, array, tile, raster_band=None):
+        """
+        Given an array and tile index in the form:
+
+            ((ystart, yend), (xstart, xend))
+
+        and optionally a raster band, write the current tile to the
+        store. See `TiledOutput.write_tile`.
+
+        The tile must start on a chunk boundary, and must end on
+        a chunk boundary or the edge of the image. Tiles spanning
+        several chunks are split. For a (read_window, core_window)
+        pair, only the core window is written.
+        """
+        dims = array.ndim
+        if array.ndim not in [2, 3]:
+            msg = ("Input array is not 2 or 3 dimensions. "
+                   "Array dimensions: {dims}").format(dims=dims)
+            raise TypeError(msg)
+
+        array, tile = crop_tile(array, tile)
+
+        (ystart, yend), (xstart, xend) = tile
+        ysize, xsize = self.chunks
+        if ((ystart % ysize) or (xstart % xsize) or
+                ((yend % ysize) and yend != self.lines) or
+                ((xend % xsize) and xend != self.samples)):
+            msg = "Tile {} is not aligned to the chunk shape {}"
+            raise ValueError(msg.format(tile, self.chunks))
+
+        if dims == 3:
+            bands = range(self.bands)
+        else:
+            band = 1 if raster_band is None else raster_band
+            bands = [band - 1]
+            array = array[numpy.newaxis]
+
+        with self.stats.timer('write', tile, array.nbytes):
+            for i, band in enumerate(bands):
+                for y in range(ystart, yend, ysize):
+                    for x in range(xstart, xend, xsize):
+                        data = array[i, y - ystart:y - ystart + ysize,
+                                     x - xstart:x - xstart + xsize]
+                        self._write_chunk(data, band, y // ysize, x // xsize)
+
+    def fill_tile(self, tile, value=None):
+        """
+        Fill every band of `tile` with a constant. See
+        `TiledOutput.fill_tile`.
+
+        Chunks that are never written already read as the no data
+        value, so nothing is written unless `value` is given.
+        """
+        if value is None:
+            return
+
+        (ystart, yend), (xstart, xend) = split_tile(tile)[1]
+        shape = (self.bands, int(yend - ystart), int(xend - xstart))
+        array = numpy.empty(shape, dtype=self.dtype)
+        array.fill(value)
+
+        self.write_tile(array, tile)
+
+    def close(self):
+        """
+        Close the store. Every chunk is complete once written, so there
+        is nothing to flush.
+        """
+        self.closed = True
+
+
+class ChunkedStore(object):
+
+    def __init__(self, fname):
+        """
+        Read access to a store written by `ChunkedOutput`.
+
+        :param fname:
+            A string containing the full filepath name of the store
+            directory.
+        """
+        self.fname = fname
+
+        with open(pjoin(fname, '.zarray')) as src:
+            zarray = json.load(src)
+        with open(pjoin(fname, '.zattrs')) as src:
+            self.attrs = json.load(src)
+
+        self.bands, self.lines, self.samples = zarray['shape']
+        self.chunks = tuple(zarray['chunks'][1:])
+        self.dtype = numpy.dtype(zarray['dtype'])
+
+        fill_value = zarray['fill_value']
+        if fill_value is None:
+            fill_value = 0
+        self.fill_value = float(fill_value)
+
+        self.band_names = self.attrs.get('band_names')
+        self.geotransform = self.attrs.get('geotransform')
+        self.projection = self.attrs.get('crs')
+
+    def _read_chunk(self, band, ychunk, xchunk):
+        """
+        Read and decompress a single chunk; `band` is zero based.
+        """
+        fname = pjoin(self.fname, _chunk_name(band, ychunk, xchunk))
+        if not exists(fname):
+            data = numpy.empty(self.chunks, dtype=self.dtype)
+            data.fill(self.fill_value)
+            return data
+
+        with open(fname, 'rb') as src:
+            data = zlib.decompress(src.read())
+        return numpy.frombuffer(data, dtype=self.dtype).reshape(self.chunks)
+
+    def read_tile(self, tile, raster_bands=1):
+        """
+        Read an x & y block specified by tile for the given raster
+        band(s). See `StackedDataset.read_tile`.
+        """
+        (ystart, yend), (xstart, xend) = tile
+        ysize, xsize = self.chunks
+
+        if isinstance(raster_bands, int):
+            bands = [raster_bands]
+        else:
+            bands = list(raster_bands)
+
+        subset = numpy.empty((len(bands), yend - ystart, xend - xstart),
+                             dtype=self.dtype)
+
+        for i, band in enumerate(bands):
+            for ychunk in range(ystart // ysize, (yend - 1) // ysize + 1):
+                for xchunk in range(xstart // xsize, (xend - 1) // xsize + 1):
+                    data = self._read_chunk(band - 1, ychunk, xchunk)
+                    y0 = ychunk * ysize
+                    x0 = xchunk * xsize
+                    ys = max(ystart, y0)
+                    ye = min(yend, y0 + ysize)
+                    xs = max(xstart, x0)
+                    xe = min(xend, x0 + xsize)
+                    idx = (i, slice(ys - ystart, ye - ystart),
+                           slice(xs - xstart, xe - xstart))
+                    subset[idx] = data[ys - y0:ye - y0, xs - x0:xe - x0]
+
+        if isinstance(raster_bands, int):
+            return subset[0]
+        return subset
+
+    def read_raster_band(self, raster_band=1):
+        """
+        Read the entire 2D block for a single raster band.
+        """
+        tile = ((0, self.lines), (0, self.samples))
+        return self.read_tile(tile, raster_band)
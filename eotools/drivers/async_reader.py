@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+
+# ===============================================================================
+# Copyright 2015 Geoscience Australia
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+"""
+asyncio support for `StackedDataset` reads (Python 3 only).
+
+GDAL reads are run in a bounded pool of threads, each of which keeps
+its own open GDAL handle. Identical requests that are in flight at the
+same time are coalesced into a single read, and a request is only
+cancelled once every caller awaiting it has been cancelled.
+
+Example:
+
+    >>> async def serve(ds):
+    ...     tiles = [ds.get_tile(i) for i in range(ds.n_tiles)]
+    ...     reads = [ds.aread_tile(tile, [1, 2, 3]) for tile in tiles]
+    ...     return await asyncio.gather(*reads)
+"""
+
+from __future__ import absolute_import
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import numpy
+
+
+def _key(value):
+    """
+    Convert a (possibly nested) tile or band list to a hashable key.
+    """
+    if isinstance(value, (list, tuple, range)):
+        return tuple(_key(v) for v in value)
+    return int(value)
+
+
+def _get_loop():
+    """
+    The running event loop, or the current event loop if called
+    outside of a coroutine.
+    """
+    try:
+        return asyncio.get_running_loop()
+    except (AttributeError, RuntimeError):
+        return asyncio.get_event_loop()
+
+
+class _SharedState(object):
+
+    """
+    Mixed into a view of a dataset. Any attribute the view doesn't hold
+    itself is looked up on the dataset, so later changes to the dataset
+    (eg `attach_time_major`, `init_tiling` or a block cache) apply to
+    reads made through the view.
+    """
+
+    def __getattr__(self, name):
+        return getattr(self.__dict__['_shared'], name)
+
+
+def _thread_handle_view(dataset):
+    """
+    A view of `dataset` whose reads keep per thread GDAL handles,
+    leaving the handles of the dataset itself unchanged.
+    """
+    cls = type(dataset)
+    view = object.__new__(type(cls.__name__, (_SharedState, cls), {}))
+    view.__dict__['_shared'] = dataset
+    view.use_thread_handles(True)
+
+    return view
+
+
+class _Request(object):
+
+    """
+    A single in flight read shared by one or more awaiting callers.
+    """
+
+    def __init__(self, future):
+        self.future = future
+        self.waiters = set()
+
+
+class AsyncReader(object):
+
+    def __init__(self, stacked_dataset, max_workers=4):
+        """
+        Provides awaitable reads of a `StackedDataset`.
+
+        :param stacked_dataset:
+            An instance of a `StackedDataset`. Reads share its state,
+            so eg a time-major cache attached after the reader was
+            created serves subsequent reads.
+
+        :param max_workers:
+            The maximum number of concurrent GDAL reads, and therefore
+            the maximum number of open GDAL handles per file.
+            Default is 4.
+        """
+        self.stacked_dataset = stacked_dataset
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers)
+        self._requests = {}
+
+        # Reads use a private view of the dataset, whose worker threads
+        # keep their GDAL handles open between reads. The view shares
+        # every other attribute with the caller's dataset
+        self._dataset = _thread_handle_view(stacked_dataset)
+
+    @property
+    def pending(self):
+        """
+        The number of distinct reads currently in flight.
+        """
+        return len(self._requests)
+
+    def _submit(self, key, func, *args):
+        """
+        Submit `func` to the thread pool, or attach to an identical
+        request already in flight.
+
+        :return:
+            An `asyncio.Future` owned by the caller.
+        """
+        loop = _get_loop()
+
+        request = self._requests.get(key)
+        if request is None:
+            future = self._executor.submit(func, *args)
+            request = _Request(future)
+            self._requests[key] = request
+
+            def on_complete(future):
+                loop.call_soon_threadsafe(self._complete, key, request)
+
+            future.add_done_callback(on_complete)
+
+        waiter = loop.create_future()
+        request.waiters.add(waiter)
+
+        def on_waiter_done(waiter):
+            if waiter.cancelled():
+                request.waiters.discard(waiter)
+                if not request.waiters:
+                    # Nobody is waiting; drop the read if not yet started
+                    request.future.cancel()
+                    if self._requests.get(key) is request:
+                        del self._requests[key]
+
+        waiter.add_done_callback(on_waiter_done)
+
+        return waiter
+
+    def _complete(self, key, request):
+        """
+        Deliver the result of a completed read to every waiter.
+        """
+        if self._requests.get(key) is request:
+            del self._requests[key]
+
+        future = request.future
+        first = True
+        for waiter in request.waiters:
+            if waiter.done():
+                continue
+            if future.cancelled():
+                waiter.cancel()
+            elif future.exception() is not None:
+                waiter.set_exception(future.exception())
+            else:
+                # Only the first waiter receives the array itself; the
+                # others get copies, so callers never share an array
+                result = future.result()
+                if not first and isinstance(result, numpy.ndarray):
+                    result = result.copy()
+                first = False
+                waiter.set_result(result)
+
+        request.waiters.clear()
+
+    def read_tile(self, tile, raster_bands=1, decimation=1):
+        """
+        Awaitable variant of `StackedDataset.read_tile`.
+        """
+        key = ('read_tile', _key(tile), _key(raster_bands), decimation)
+        return self._submit(key, self._dataset.read_tile, tile,
+                            raster_bands, decimation)
+
+    def read_raster_band(self, raster_band=1, decimation=1):
+        """
+        Awaitable variant of `StackedDataset.read_raster_band`.
+        """
+        key = ('read_raster_band', raster_band, decimation)
+        return self._submit(key, self._dataset.read_raster_band,
+                            raster_band, decimation)
+
+    def z_profile(self, x, y, raster_bands=None):
+        """
+        Awaitable read of the z-axis profile at image co-ordinate (x, y).
+        """
+        ds = self._dataset
+        if raster_bands is None:
+            raster_bands = list(range(1, ds.bands + 1))
+
+        tile = ((y, y + 1), (x, x + 1))
+
+        def read():
+            return ds.read_tile(tile, raster_bands)[:, 0, 0]
+
+        key = ('z_profile', _key(tile), _key(raster_bands))
+        return self._submit(key, read)
+
+    def close(self, wait=True):
+        """
+        Shut down the thread pool.
+        """
+        self._executor.shutdown(wait=wait)
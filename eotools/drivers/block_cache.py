@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+
+# ===============================================================================
+# Copyright 2015 Geoscience Australia
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+from __future__ import absolute_import
+import collections
+import threading
+import zlib
+import numpy
+
+
+class BlockCache(object):
+
+    def __init__(self, max_bytes, compress=False, level=1):
+        """
+        A thread safe, byte bounded, least recently used cache of
+        decoded image blocks.
+
+        :param max_bytes:
+            The maximum number of bytes held by the cache. Once
+            exceeded, the least recently used blocks are evicted.
+
+        :param compress:
+            If set to True, then blocks are held zlib compressed,
+            trading CPU time for a larger effective cache.
+            Default is False.
+
+        :param level:
+            The zlib compression level. Default is 1 (fastest).
+
+        :example:
+            >>> cache = BlockCache(2**20)
+            >>> cache.get((1, 0, 0)) is None
+            True
+            >>> cache.put((1, 0, 0), numpy.zeros((128, 128)))
+            >>> cache.get((1, 0, 0)).shape
+            (128, 128)
+            >>> cache.info()['hits']
+            1
+        """
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.level = level
+        self._init_state()
+
+    def _init_state(self):
+        """
+        Initialise an empty cache.
+        """
+        self._blocks = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __getstate__(self):
+        """
+        Only the cache settings are pickled; the receiving process
+        starts with an empty cache.
+        """
+        return {'max_bytes': self.max_bytes,
+                'compress': self.compress,
+                'level': self.level}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_state()
+
+    def __len__(self):
+        return len(self._blocks)
+
+    def get(self, key):
+        """
+        Retrieve a block from the cache.
+
+        :param key:
+            A hashable key, eg (band, yblock, xblock).
+
+        :return:
+            A NumPy array, or None if `key` isn't cached.
+        """
+        with self._lock:
+            item = self._blocks.pop(key, None)
+            if item is None:
+                self.misses += 1
+                return None
+
+            # Re-insert to mark as the most recently used
+            self._blocks[key] = item
+            self.hits += 1
+
+        data, dtype, shape, _ = item
+        if self.compress:
+            array = numpy.frombuffer(zlib.decompress(data), dtype=dtype)
+            return array.reshape(shape)
+
+        return data
+
+    def put(self, key, array):
+        """
+        Insert a block into the cache, evicting the least recently
+        used blocks as required.
+
+        :param key:
+            A hashable key, eg (band, yblock, xblock).
+
+        :param array:
+            A NumPy array containing the decoded block.
+        """
+        if self.compress:
+            data = zlib.compress(numpy.ascontiguousarray(array).tobytes(),
+                                 self.level)
+            nbytes = len(data)
+        else:
+            data = array
+            nbytes = array.nbytes
+
+        # Don't cache anything that can never fit
+        if nbytes > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._blocks.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[3]
+
+            self._blocks[key] = (data, array.dtype, array.shape, nbytes)
+            self.nbytes += nbytes
+
+            while self.nbytes > self.max_bytes:
+                _, item = self._blocks.popitem(last=False)
+                self.nbytes -= item[3]
+                self.evictions += 1
+
+    def clear(self):
+        """
+        Remove every block from the cache. The statistics are retained.
+        """
+        with self._lock:
+            self._blocks.clear()
+            self.nbytes = 0
+
+    def info(self):
+        """
+        Return the cache statistics.
+
+        :return:
+            A dictionary containing the keys hits, misses, hit_rate,
+            evictions, blocks, nbytes and max_bytes.
+        """
+        with self._lock:
+            requests = self.hits + self.misses
+            hit_rate = self.hits / float(requests) if requests else 0.0
+            info = {'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': hit_rate,
+                    'evictions': self.evictions,
+                    'blocks': len(self._blocks),
+                    'nbytes': self.nbytes,
+                    'max_bytes': self.max_bytes}
+
+        return info
@@ -0,0 +1,387 @@
+#!/usr/bin/env python
+
+# ===============================================================================
+# Copyright 2015 Geoscience Australia
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+"""
+An in-memory stack built from a list of single date files, without
+the need for a VRT.
+"""
+
+from __future__ import absolute_import
+import collections
+import contextlib
+import threading
+from osgeo import gdal
+from eotools.instrumentation import NULL_STATS
+from eotools.drivers.stacked_dataset import StackedDataset
+from eotools.drivers.stacked_dataset import gdal_2_numpy_dtypes
+
+
+class HandlePool(object):
+
+    def __init__(self, max_handles=64, opener=gdal.Open):
+        """
+        A pool of open GDAL handles. Files are opened on first use, and
+        handles are returned to the pool after each read for re-use by
+        any thread, though a handle is never used by two threads at
+        once. The least recently used idle handles are closed once
+        more than `max_handles` are held.
+
+        :param max_handles:
+            The maximum number of idle handles held by the pool.
+            Default is 64.
+
+        :param opener:
+            The function used to open a file. Default is `gdal.Open`.
+        """
+        self.max_handles = max_handles
+        self.opener = opener
+        self._lock = threading.Lock()
+        self._idle = collections.OrderedDict()
+        self._n_idle = 0
+
+    def acquire(self, fname):
+        """
+        Take an idle handle to `fname` from the pool, or open a new one.
+        """
+        with self._lock:
+            handles = self._idle.pop(fname, None)
+            if handles:
+                ds = handles.pop()
+                self._n_idle -= 1
+                if handles:
+                    self._idle[fname] = handles
+                return ds
+
+        return self.opener(fname)
+
+    def release(self, fname, ds):
+        """
+        Return a handle to the pool, closing the least recently used
+        idle handles if the pool is full.
+        """
+        with self._lock:
+            handles = self._idle.pop(fname, [])
+            handles.append(ds)
+            self._idle[fname] = handles
+            self._n_idle += 1
+
+            while self._n_idle > self.max_handles:
+                oldest = next(iter(self._idle))
+                handles = self._idle[oldest]
+                handles.pop(0)
+                self._n_idle -= 1
+                if not handles:
+                    del self._idle[oldest]
+
+    @contextlib.contextmanager
+    def handle(self, fname):
+        """
+        A context manager providing exclusive use of a handle to `fname`.
+        """
+        ds = self.acquire(fname)
+        try:
+            yield ds
+        finally:
+            self.release(fname, ds)
+
+    def clear(self):
+        """
+        Close every idle handle.
+        """
+        with self._lock:
+            self._idle.clear()
+            self._n_idle = 0
+
+
+class FileStack(StackedDataset):
+
+    """
+    A `StackedDataset` whose raster bands are held in a list of
+    separate files, eg one GeoTIFF per acquisition date. The stack is
+    held in memory, so there is no VRT to write or parse.
+
+    Example:
+
+        >>> fnames = ['LS5_TM_NBAR_1995-07-02.tif',
+        ...           'LS5_TM_NBAR_1995-07-18.tif',
+        ...           'LS5_TM_NBAR_1996-01-10.tif',
+        ...           'LS5_TM_NBAR_1996-01-26.tif']
+        >>> dates = [datetime.datetime(1995, 7, 2),
+        ...          datetime.datetime(1995, 7, 18),
+        ...          datetime.datetime(1996, 1, 10),
+        ...          datetime.datetime(1996, 1, 26)]
+        >>> ds = StackedDataset.from_files(fnames, dates, raster_band=4)
+        >>> ds.bands
+        4
+        >>> ds.init_yearly_iterator()
+        >>> ds.get_yearly_iterator()
+        {1995: [1, 2], 1996: [3, 4]}
+    """
+
+    def __init__(self, fnames, datetimes=None, raster_band=1,
+                 source_threads=None, cache_size=None, cache_compress=False,
+                 max_handles=64, stats=None):
+        """
+        Initialise the stack and validate that every file shares the
+        same grid and data type.
+
+        :param fnames:
+            A list of GDAL compliant file path names, in temporal order.
+            Each file provides a single raster band of the stack.
+
+        :param datetimes:
+            An optional list of `datetime.datetime` objects, one for
+            each file, used by the yearly iterator.
+
+        :param raster_band:
+            The raster band to read from each file. Default is 1.
+
+        :param max_handles:
+            The maximum number of idle file handles kept open.
+            Default is 64.
+
+        See `StackedDataset` for the remaining parameters.
+        """
+        if len(fnames) == 0:
+            raise ValueError("A FileStack requires at least one file")
+
+        if datetimes is not None and len(datetimes) != len(fnames):
+            msg = "Received {} datetimes for {} files"
+            raise ValueError(msg.format(len(datetimes), len(fnames)))
+
+        self.fnames = list(fnames)
+        self.datetimes = None if datetimes is None else list(datetimes)
+        self.raster_band = raster_band
+        self.max_handles = max_handles
+
+        # The first file is used to name the stack
+        self.fname = self.fnames[0]
+        self.stats = NULL_STATS if stats is None else stats
+
+        # Open the first file
+        ds = self._open(self.fname)
+
+        self._init_from_dataset(ds, len(self.fnames), raster_band,
+                                memmap=False, source_threads=source_threads,
+                                cache_size=cache_size,
+                                cache_compress=cache_compress)
+
+        # Close the dataset
+        ds = None
+
+        self._validate()
+
+        self._sources = [(fname, raster_band) for fname in self.fnames]
+        self._handles = HandlePool(max_handles, self._open_pooled)
+
+    def __getstate__(self):
+        """
+        Exclude the handle pool when pickling.
+        """
+        state = StackedDataset.__getstate__(self)
+        state['_handles'] = None
+        return state
+
+    def __setstate__(self, state):
+        StackedDataset.__setstate__(self, state)
+        self._handles = HandlePool(self.max_handles, self._open_pooled)
+
+    def _open_pooled(self, fname):
+        """
+        Open a new handle for the pool. Unlike `_open`, the per thread
+        handle cache is bypassed, as a handle released to the pool may
+        be acquired next by another thread.
+        """
+        with self.stats.timer('open'):
+            return gdal.Open(fname)
+
+    def _validate(self):
+        """
+        Ensure every file shares the grid and data type of the first.
+        Each file is opened once.
+        """
+        for fname in self.fnames[1:]:
+            ds = self._open(fname)
+            if ds is None:
+                raise IOError("Unable to open {}".format(fname))
+
+            if ds.RasterCount < self.raster_band:
+                msg = "{} has {} raster bands, raster band {} requested"
+                raise ValueError(msg.format(fname, ds.RasterCount,
+                                            self.raster_band))
+
+            band = ds.GetRasterBand(self.raster_band)
+            dtype = gdal_2_numpy_dtypes[band.DataType]
+            if ((ds.RasterXSize, ds.RasterYSize) !=
+                    (self.samples, self.lines)):
+                msg = "{} has dimensions {}, expected {}"
+                raise ValueError(msg.format(fname,
+                                            (ds.RasterYSize, ds.RasterXSize),
+                                            (self.lines, self.samples)))
+            if ds.GetGeoTransform() != self.geotransform:
+                msg = "{} has geotransform {}, expected {}"
+                raise ValueError(msg.format(fname, ds.GetGeoTransform(),
+                                            self.geotransform))
+            if ds.GetProjection() != self.projection:
+                msg = "{} has a differing projection to {}"
+                raise ValueError(msg.format(fname, self.fname))
+            if dtype != self.dtype:
+                msg = "{} has datatype {}, expected {}"
+                raise ValueError(msg.format(fname, dtype, self.dtype))
+
+            # Close the dataset
+            band = None
+            ds = None
+
+    def _resolve_sources(self):
+        """
+        The (filename, band) tuple of every raster band.
+        """
+        return self._sources
+
+    def _use_sources(self):
+        """
+        Every read goes directly to the files.
+        """
+        return True
+
+    def _read_source(self, args):
+        """
+        Read a block from a single file using a pooled handle.
+        """
+        source, xstart, ystart, xsize, ysize, buf_xsize, buf_ysize = args
+        fname, layer = source
+
+        with self._handles.handle(fname) as ds:
+            band = ds.GetRasterBand(layer)
+            subset = band.ReadAsArray(xstart, ystart, xsize, ysize,
+                                      buf_xsize, buf_ysize)
+            band = None
+
+        return subset
+
+    def _read_block(self, raster_band, yblock, xblock):
+        """
+        Read a single image block, via the block cache.
+        """
+        key = (raster_band, yblock, xblock)
+        block = self._cache.get(key)
+        if block is not None:
+            return block
+
+        xstart = xblock * self.block_xsize
+        ystart = yblock * self.block_ysize
+        xsize = min(self.block_xsize, self.samples - xstart)
+        ysize = min(self.block_ysize, self.lines - ystart)
+
+        args = (self._sources[raster_band - 1], xstart, ystart, xsize, ysize,
+                None, None)
+        block = self._read_source(args)
+
+        self._cache.put(key, block)
+
+        return block
+
+    def _read_tile(self, tile, raster_bands=1, decimation=1):
+        """
+        Read an x & y block; see `StackedDataset.read_tile`.
+        """
+        ystart = int(tile[0][0])
+        yend = int(tile[0][1])
+        xstart = int(tile[1][0])
+        xend = int(tile[1][1])
+        xsize = int(xend - xstart)
+        ysize = int(yend - ystart)
+
+        sequence = isinstance(raster_bands, collections.Sequence)
+        bands = raster_bands if sequence else [raster_bands]
+
+        if decimation > 1:
+            buf_xsize = (xsize + decimation - 1) // decimation
+            buf_ysize = (ysize + decimation - 1) // decimation
+            subset = self._read_sources(xstart, ystart, xsize, ysize, bands,
+                                        buf_xsize, buf_ysize)
+        elif (sequence and self._time_major is not None and
+                self._time_major.has_bands(raster_bands)):
+            return self._time_major.read_tile(tile, raster_bands)
+        elif self._cache is not None:
+            subset = self._read_cached(xstart, ystart, xsize, ysize, bands)
+        else:
+            subset = self._read_sources(xstart, ystart, xsize, ysize, bands)
+
+        if sequence:
+            return subset
+        return subset[0]
+
+    def _read_tile_all_rasters(self, tile):
+        """
+        See `StackedDataset.read_tile_all_rasters`.
+        """
+        subset = self._read_tile(tile, list(range(1, self.bands + 1)))
+        if self.bands == 1:
+            subset = subset[0]
+        return subset
+
+    def _read_raster_band(self, raster_band=1, decimation=1):
+        """
+        See `StackedDataset.read_raster_band`.
+        """
+        tile = ((0, self.lines), (0, self.samples))
+        return self._read_tile(tile, raster_band, decimation)
+
+    def get_raster_band_metadata(self, raster_band=1):
+        """
+        Retrieves the metadata for a given raster band, following the
+        conventions of stacker.py.
+
+        :param raster_band:
+            The band index of interest. Default is the first band.
+
+        :return:
+            A dictionary containing the tile_pathname, tile_layer and,
+            if datetimes were given, the start_datetime.
+        """
+        fname, layer = self._sources[raster_band - 1]
+        metadata = {'tile_pathname': fname,
+                    'tile_layer': str(layer)}
+        if self.datetimes is not None:
+            dt = self.datetimes[raster_band - 1]
+            metadata['start_datetime'] = dt.strftime("%Y-%m-%d %H:%M:%S.%f")
+        return metadata
+
+    def get_raster_band_datetime(self, raster_band=1):
+        """
+        Retrieves the datetime for a given raster band index.
+
+        :param raster_band:
+            The raster band interest. Default is the first raster band.
+
+        :return:
+            A Python datetime object, or None if no datetimes were given.
+        """
+        if self.datetimes is None:
+            return None
+        return self.datetimes[raster_band - 1]
+
+    def clear_cache(self):
+        """
+        Remove every block from the block cache and close the idle
+        file handles.
+        """
+        StackedDataset.clear_cache(self)
+        self._handles.clear()
@@ -0,0 +1,776 @@
+#!/usr/bin/env python
+
+# ===============================================================================
+# Copyright 2015 Geoscience Australia
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+"""
+A lazy, sliceable array facade over a `StackedDataset`.
+
+Slicing and arithmetic build a deferred expression graph. Nothing is
+read until the expression is evaluated, at which point it is evaluated
+block by block (in parallel), such that only the final result, and
+never the whole stack, is held in memory.
+
+Example:
+
+    >>> ds = StackedDataset('FC_144_-035_BS.vrt')
+    >>> # No data is read here
+    >>> ndvi = (ds[4] - ds[3]) / (ds[4] + ds[3])
+    >>> subset = ds[0:10, 100:200, 300:400]
+    >>> subset.shape
+    (10, 100, 100)
+    >>> # The mean over the bands, evaluated block by block
+    >>> mean = ds[:, 0:2000, 0:2000].astype('float32').mean(axis=0)
+    >>> img = mean.compute(workers=4)
+    >>> # Or stream the result to disk
+    >>> mean.to_file('mean_image', workers=4)
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from functools import partial
+import numbers
+import operator
+from multiprocessing.pool import ThreadPool
+import numpy
+from osgeo import gdal
+from osgeo import gdal_array
+from eotools.geobox import GriddedGeoBox
+from eotools.tiling import generate_tiles
+from eotools.tiling import split_tile
+from eotools.processing import map_tiles
+from eotools.processing import OutputSpec
+
+# Default target size (bytes) of the blocks evaluated by each worker
+BLOCK_BYTES = 2**26
+
+
+def _identity(array):
+    """
+    Return the input; the function applied by `LazyArray.to_file`.
+    """
+    return array
+
+
+def _gdal_dtype(dtype):
+    """
+    The GDAL datatype used to write a NumPy datatype.
+    """
+    if dtype == numpy.bool_:
+        return gdal.GDT_Byte
+
+    gdal_dtype = gdal_array.NumericTypeCodeToGDALTypeCode(dtype.type)
+    if gdal_dtype is None:
+        msg = "The datatype {} has no GDAL equivalent; specify dtype"
+        raise TypeError(msg.format(dtype.name))
+
+    return gdal_dtype
+
+
+def _astype(array, dtype):
+    """
+    Cast a block to `dtype`; the function applied by `LazyArray.astype`.
+    """
+    return array.astype(dtype)
+
+
+def _broadcast_shapes(shapes):
+    """
+    Determine the broadcast shape of the lazy operands. The spatial
+    dimensions must match, while a 2D operand is broadcast across
+    the bands of a 3D operand.
+    """
+    spatial = set(shape[-2:] for shape in shapes)
+    if len(spatial) > 1:
+        msg = "Operands have differing spatial dimensions: {}"
+        raise ValueError(msg.format(sorted(spatial)))
+
+    bands = set(shape[0] for shape in shapes if len(shape) == 3)
+    bands.discard(1)
+    if len(bands) > 1:
+        msg = "Operands have differing numbers of bands: {}"
+        raise ValueError(msg.format(sorted(bands)))
+
+    shape = shapes[0][-2:]
+    if any(len(s) == 3 for s in shapes):
+        nb = bands.pop() if bands else 1
+        shape = (nb,) + shape
+
+    return shape
+
+
+def _slice_range(key, size, axis):
+    """
+    Convert a basic slice of a spatial axis to a (start, stop) tuple.
+    """
+    if not isinstance(key, slice):
+        msg = ("Only slices are supported for the {} axis, "
+               "received {}").format(axis, type(key))
+        raise IndexError(msg)
+
+    start, stop, step = key.indices(size)
+    if step != 1:
+        msg = "Strided slices are not supported for the {} axis"
+        raise IndexError(msg.format(axis))
+    if stop <= start:
+        msg = "Empty slice for the {} axis: {}".format(axis, key)
+        raise IndexError(msg)
+
+    return start, stop
+
+
+def _band_selection(key, size):
+    """
+    Convert an index of the band axis to a list of band positions and
+    a flag indicating whether the band axis is dropped.
+    """
+    if isinstance(key, numbers.Integral):
+        index = int(key)
+        if index < 0:
+            index += size
+        if not 0 <= index < size:
+            raise IndexError("Band index {} out of range".format(key))
+        return [index], True
+
+    if isinstance(key, slice):
+        selection = list(range(*key.indices(size)))
+    else:
+        key = numpy.asarray(key)
+        if key.dtype == bool:
+            key = numpy.nonzero(key)[0]
+        selection = [int(i) + size if i < 0 else int(i) for i in key]
+
+    if len(selection) == 0:
+        raise IndexError("Empty band selection: {}".format(key))
+
+    return selection, False
+
+
+class LazyArray(object):
+
+    """
+    The base class of the deferred expression graph. Each node has a
+    shape of either (bands, lines, samples) or (lines, samples), and
+    evaluates any spatial window of itself on request.
+    """
+
+    # Ensures numpy defers to the reflected operators
+    __array_priority__ = 100.0
+
+    def __init__(self, shape, geotransform, projection, dtype=None):
+        self.shape = tuple(shape)
+        self.geotransform = geotransform
+        self.projection = projection
+        self._dtype = None if dtype is None else numpy.dtype(dtype)
+
+    def __repr__(self):
+        return '{}(shape={})'.format(self.__class__.__name__, self.shape)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def bands(self):
+        return self.shape[0] if self.ndim == 3 else 1
+
+    @property
+    def lines(self):
+        return self.shape[-2]
+
+    @property
+    def samples(self):
+        return self.shape[-1]
+
+    @property
+    def tiles(self):
+        return self._default_tiles()
+
+    @property
+    def dtype(self):
+        """
+        The datatype of the evaluated array, determined by evaluating
+        a single pixel if it can't be inferred.
+        """
+        if self._dtype is None:
+            self._dtype = self._evaluate(0, 1, 0, 1).dtype
+        return self._dtype
+
+    def _evaluate(self, ystart, yend, xstart, xend):
+        """
+        Evaluate the spatial window ((ystart, yend), (xstart, xend)).
+        """
+        raise NotImplementedError
+
+    def _pixel_bytes(self):
+        """
+        The bytes held per pixel while evaluating this node; the
+        larger of its own result and the sum of the nodes it reads.
+        """
+        itemsize = 8 if self._dtype is None else self._dtype.itemsize
+        return max(self.bands * itemsize,
+                   sum(node._pixel_bytes() for node in self._inputs()))
+
+    def _inputs(self):
+        """
+        The lazy arrays evaluated by this node.
+        """
+        return []
+
+    def get_geobox(self):
+        """
+        Return the GriddedGeoBox enclosing the array.
+        """
+        geobox = GriddedGeoBox(shape=(self.lines, self.samples),
+                               origin=(self.geotransform[0],
+                                       self.geotransform[3]),
+                               pixelsize=(abs(self.geotransform[1]),
+                                          abs(self.geotransform[5])),
+                               crs=self.projection)
+        return geobox
+
+    def read_tile(self, tile, raster_bands=None):
+        """
+        Evaluate an x & y block specified by tile, of the form
+        ((ystart, yend), (xstart, xend)), or the read window of a
+        (read_window, core_window) pair.
+
+        :param raster_bands:
+            An optional list of (one based) bands to return.
+            Default is all bands.
+        """
+        (ystart, yend), (xstart, xend) = split_tile(tile)[0]
+        block = self._evaluate(int(ystart), int(yend), int(xstart),
+                               int(xend))
+        if raster_bands is not None and self.ndim == 3:
+            if list(raster_bands) != list(range(1, self.bands + 1)):
+                block = block[numpy.array(raster_bands) - 1]
+
+        return block
+
+    def _subset_geotransform(self, ystart, xstart):
+        """
+        The geotransform of a spatial subset starting at (ystart, xstart).
+        """
+        gt = self.geotransform
+        if gt is None:
+            return None
+        return (gt[0] + xstart * gt[1] + ystart * gt[2], gt[1], gt[2],
+                gt[3] + xstart * gt[4] + ystart * gt[5], gt[4], gt[5])
+
+    def _parse_key(self, key):
+        """
+        Convert an index into a band selection, a band drop flag and
+        the (start, stop) ranges of the y and x axes.
+        """
+        if not isinstance(key, tuple):
+            key = (key,)
+
+        if any(k is Ellipsis for k in key):
+            i = [k is Ellipsis for k in key].index(True)
+            fill = (slice(None),) * (self.ndim - len(key) + 1)
+            key = key[:i] + fill + key[i + 1:]
+
+        if len(key) > self.ndim:
+            raise IndexError("Too many indices for a {}D array".format(
+                self.ndim))
+        key = key + (slice(None),) * (self.ndim - len(key))
+
+        if self.ndim == 3:
+            selection, drop = _band_selection(key[0], self.bands)
+            key = key[1:]
+        else:
+            selection, drop = None, False
+
+        yrange = _slice_range(key[0], self.lines, 'y')
+        xrange = _slice_range(key[1], self.samples, 'x')
+
+        return selection, drop, yrange, xrange
+
+    def __getitem__(self, key):
+        selection, drop, yrange, xrange = self._parse_key(key)
+        return Subset(self, selection, drop, yrange, xrange)
+
+    def __array__(self, dtype=None):
+        array = self.compute()
+        if dtype is not None:
+            array = array.astype(dtype)
+        return array
+
+    # Elementwise operations
+
+    def _binary(self, func, other, reflect=False):
+        if isinstance(other, numpy.ndarray):
+            # Applied to every block as is, so it can't vary spatially,
+            # eg per band constants of shape (bands, 1, 1)
+            if other.ndim > 3 or any(n != 1 for n in other.shape[-2:]):
+                msg = ("Array operands must have at most 3 dimensions and "
+                       "a size of 1 along the y and x axes, not a shape "
+                       "of {}")
+                raise ValueError(msg.format(other.shape))
+        elif not isinstance(other, (LazyArray, numbers.Number,
+                                    numpy.generic)):
+            return NotImplemented
+        args = [other, self] if reflect else [self, other]
+        return Elementwise(func, args)
+
+    def __add__(self, other):
+        return self._binary(operator.add, other)
+
+    def __radd__(self, other):
+        return self._binary(operator.add, other, True)
+
+    def __sub__(self, other):
+        return self._binary(operator.sub, other)
+
+    def __rsub__(self, other):
+        return self._binary(operator.sub, other, True)
+
+    def __mul__(self, other):
+        return self._binary(operator.mul, other)
+
+    def __rmul__(self, other):
+        return self._binary(operator.mul, other, True)
+
+    def __truediv__(self, other):
+        return self._binary(operator.truediv, other)
+
+    def __rtruediv__(self, other):
+        return self._binary(operator.truediv, other, True)
+
+    __div__ = __truediv__
+    __rdiv__ = __rtruediv__
+
+    def __pow__(self, other):
+        return self._binary(operator.pow, other)
+
+    def __lt__(self, other):
+        return self._binary(operator.lt, other)
+
+    def __le__(self, other):
+        return self._binary(operator.le, other)
+
+    def __gt__(self, other):
+        return self._binary(operator.gt, other)
+
+    def __ge__(self, other):
+        return self._binary(operator.ge, other)
+
+    def __eq__(self, other):
+        return self._binary(operator.eq, other)
+
+    def __ne__(self, other):
+        return self._binary(operator.ne, other)
+
+    def __and__(self, other):
+        return self._binary(operator.and_, other)
+
+    def __or__(self, other):
+        return self._binary(operator.or_, other)
+
+    __hash__ = object.__hash__
+
+    def __neg__(self):
+        return Elementwise(operator.neg, [self])
+
+    def __abs__(self):
+        return Elementwise(numpy.abs, [self])
+
+    def __invert__(self):
+        return Elementwise(operator.invert, [self])
+
+    def astype(self, dtype):
+        """
+        Cast the array to `dtype`.
+        """
+        return Elementwise(partial(_astype, dtype=dtype), [self],
+                           dtype=dtype)
+
+    def map_blocks(self, func, dtype=None):
+        """
+        Apply an arbitrary elementwise function to each block.
+        The function must not change the shape of the block.
+        """
+        return Elementwise(func, [self], dtype=dtype)
+
+    # Reductions
+
+    def _reduce(self, name, axis, workers):
+        if axis is None:
+            return self._reduce_all(name, workers)
+        if axis != 0 or self.ndim != 3:
+            msg = "Reductions are only supported over the band axis (0)"
+            raise ValueError(msg)
+        return BandReduction(getattr(numpy, name), self)
+
+    def sum(self, axis=None, workers=1):
+        """
+        Sum over the band axis (axis=0; lazy) or all axes (axis=None;
+        evaluated immediately).
+        """
+        return self._reduce('sum', axis, workers)
+
+    def mean(self, axis=None, workers=1):
+        """
+        Mean over the band axis (axis=0; lazy) or all axes (axis=None;
+        evaluated immediately).
+        """
+        return self._reduce('mean', axis, workers)
+
+    def min(self, axis=None, workers=1):
+        """
+        Minimum over the band axis (axis=0; lazy) or all axes
+        (axis=None; evaluated immediately).
+        """
+        return self._reduce('min', axis, workers)
+
+    def max(self, axis=None, workers=1):
+        """
+        Maximum over the band axis (axis=0; lazy) or all axes
+        (axis=None; evaluated immediately).
+        """
+        return self._reduce('max', axis, workers)
+
+    def nansum(self, axis=None, workers=1):
+        """
+        As per `sum`, ignoring NaN's.
+        """
+        return self._reduce('nansum', axis, workers)
+
+    def nanmean(self, axis=None, workers=1):
+        """
+        As per `mean`, ignoring NaN's.
+        """
+        return self._reduce('nanmean', axis, workers)
+
+    def nanmin(self, axis=None, workers=1):
+        """
+        As per `min`, ignoring NaN's.
+        """
+        return self._reduce('nanmin', axis, workers)
+
+    def nanmax(self, axis=None, workers=1):
+        """
+        As per `max`, ignoring NaN's.
+        """
+        return self._reduce('nanmax', axis, workers)
+
+    def _reduce_all(self, name, workers):
+        """
+        Reduce over all axes by combining per block partial results.
+        """
+        def partial_result(tile):
+            block = self.read_tile(tile)
+            if name in ['mean', 'nanmean']:
+                count = block.size
+                if name == 'nanmean':
+                    count = numpy.count_nonzero(~numpy.isnan(block))
+                func = numpy.nansum if name == 'nanmean' else numpy.sum
+                return func(block, dtype='float64'), count
+            return getattr(numpy, name)(block), block.size
+
+        partials = self._blockwise(partial_result, self._default_tiles(),
+                                   workers)
+        values = [p[0] for p in partials]
+
+        if name in ['mean', 'nanmean']:
+            count = sum(p[1] for p in partials)
+            return sum(values) / count if count else numpy.nan
+        if name in ['sum', 'nansum']:
+            return numpy.sum(values)
+        return getattr(numpy, name)(values)
+
+    # Evaluation
+
+    def _default_tiles(self, xtile=None, ytile=None):
+        """
+        Tiles spanning the full width, with enough lines to give
+        blocks of approximately `BLOCK_BYTES`. The blocks are sized
+        from the widest read or intermediate in the graph, not the
+        result, such that eg a band reduction doesn't read every band
+        over a block sized for a single band.
+        """
+        if xtile is None:
+            xtile = self.samples
+        if ytile is None:
+            row_bytes = self._pixel_bytes() * xtile
+            ytile = max(1, BLOCK_BYTES // row_bytes)
+        return generate_tiles(self.samples, self.lines, xtile, ytile,
+                              generator=False)
+
+    @staticmethod
+    def _blockwise(func, tiles, workers):
+        """
+        Apply `func` to every tile, in parallel if `workers` > 1.
+        """
+        if workers <= 1:
+            return [func(tile) for tile in tiles]
+
+        pool = ThreadPool(workers)
+        try:
+            results = pool.map(func, tiles, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+        return results
+
+    def compute(self, xtile=None, ytile=None, workers=1):
+        """
+        Evaluate the expression block by block and return the result
+        as a NumPy array.
+
+        :param xtile:
+            The block size in the x-direction. Default is the number
+            of samples.
+
+        :param ytile:
+            The block size in the y-direction. Default is determined
+            from the number of samples and bands.
+
+        :param workers:
+            The number of threads used to evaluate the blocks.
+            Default is 1.
+        """
+        result = numpy.empty(self.shape, dtype=self.dtype)
+
+        def evaluate(tile):
+            (ystart, yend), (xstart, xend) = tile
+            result[..., ystart:yend, xstart:xend] = self.read_tile(tile)
+
+        self._blockwise(evaluate, self._default_tiles(xtile, ytile),
+                        workers)
+
+        return result
+
+    def to_file(self, out_fname, fmt="ENVI", dtype=None, nodata=None,
+                xtile=None, ytile=None, workers=1):
+        """
+        Evaluate the expression block by block and stream the result
+        to disk, without materialising it in memory.
+
+        :param out_fname:
+            A string containing the full filepath name of the output.
+
+        :param fmt:
+            A GDAL compliant file format. Default is ENVI.
+
+        :param dtype:
+            The GDAL datatype of the output. Default is determined from
+            the datatype of the expression, with boolean results (eg
+            comparisons and `where` conditions) written as GDT_Byte.
+
+        :param nodata:
+            The no data value for the output.
+
+        :param xtile:
+            The block size in the x-direction. Default is the number
+            of samples.
+
+        :param ytile:
+            The block size in the y-direction. Default is determined
+            from the number of samples and bands.
+
+        :param workers:
+            The number of threads used to evaluate the blocks.
+            Default is 1.
+
+        :return:
+            The timing summary from `map_tiles`.
+        """
+        if dtype is None:
+            dtype = _gdal_dtype(self.dtype)
+
+        spec = OutputSpec(out_fname, bands=self.bands, dtype=dtype,
+                          nodata=nodata, fmt=fmt)
+
+        return map_tiles(_identity, (self, None), spec, workers=workers,
+                         tiles=self._default_tiles(xtile, ytile))
+
+
+class StackView(LazyArray):
+
+    def __init__(self, stacked_dataset, raster_bands=None, yrange=None,
+                 xrange=None, drop_band=False):
+        """
+        A lazy view of a subset of a `StackedDataset`. Band selection
+        and spatial subsets are applied to the read itself, such that
+        only the data required is read.
+
+        :param stacked_dataset:
+            An instance of a `StackedDataset`.
+
+        :param raster_bands:
+            A list of (one based) raster bands. Default is all bands.
+
+        :param yrange:
+            A (ystart, yend) tuple. Default is all lines.
+
+        :param xrange:
+            A (xstart, xend) tuple. Default is all samples.
+
+        :param drop_band:
+            If set to True, the view is 2D and `raster_bands` must
+            contain a single raster band.
+        """
+        ds = stacked_dataset
+        if raster_bands is None:
+            raster_bands = list(range(1, ds.bands + 1))
+        if yrange is None:
+            yrange = (0, ds.lines)
+        if xrange is None:
+            xrange = (0, ds.samples)
+
+        self.stacked_dataset = ds
+        self.raster_bands = list(raster_bands)
+        self.yrange = yrange
+        self.xrange = xrange
+        self.drop_band = drop_band
+
+        shape = (yrange[1] - yrange[0], xrange[1] - xrange[0])
+        if not drop_band:
+            shape = (len(self.raster_bands),) + shape
+
+        super(StackView, self).__init__(shape, ds.geotransform,
+                                        ds.projection, dtype=ds.dtype)
+        self.geotransform = self._subset_geotransform(yrange[0], xrange[0])
+
+    def _evaluate(self, ystart, yend, xstart, xend):
+        y0 = self.yrange[0]
+        x0 = self.xrange[0]
+        tile = ((y0 + ystart, y0 + yend), (x0 + xstart, x0 + xend))
+        if self.drop_band:
+            return self.stacked_dataset.read_tile(tile,
+                                                  self.raster_bands[0])
+        return self.stacked_dataset.read_tile(tile, self.raster_bands)
+
+    def _pixel_bytes(self):
+        return self.bands * self._dtype.itemsize
+
+    def __getitem__(self, key):
+        # Push the subset down into the read
+        selection, drop, yrange, xrange = self._parse_key(key)
+        y0 = self.yrange[0]
+        x0 = self.xrange[0]
+        if selection is None:
+            raster_bands = self.raster_bands
+            drop = True
+        else:
+            raster_bands = [self.raster_bands[i] for i in selection]
+
+        return StackView(self.stacked_dataset, raster_bands,
+                         (y0 + yrange[0], y0 + yrange[1]),
+                         (x0 + xrange[0], x0 + xrange[1]), drop)
+
+
+class Subset(LazyArray):
+
+    def __init__(self, array, selection, drop_band, yrange, xrange):
+        """
+        A band selection and spatial subset of a lazy expression.
+        """
+        self.array = array
+        self.selection = selection
+        self.drop_band = drop_band
+        self.yrange = yrange
+        self.xrange = xrange
+
+        shape = (yrange[1] - yrange[0], xrange[1] - xrange[0])
+        if selection is not None and not drop_band:
+            shape = (len(selection),) + shape
+
+        super(Subset, self).__init__(shape, array.geotransform,
+                                     array.projection, dtype=array._dtype)
+        self.geotransform = array._subset_geotransform(yrange[0], xrange[0])
+
+    def _evaluate(self, ystart, yend, xstart, xend):
+        y0 = self.yrange[0]
+        x0 = self.xrange[0]
+        block = self.array._evaluate(y0 + ystart, y0 + yend, x0 + xstart,
+                                     x0 + xend)
+        if self.selection is None:
+            return block
+        if self.drop_band:
+            return block[self.selection[0]]
+        return block[self.selection]
+
+    def _inputs(self):
+        return [self.array]
+
+
+class Elementwise(LazyArray):
+
+    def __init__(self, func, args, dtype=None):
+        """
+        An elementwise function of lazy arrays, scalars and spatially
+        constant arrays.
+        """
+        lazy = [a for a in args if isinstance(a, LazyArray)]
+        shapes = [a.shape for a in lazy]
+
+        # A constant array may add a band axis, eg of shape (bands, 1, 1)
+        spatial = lazy[0].shape[-2:]
+        shapes.extend(a.shape[:1] + spatial for a in args
+                      if isinstance(a, numpy.ndarray) and a.ndim == 3)
+        shape = _broadcast_shapes(shapes)
+
+        self.func = func
+        self.args = args
+
+        super(Elementwise, self).__init__(shape, lazy[0].geotransform,
+                                          lazy[0].projection, dtype=dtype)
+
+    def _evaluate(self, ystart, yend, xstart, xend):
+        args = []
+        for arg in self.args:
+            if isinstance(arg, LazyArray):
+                arg = arg._evaluate(ystart, yend, xstart, xend)
+            args.append(arg)
+
+        return self.func(*args)
+
+    def _inputs(self):
+        return [a for a in self.args if isinstance(a, LazyArray)]
+
+
+class BandReduction(LazyArray):
+
+    def __init__(self, func, array):
+        """
+        A reduction over the band axis of a 3D lazy array.
+        """
+        self.func = partial(func, axis=0)
+        self.array = array
+
+        super(BandReduction, self).__init__(array.shape[1:],
+                                            array.geotransform,
+                                            array.projection)
+
+    def _evaluate(self, ystart, yend, xstart, xend):
+        block = self.array._evaluate(ystart, yend, xstart, xend)
+        return self.func(block)
+
+    def _inputs(self):
+        return [self.array]
+
+
+def where(condition, x, y):
+    """
+    Lazily select elements from `x` or `y` depending on `condition`.
+    Any of the arguments may be scalars, but at least one must be a
+    `LazyArray`.
+    """
+    return Elementwise(numpy.where, [condition, x, y])
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+
+# ===============================================================================
+# Copyright 2015 Geoscience Australia
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+"""
+Helpers for accessing raw binary rasters (ENVI, ESRI BSQ/BIL/BIP)
+directly as `numpy.memmap` arrays, bypassing GDAL's decode and copy.
+"""
+
+from __future__ import absolute_import
+import os
+import numpy
+
+# GDAL drivers whose files are plain raw binary plus a text header
+RAW_DRIVERS = ['ENVI', 'EHdr']
+
+
+def read_envi_header(hdr_fname):
+    """
+    Parse an ENVI header file into a dictionary.
+
+    :param hdr_fname:
+        A string containing the full file path name of the ENVI
+        header file.
+
+    :return:
+        A dictionary with lowercase keys and string values. Values
+        enclosed in braces are returned with the braces removed.
+    """
+    with open(hdr_fname, 'r') as src:
+        lines = src.read().splitlines()
+
+    header = {}
+    key = None
+    value = None
+    for line in lines[1:]:
+        if key is not None:
+            # Continuation of a multi-line {} value
+            value = value + '\n' + line
+            if '}' in line:
+                header[key] = value.strip().strip('{}').strip()
+                key = None
+            continue
+
+        if '=' not in line:
+            continue
+
+        name, val = line.split('=', 1)
+        name = name.strip().lower()
+        val = val.strip()
+        if val.startswith('{') and '}' not in val:
+            key = name
+            value = val
+        else:
+            header[name] = val.strip('{}').strip()
+
+    return header
+
+
+def read_ehdr_header(hdr_fname):
+    """
+    Parse an ESRI (EHdr) header file into a dictionary.
+
+    :param hdr_fname:
+        A string containing the full file path name of the ESRI
+        header file.
+
+    :return:
+        A dictionary with uppercase keys and string values.
+    """
+    header = {}
+    with open(hdr_fname, 'r') as src:
+        for line in src:
+            items = line.split()
+            if len(items) >= 2:
+                header[items[0].upper()] = items[1]
+
+    return header
+
+
+def _find_header(file_list):
+    """
+    Find the header file within a GDAL dataset file list.
+    """
+    for fname in file_list[1:]:
+        if os.path.splitext(fname)[1].lower() == '.hdr':
+            return fname
+    return None
+
+
+def raw_layout(ds, dtype):
+    """
+    Determine whether an open GDAL dataset is a raw, tightly packed
+    binary raster that can be memory mapped, and if so describe the
+    on-disk layout.
+
+    :param ds:
+        An open GDAL dataset.
+
+    :param dtype:
+        The NumPy datatype name (eg 'int16') of the raster bands.
+
+    :return:
+        A dictionary with the keys fname, offset, dtype, interleave,
+        bands, lines and samples; or None if the dataset cannot be
+        memory mapped (eg a non-raw driver, padded rows, or an
+        unsupported header).
+    """
+    driver = ds.GetDriver().ShortName
+    if driver not in RAW_DRIVERS:
+        return None
+
+    file_list = ds.GetFileList()
+    if not file_list:
+        return None
+
+    fname = file_list[0]
+    hdr_fname = _find_header(file_list)
+    if hdr_fname is None:
+        return None
+
+    if driver == 'ENVI':
+        header = read_envi_header(hdr_fname)
+        offset = int(header.get('header offset', 0))
+        big_endian = header.get('byte order', '0') == '1'
+        interleave = header.get('interleave', 'bsq').lower()
+    else:
+        header = read_ehdr_header(hdr_fname)
+        offset = int(header.get('SKIPBYTES', 0))
+        big_endian = header.get('BYTEORDER', 'I').upper() in ['M', 'B']
+        interleave = header.get('LAYOUT', 'BIL').lower()
+
+        # Padded rows or band gaps can't be expressed as a simple memmap
+        for key in ['BANDROWBYTES', 'TOTALROWBYTES', 'BANDGAPBYTES']:
+            if key in header:
+                return None
+
+    if interleave not in ['bsq', 'bil', 'bip']:
+        return None
+
+    dtype = numpy.dtype(dtype).newbyteorder('>' if big_endian else '<')
+
+    bands = ds.RasterCount
+    lines = ds.RasterYSize
+    samples = ds.RasterXSize
+
+    # Ensure the file holds all the data we expect (no compression etc)
+    nbytes = bands * lines * samples * dtype.itemsize
+    if not os.path.exists(fname) or os.path.getsize(fname) < offset + nbytes:
+        return None
+
+    layout = {'fname': fname,
+              'offset': offset,
+              'dtype': dtype,
+              'interleave': interleave,
+              'bands': bands,
+              'lines': lines,
+              'samples': samples}
+
+    return layout
+
+
+def open_memmap(layout, mode='r'):
+    """
+    Open a raw raster described by `layout` as a 3D `numpy.memmap`
+    with the dimensions [bands, lines, samples] regardless of the
+    interleave on disk.
+
+    :param layout:
+        A dictionary as returned by `raw_layout`.
+
+    :param mode:
+        The `numpy.memmap` access mode. Default is 'r' (read only),
+        such that any attempt to modify the views raises an error
+        rather than altering the data seen by later reads.
+
+    :return:
+        A `numpy.memmap` view of the file with dimensions
+        [bands, lines, samples].
+    """
+    bands = layout['bands']
+    lines = layout['lines']
+    samples = layout['samples']
+    interleave = layout['interleave']
+
+    if interleave == 'bsq':
+        shape = (bands, lines, samples)
+        axes = (0, 1, 2)
+    elif interleave == 'bil':
+        shape = (lines, bands, samples)
+        axes = (1, 0, 2)
+    else:
+        shape = (lines, samples, bands)
+        axes = (2, 0, 1)
+
+    array = numpy.memmap(layout['fname'], dtype=layout['dtype'], mode=mode,
+                         offset=layout['offset'], shape=shape)
+
+    return array.transpose(axes)
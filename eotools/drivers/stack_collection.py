@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+
+# ===============================================================================
+# Copyright 2015 Geoscience Australia
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+from __future__ import absolute_import
+from multiprocessing.pool import ThreadPool
+import numpy
+from eotools.tiling import TileIndex
+from eotools.drivers.stacked_dataset import StackedDataset
+
+
+class StackCollection(object):
+
+    """
+    Groups several `StackedDataset`s that share the same grid and
+    number of raster bands, eg one temporal stack per spectral band,
+    and reads them as a single [spectral, time, y, x] array. The
+    member stacks are read concurrently.
+
+    Example:
+
+        >>> fnames = ['B1.vrt', 'B2.vrt', 'B3.vrt', 'B4.vrt', 'B5.vrt',
+        ...           'B7.vrt']
+        >>> stacks = StackCollection(fnames)
+        >>> stacks.init_tiling(400, 400)
+        >>> # All time slices for all spectral bands
+        >>> img = stacks.read_tile(stacks.get_tile(0))
+        >>> img.shape
+        (6, 22, 400, 400)
+        >>> # A single time slice (the 10th raster band)
+        >>> img = stacks.read_time_slice(stacks.get_tile(0), 10)
+        >>> img.shape
+        (6, 400, 400)
+    """
+
+    def __init__(self, stacks, names=None, workers=None):
+        """
+        Initialise the collection and validate the alignment of the
+        member stacks.
+
+        :param stacks:
+            A list of `StackedDataset`s, or of file path names from
+            which to create them.
+
+        :param names:
+            An optional list of names, eg the spectral band names,
+            one for each stack.
+
+        :param workers:
+            The number of threads used to read the member stacks.
+            Default is one per stack.
+        """
+        stacks = [s if isinstance(s, StackedDataset) else StackedDataset(s)
+                  for s in stacks]
+
+        if len(stacks) == 0:
+            raise ValueError("A StackCollection requires at least one stack")
+
+        if names is None:
+            names = [s.fname for s in stacks]
+        if len(names) != len(stacks):
+            msg = "Received {} names for {} stacks"
+            raise ValueError(msg.format(len(names), len(stacks)))
+
+        self.stacks = stacks
+        self.names = list(names)
+        self.workers = len(stacks) if workers is None else workers
+
+        first = stacks[0]
+        self.bands = first.bands
+        self.samples = first.samples
+        self.lines = first.lines
+        self.geotransform = first.geotransform
+        self.projection = first.projection
+        self.no_data = [s.no_data for s in stacks]
+
+        self._validate()
+
+        self.tiles = [None]
+        self.n_tiles = 0
+        self.init_tiling()
+
+        self._pool = None
+
+    def __len__(self):
+        return len(self.stacks)
+
+    def __getstate__(self):
+        """
+        Exclude the thread pool when pickling.
+        """
+        state = self.__dict__.copy()
+        state['_pool'] = None
+        return state
+
+    def _validate(self):
+        """
+        Ensure every stack shares the same grid and number of bands.
+        """
+        geobox = self.stacks[0].get_geobox()
+        for name, stack in zip(self.names[1:], self.stacks[1:]):
+            if not geobox.equals(stack.get_geobox()):
+                msg = "Stack {} is not aligned with stack {}: {} vs {}"
+                msg = msg.format(name, self.names[0], stack.get_geobox(),
+                                 geobox)
+                raise ValueError(msg)
+            if stack.bands != self.bands:
+                msg = "Stack {} has {} raster bands, expected {}"
+                raise ValueError(msg.format(name, stack.bands, self.bands))
+
+    def get_geobox(self):
+        """
+        Return the GriddedGeoBox shared by the member stacks.
+        """
+        return self.stacks[0].get_geobox()
+
+    def init_tiling(self, xsize=None, ysize=None):
+        """
+        Sets the tile indices for a 2D array.
+        See `StackedDataset.init_tiling`.
+        """
+        if xsize is None:
+            xsize = self.samples
+        if ysize is None:
+            ysize = 10
+        self.tiles = TileIndex.from_grid(self.samples, self.lines,
+                                         xtile=xsize, ytile=ysize)
+        self.n_tiles = len(self.tiles)
+
+    def get_tile(self, index=0):
+        """
+        Retrieves a tile given an index.
+        See `StackedDataset.get_tile`.
+        """
+        return self.tiles[index]
+
+    def _map(self, func):
+        """
+        Apply `func` to each member stack concurrently.
+        """
+        if self.workers <= 1 or len(self.stacks) == 1:
+            return [func(stack) for stack in self.stacks]
+
+        if self._pool is None:
+            self._pool = ThreadPool(self.workers)
+
+        return self._pool.map(func, self.stacks)
+
+    def read_tile(self, tile, raster_bands=None):
+        """
+        Read an x & y block specified by tile from each member stack.
+
+        :param tile:
+            A tuple containing the start and end array indices, of the
+            form ((ystart, yend), (xstart, xend)).
+
+        :param raster_bands:
+            A list containing the raster bands (time slices) to read.
+            Default is all raster bands.
+
+        :return:
+            A 4D NumPy array of [spectral, time, y, x].
+        """
+        if raster_bands is None:
+            raster_bands = list(range(1, self.bands + 1))
+        raster_bands = list(raster_bands)
+
+        subsets = self._map(lambda s: s.read_tile(tile, raster_bands))
+
+        return numpy.array(subsets)
+
+    def read_time_slice(self, tile, raster_band=1):
+        """
+        Read an x & y block specified by tile for a single raster band
+        (time slice) from each member stack.
+
+        :param tile:
+            A tuple containing the start and end array indices, of the
+            form ((ystart, yend), (xstart, xend)).
+
+        :param raster_band:
+            The raster band (time slice) to read. Default is 1.
+
+        :return:
+            A 3D NumPy array of [spectral, y, x].
+        """
+        subsets = self._map(lambda s: s.read_tile(tile, raster_band))
+
+        return numpy.array(subsets)
@@ -19,13 +19,33 @@
 from __future__ import absolute_import
 import collections
 from os.path import join as pjoin
+from os.path import dirname
+from os.path import isabs
 import datetime
+from functools import partial
+from multiprocessing.pool import ThreadPool
+import threading
 import numpy
 from osgeo import gdal
 from eotools.geobox import GriddedGeoBox
-from eotools.tiling import generate_tiles
-from eotools.tiling import TiledOutput
+from eotools.coordinates import convert_coordinates
+from eotools.tiling import TileIndex
+from eotools.tiling import decimated_index
+from eotools.tiling import split_tile
+from eotools.tiling import CoverageIndex
+from eotools.tiling import plan_tile_size
 from eotools.bulk_stats import bulk_stats
+from eotools.processing import map_tiles
+from eotools.processing import OutputSpec
+from eotools.instrumentation import NULL_STATS
+from eotools.chunked_store import ChunkedStore
+from eotools.chunked_store import CHUNKED_FORMAT
+from eotools.drivers.raw import raw_layout
+from eotools.drivers.raw import open_memmap
+from eotools.drivers.block_cache import BlockCache
+from eotools.drivers.time_major import build_time_major
+from eotools.drivers.time_major import TimeMajorDataset
+from eotools.drivers.lazy_array import StackView
 
 gdal_2_numpy_dtypes = {1: 'uint8',
                        2: 'uint16',
@@ -40,6 +60,44 @@ gdal_2_numpy_dtypes = {1: 'uint8',
                        11: 'complex128'}
 
 
+def band_runs(raster_bands):
+    """
+    Group a list of raster bands into runs of contiguous bands.
+
+    :param raster_bands:
+        A list of raster band numbers, in any order and possibly
+        containing duplicates.
+
+    :return:
+        A tuple (unique, inverse, runs), where `unique` is the sorted
+        list of distinct bands; `inverse` is a NumPy array such that
+        `unique[inverse]` reproduces `raster_bands`, or None if
+        `raster_bands` is already sorted and distinct; and `runs` is
+        a list of (index, first_band, count) tuples, where `index` is
+        the position of the run within `unique`.
+
+    Example:
+
+        >>> band_runs([7, 1, 2, 3, 8, 2])
+        ([1, 2, 3, 7, 8], array([3, 0, 1, 2, 4, 1]),
+         [(0, 1, 3), (3, 7, 2)])
+    """
+    bands = numpy.asarray(raster_bands, dtype='int')
+    unique, inverse = numpy.unique(bands, return_inverse=True)
+
+    if len(unique) == len(bands) and (unique == bands).all():
+        inverse = None
+
+    runs = []
+    start = 0
+    for i in range(1, len(unique) + 1):
+        if i == len(unique) or unique[i] != unique[i - 1] + 1:
+            runs.append((start, int(unique[start]), i - start))
+            start = i
+
+    return [int(b) for b in unique], inverse, runs
+
+
 class StackedDataset:
 
     """
@@ -51,6 +109,33 @@ class StackedDataset:
     when reading the image data.  Once the request has been made the file
     is closed.
 
+    Raw band sequential, band interleaved by line or band interleaved
+    by pixel files (ENVI or ESRI BSQ/BIL/BIP), such as those written by
+    `TiledOutput`, are detected and read directly from a read only
+    `numpy.memmap` rather than through GDAL. Every read returns a
+    copy, such that callers may modify the result.
+
+    For stacker.py VRTs, setting `source_threads` reads the requested
+    window directly from each band's source file (as recorded by the
+    tile_pathname metadata) using a pool of threads, rather than
+    sequentially through GDAL's VRT driver.
+
+    Setting `cache_size` enables a least recently used cache of
+    decoded image blocks, which serves repeated interactive reads such
+    as profiles from memory. See `cache_info` for the hit statistics.
+
+    A chunked, time-major copy of the stack can be built and attached
+    with `build_time_major` (or an existing one attached with
+    `attach_time_major`), after which multi-band reads such as
+    `profiles.z_profile` need only one contiguous read per pixel.
+
+    Indexing the dataset returns a lazy array (see
+    `eotools.drivers.lazy_array`), which supports numpy style slicing
+    and deferred, block-wise evaluation of array expressions:
+
+        >>> ndvi = (ds[3] - ds[2]) / (ds[3] + ds[2])
+        >>> subset = ds[0:10, 400:800, 0:400].compute()
+
     Example:
 
         >>> fname = 'FC_144_-035_BS.vrt'
@@ -116,21 +201,69 @@ class StackedDataset:
         (22, 400, 400)
     """
 
-    def __init__(self, filename):
+    # Per thread GDAL handles; see `use_thread_handles`
+    _thread_handles = None
+
+    def __init__(self, filename, memmap=True, source_threads=None,
+                 cache_size=None, cache_compress=False, stats=None):
         """
         Initialise the class structure.
 
         :param file:
             A string containing the full filepath of a GDAL compliant
             dataset created by stacker.py.
+
+        :param memmap:
+            If set to True (Default) and the dataset is a raw binary
+            file (eg ENVI), then reads are served from a
+            `numpy.memmap` of the file rather than via GDAL.
+
+        :param source_threads:
+            If set to an integer, then multi-band reads are served by
+            reading each band's source file directly using a pool of
+            `source_threads` threads, and the runs of contiguous bands
+            within non-contiguous band lists are read concurrently.
+            Default is None, whereby reads are made serially via GDAL's
+            VRT driver.
+
+        :param cache_size:
+            If set, then decoded image blocks are held in a least
+            recently used cache of at most `cache_size` bytes, such
+            that repeated or nearby reads are served from memory.
+            Ignored for memory mapped files. Default is None (no cache).
+
+        :param cache_compress:
+            If set to True, then the cached blocks are zlib compressed.
+            Default is False.
+
+        :param stats:
+            An optional instance of `eotools.instrumentation.IOStats`
+            used to record the counts, bytes and time of file opens
+            and reads. Default is None (no instrumentation).
         """
 
         self.fname = filename
+        self.stats = NULL_STATS if stats is None else stats
 
         # Open the dataset
-        ds = gdal.Open(filename)
+        ds = self._open()
+
+        self._init_from_dataset(ds, ds.RasterCount, 1, memmap,
+                                source_threads, cache_size, cache_compress)
 
-        self.bands = ds.RasterCount
+        # Close the dataset
+        ds = None
+
+    def _init_from_dataset(self, ds, bands, raster_band=1, memmap=True,
+                           source_threads=None, cache_size=None,
+                           cache_compress=False):
+        """
+        Initialise the dimensions, georeferencing, data type and read
+        backends from an open GDAL dataset `ds`, describing a stack of
+        `bands` raster bands that share the properties of `raster_band`.
+        See `__init__`.
+        """
+        self.bands = bands
         self.samples = ds.RasterXSize
         self.lines = ds.RasterYSize
 
@@ -143,13 +276,544 @@ class StackedDataset:
         self.init_tiling()
 
         # Get the no data value (assume the same value for all bands)
-        band = ds.GetRasterBand(1)
+        band = ds.GetRasterBand(raster_band)
         self.no_data = band.GetNoDataValue()
+        self.dtype = gdal_2_numpy_dtypes[band.DataType]
+        self.block_xsize, self.block_ysize = band.GetBlockSize()
+
+        # Detect whether we can bypass GDAL and memory map the file
+        self._memmap = None
+        self._memmap_layout = None
+        if memmap:
+            self._memmap_layout = raw_layout(ds, self.dtype)
+
+        # Source files are resolved upon the first parallel read
+        self.source_threads = source_threads
+        self._sources = None
+        self._pool = None
+
+        # Block cache and the handle used to fill it
+        self._cache = None
+        if cache_size and not self.memmapped:
+            self._cache = BlockCache(cache_size, compress=cache_compress)
+        self._handle = None
+        self._handle_lock = threading.Lock()
+
+        # An optional time-major cache serving multi-band reads
+        self._time_major = None
+
+        # Per thread GDAL handles, and the reader serving asyncio requests
+        self._thread_handles = None
+        self._async_reader = None
+
+        band = None
+
+    @classmethod
+    def from_files(cls, fnames, datetimes=None, raster_band=1, **kwargs):
+        """
+        Create an in-memory stack from a list of files, each providing
+        a single raster band, eg one GeoTIFF per acquisition date.
+        No VRT is required.
+
+        :param fnames:
+            A list of GDAL compliant file path names, in temporal order.
+
+        :param datetimes:
+            An optional list of `datetime.datetime` objects, one for
+            each file, used by the yearly iterator.
+
+        :param raster_band:
+            The raster band to read from each file. Default is 1.
+
+        :return:
+            An instance of `eotools.drivers.file_stack.FileStack`.
+            See `FileStack` for the remaining keyword arguments.
+        """
+        from eotools.drivers.file_stack import FileStack
+        return FileStack(fnames, datetimes, raster_band, **kwargs)
+
+    def __getstate__(self):
+        """
+        Exclude the memory map, thread pool and file handle when
+        pickling; they are re-opened on demand by the receiving process.
+        """
+        state = self.__dict__.copy()
+        state['_memmap'] = None
+        state['_pool'] = None
+        state['_handle'] = None
+        state['_handle_lock'] = None
+        state['_thread_handles'] = None
+        state['_async_reader'] = None
+        state['_keep_handles'] = self._thread_handles is not None
+        return state
+
+    def __setstate__(self, state):
+        keep_handles = state.pop('_keep_handles', False)
+        self.__dict__.update(state)
+        self._handle_lock = threading.Lock()
+        self.use_thread_handles(keep_handles)
+
+    def use_thread_handles(self, enable=True):
+        """
+        If enabled, then each thread keeps its GDAL handles open and
+        re-uses them for subsequent reads, rather than re-opening the
+        file for every read.
+
+        :param enable:
+            If set to True (Default), then handles are kept open.
+            If False, then any open handles are released.
+        """
+        if enable:
+            if self._thread_handles is None:
+                self._thread_handles = threading.local()
+        else:
+            self._thread_handles = None
+
+    def _open(self, fname=None):
+        """
+        Open `fname` (Default is the dataset itself) with GDAL,
+        recording the time taken.
+        """
+        if fname is None:
+            fname = self.fname
+
+        handles = None
+        if self._thread_handles is not None:
+            handles = self._thread_handles.__dict__.setdefault('handles', {})
+            if fname in handles:
+                return handles[fname]
+
+        with self.stats.timer('open'):
+            ds = gdal.Open(fname)
+
+        if handles is not None:
+            handles[fname] = ds
+
+        return ds
+
+    def __getitem__(self, key):
+        """
+        Return a lazy array view of the dataset indexed by `key`, of
+        the form [band_index, ystart:yend, xstart:xend], where the
+        band index is zero based and may be an integer, slice or list.
+        """
+        return self.array[key]
+
+    @property
+    def array(self):
+        """
+        A lazy [bands, lines, samples] array view of the dataset.
+        """
+        return StackView(self)
+
+    @property
+    def memmapped(self):
+        """
+        True if reads are served directly from a `numpy.memmap`.
+        """
+        return self._memmap_layout is not None
+
+    def _get_memmap(self):
+        """
+        Return the [bands, lines, samples] `numpy.memmap` of the file,
+        opening it on first use.
+        """
+        if self._memmap is None:
+            self._memmap = open_memmap(self._memmap_layout)
+        return self._memmap
+
+    def _read_memmap(self, xstart, ystart, xsize, ysize, raster_bands,
+                     decimation=1):
+        """
+        Read a block from the memory map. The result is always a copy,
+        which the caller owns and may modify.
+        """
+        array = self._get_memmap()
+        if decimation > 1:
+            ys = decimated_index(ystart, ysize, decimation)[:, None]
+            xs = decimated_index(xstart, xsize, decimation)
+        else:
+            ys = slice(ystart, ystart + ysize)
+            xs = slice(xstart, xstart + xsize)
+
+        if not isinstance(raster_bands, collections.Sequence):
+            subset = array[raster_bands - 1, ys, xs]
+        else:
+            first = raster_bands[0] if len(raster_bands) > 0 else 1
+            bands = list(range(first, first + len(raster_bands)))
+            if list(raster_bands) != bands:
+                def read_run(first, count):
+                    return array[first - 1:first - 1 + count, ys, xs]
+
+                return self._read_runs(raster_bands, read_run,
+                                       parallel=False)
+
+            subset = array[first - 1:first - 1 + len(raster_bands), ys, xs]
+
+        # Slices are views of the read only memmap; decimated reads
+        # are already copies
+        if decimation > 1:
+            return subset
+        return numpy.array(subset)
+
+    def _read_runs(self, raster_bands, read_run, parallel=True):
+        """
+        Read `raster_bands` as runs of contiguous bands, and assemble
+        the [bands, y, x] result in the caller's order. Each distinct
+        band is read once, in ascending order.
+
+        :param read_run:
+            A function accepting the first band and number of bands
+            of a run, and returning a [bands, y, x] NumPy array.
+
+        :param parallel:
+            If set to True (Default) and `source_threads` is set, then
+            the runs are read concurrently.
+        """
+        unique, inverse, runs = band_runs(raster_bands)
+
+        subset = None
+        if len(runs) == 1:
+            subset = read_run(runs[0][1], runs[0][2])
+        else:
+            def read(run):
+                index, first, count = run
+                return index, read_run(first, count)
+
+            if parallel and self.source_threads is not None:
+                if self._pool is None:
+                    self._pool = ThreadPool(self.source_threads)
+                results = self._pool.map(read, runs)
+            else:
+                results = [read(run) for run in runs]
+
+            for index, data in results:
+                if subset is None:
+                    subset = numpy.empty((len(unique),) + data.shape[1:],
+                                         dtype=data.dtype)
+                subset[index:index + len(data)] = data
+
+        if inverse is not None:
+            subset = subset[inverse]
+
+        return subset
+
+    def _read_gdal(self, xstart, ystart, xsize, ysize, raster_bands,
+                   buf_xsize=None, buf_ysize=None):
+        """
+        Read a multi-band block via GDAL, issuing one read per run of
+        contiguous bands.
+        """
+        if buf_xsize is None:
+            buf_xsize = xsize
+        if buf_ysize is None:
+            buf_ysize = ysize
+
+        def read_run(first, count):
+            # Open the dataset.
+            ds = self._open()
+
+            subset = ds.ReadRaster(xstart, ystart, xsize, ysize,
+                                   buf_xsize, buf_ysize,
+                                   band_list=list(range(first,
+                                                        first + count)))
+            subset = numpy.frombuffer(subset, dtype=self.dtype)
+            subset = subset.reshape(count, buf_ysize, buf_xsize)
+            ds.FlushCache()
+
+            # Close the dataset
+            ds = None
+
+            return subset
+
+        subset = self._read_runs(raster_bands, read_run)
+        if not subset.flags['WRITEABLE']:
+            try:
+                subset.flags['WRITEABLE'] = True
+            except ValueError:
+                subset = subset.copy()
+
+        return subset
+
+    def _resolve_sources(self):
+        """
+        Resolve the source file and band of every raster band using
+        the tile_pathname and tile_layer metadata written by
+        stacker.py.
+
+        :return:
+            A list of (filename, band) tuples, one for each raster
+            band, or an empty list if the sources can't be resolved.
+        """
+        if self._sources is not None:
+            return self._sources
+
+        # Open the dataset
+        ds = self._open()
+
+        sources = []
+        for i in range(1, self.bands + 1):
+            metadata = ds.GetRasterBand(i).GetMetadata()
+            if 'tile_pathname' not in metadata:
+                sources = []
+                break
+            fname = metadata['tile_pathname']
+            if not isabs(fname):
+                fname = pjoin(dirname(self.fname), fname)
+            layer = int(metadata.get('tile_layer', 1))
+            sources.append((fname, layer))
+
+        # Close the dataset
+        ds = None
+
+        self._sources = sources
+
+        return sources
+
+    def _read_source(self, args):
+        """
+        Read a block from a single source file.
+        """
+        source, xstart, ystart, xsize, ysize, buf_xsize, buf_ysize = args
+        fname, layer = source
+
+        ds = self._open(fname)
+        band = ds.GetRasterBand(layer)
+        subset = band.ReadAsArray(xstart, ystart, xsize, ysize, buf_xsize,
+                                  buf_ysize)
+        band.FlushCache()
 
         # Close the dataset
         band = None
         ds = None
 
+        return subset
+
+    def _read_sources(self, xstart, ystart, xsize, ysize, raster_bands,
+                      buf_xsize=None, buf_ysize=None):
+        """
+        Read a block from the source files of `raster_bands`
+        concurrently and assemble the [bands, y, x] result. If set,
+        `buf_xsize` and `buf_ysize` give a reduced resolution
+        buffer size.
+        """
+        if buf_xsize is None:
+            buf_xsize = xsize
+        if buf_ysize is None:
+            buf_ysize = ysize
+
+        sources = self._resolve_sources()
+        args = [(sources[b - 1], xstart, ystart, xsize, ysize, buf_xsize,
+                 buf_ysize) for b in raster_bands]
+
+        if self.source_threads is None or len(args) == 1:
+            results = [self._read_source(a) for a in args]
+        else:
+            if self._pool is None:
+                self._pool = ThreadPool(self.source_threads)
+            results = self._pool.map(self._read_source, args)
+
+        subset = numpy.empty((len(raster_bands), buf_ysize, buf_xsize),
+                             dtype=self.dtype)
+        for i, data in enumerate(results):
+            subset[i] = data
+
+        return subset
+
+    def _use_sources(self):
+        """
+        True if multi-band reads should go directly to the source files.
+        """
+        return (self.source_threads is not None and
+                len(self._resolve_sources()) == self.bands)
+
+    def _read_block(self, raster_band, yblock, xblock):
+        """
+        Read a single image block, via the block cache.
+        """
+        key = (raster_band, yblock, xblock)
+        block = self._cache.get(key)
+        if block is not None:
+            return block
+
+        xstart = xblock * self.block_xsize
+        ystart = yblock * self.block_ysize
+        xsize = min(self.block_xsize, self.samples - xstart)
+        ysize = min(self.block_ysize, self.lines - ystart)
+
+        # GDAL handles aren't thread safe
+        with self._handle_lock:
+            if self._handle is None:
+                self._handle = self._open()
+            band = self._handle.GetRasterBand(raster_band)
+            block = band.ReadAsArray(xstart, ystart, xsize, ysize)
+            band = None
+
+        self._cache.put(key, block)
+
+        return block
+
+    def _read_cached(self, xstart, ystart, xsize, ysize, raster_bands):
+        """
+        Read a block for a list of raster bands by assembling the
+        intersecting image blocks from the block cache.
+        """
+        xend = xstart + xsize
+        yend = ystart + ysize
+        bx = self.block_xsize
+        by = self.block_ysize
+
+        subset = numpy.empty((len(raster_bands), ysize, xsize),
+                             dtype=self.dtype)
+
+        for i, raster_band in enumerate(raster_bands):
+            for yblock in range(ystart // by, (yend - 1) // by + 1):
+                for xblock in range(xstart // bx, (xend - 1) // bx + 1):
+                    block = self._read_block(raster_band, yblock, xblock)
+
+                    # Intersection of the block and the requested window
+                    bys = yblock * by
+                    bxs = xblock * bx
+                    ys = max(ystart, bys)
+                    ye = min(yend, bys + block.shape[0])
+                    xs = max(xstart, bxs)
+                    xe = min(xend, bxs + block.shape[1])
+
+                    subset[i, ys - ystart:ye - ystart,
+                           xs - xstart:xe - xstart] = block[ys - bys:ye - bys,
+                                                            xs - bxs:xe - bxs]
+
+        return subset
+
+    def build_time_major(self, out_fname, xchunk=64, ychunk=64,
+                         raster_bands=None):
+        """
+        Build a chunked, time-major (band interleaved by pixel) cache
+        of the dataset and attach it, such that subsequent multi-band
+        reads are served from the cache.
+
+        :param out_fname:
+            A string containing the full file path name of the cache.
+
+        :param xchunk:
+            The chunk size in the x-direction. Default is 64.
+
+        :param ychunk:
+            The chunk size in the y-direction. Default is 64.
+
+        :param raster_bands:
+            A list of the raster bands to include in the cache.
+            Default is all raster bands.
+
+        :return:
+            An instance of `TimeMajorDataset`.
+        """
+        cache = build_time_major(self, out_fname, xchunk, ychunk,
+                                 raster_bands)
+        self._time_major = cache
+
+        return cache
+
+    def attach_time_major(self, cache):
+        """
+        Attach an existing time-major cache.
+
+        :param cache:
+            Either the file path name of a cache created by
+            `build_time_major`, or an instance of `TimeMajorDataset`.
+            None detaches the current cache.
+        """
+        if cache is not None and not isinstance(cache, TimeMajorDataset):
+            cache = TimeMajorDataset(cache)
+
+        if cache is not None:
+            if (cache.samples, cache.lines) != (self.samples, self.lines):
+                msg = ("Time-major cache dimensions {} differ from the "
+                       "dataset dimensions {}")
+                msg = msg.format((cache.lines, cache.samples),
+                                 (self.lines, self.samples))
+                raise ValueError(msg)
+
+        self._time_major = cache
+
+    def cache_info(self):
+        """
+        Return the block cache statistics.
+
+        :return:
+            A dictionary containing the keys hits, misses, hit_rate,
+            evictions, blocks, nbytes and max_bytes; or None if the
+            block cache isn't enabled.
+        """
+        if self._cache is None:
+            return None
+        return self._cache.info()
+
+    def clear_cache(self):
+        """
+        Remove every block from the block cache and close the file
+        handle used to fill it.
+        """
+        if self._cache is not None:
+            self._cache.clear()
+        with self._handle_lock:
+            self._handle = None
+
+    def async_reader(self, max_workers=4):
+        """
+        Return the `AsyncReader` serving the asyncio read methods,
+        creating it on first use. Python 3 only.
+
+        :param max_workers:
+            The maximum number of concurrent GDAL reads used when
+            creating the reader. Default is 4.
+        """
+        if self._async_reader is None:
+            from eotools.drivers.async_reader import AsyncReader
+            self._async_reader = AsyncReader(self, max_workers)
+        return self._async_reader
+
+    def aread_tile(self, tile, raster_bands=1, decimation=1):
+        """
+        Awaitable variant of `read_tile`. Identical requests made
+        concurrently are served by a single read.
+
+        Example:
+
+            >>> subset = await ds.aread_tile(ds.get_tile(0), [1, 2, 3])
+        """
+        return self.async_reader().read_tile(tile, raster_bands, decimation)
+
+    def aread_raster_band(self, raster_band=1, decimation=1):
+        """
+        Awaitable variant of `read_raster_band`.
+        """
+        return self.async_reader().read_raster_band(raster_band, decimation)
+
+    def az_profile(self, xy, from_map=False, raster_bands=None):
+        """
+        Awaitable read of the z-axis profile at `xy`.
+        See `eotools.profiles.z_profile`.
+        """
+        if from_map:
+            x, y = convert_coordinates(self.geotransform, xy, to_map=False)
+        else:
+            x, y = xy
+        return self.async_reader().z_profile(x, y, raster_bands)
+
+    def get_geobox(self):
+        """
+        Return the GriddedGeoBox enclosing the full extent of the
+        dataset.
+        """
+        geobox = GriddedGeoBox(shape=(self.lines, self.samples),
+                               origin=(self.geotransform[0],
+                                       self.geotransform[3]),
+                               pixelsize=(abs(self.geotransform[1]),
+                                          abs(self.geotransform[5])),
+                               crs=self.projection)
+        return geobox
+
     def get_raster_band_metadata(self, raster_band=1):
         """
         Retrives the metadata for a given band_index.
@@ -163,7 +827,7 @@ class StackedDataset:
         """
 
         # Open the dataset
-        ds = gdal.Open(self.fname)
+        ds = self._open()
 
         # Retrieve the band of interest
         band = ds.GetRasterBand(raster_band)
@@ -228,6 +892,9 @@ class StackedDataset:
                     self.yearly_iterator[year_one] = band_list
                     year_one = year
                     band_list = [i]
+
+            # Include a final year containing a single band
+            self.yearly_iterator[year_one] = band_list
         else:
             self.yearly_iterator[0] = range(1, self.bands + 1)
 
@@ -238,7 +905,7 @@ class StackedDataset:
 
         return self.yearly_iterator
 
-    def init_tiling(self, xsize=None, ysize=None):
+    def init_tiling(self, xsize=None, ysize=None, order='row'):
         """
         Sets the tile indices for a 2D array.
 
@@ -252,19 +919,98 @@ class StackedDataset:
             tile.
             Default is 10.
 
-        :return:
-            A list containing a series of tuples defining the
-            individual 2D tiles/chunks to be indexed.
-            Each tuple contains ((ystart, yend), (xstart, xend)).
+        :param order:
+            The tile traversal order; one of 'row', 'column', 'hilbert'
+            or 'morton'. See `eotools.tiling.generate_tiles`.
+            Default is 'row'.
+
+        The tiles are held in `self.tiles`; an instance of
+        `eotools.tiling.TileIndex` which behaves as a list of tuples
+        defining the individual 2D tiles/chunks to be indexed.
+        Each tuple contains ((ystart, yend), (xstart, xend)).
         """
         if xsize is None:
             xsize = self.samples
         if ysize is None:
             ysize = 10
-        self.tiles = generate_tiles(self.samples, self.lines, xtile=xsize,
-                                    ytile=ysize, generator=False)
+        self.tiles = TileIndex.from_grid(self.samples, self.lines,
+                                         xtile=xsize, ytile=ysize,
+                                         order=order)
         self.n_tiles = len(self.tiles)
 
+    def coverage_index(self, decimation=16, raster_bands=None):
+        """
+        Build a low resolution index of where the stack contains valid
+        data, from a cheap decimated read (served from the overviews
+        where the files have them) of a few raster bands.
+
+        :param decimation:
+            An integer reduction factor for the index. Default is 16.
+
+        :param raster_bands:
+            The raster bands used to build the index; a pixel is valid
+            if it is valid in any of them. Default is the first and
+            last raster bands.
+
+        :return:
+            An instance of `eotools.tiling.CoverageIndex`.
+        """
+        if raster_bands is None:
+            raster_bands = sorted(set([1, self.bands]))
+
+        mask = None
+        for raster_band in raster_bands:
+            data = self.read_raster_band(raster_band, decimation)
+            if data.dtype.kind == 'f':
+                valid = numpy.isfinite(data)
+            else:
+                valid = numpy.ones(data.shape, dtype='bool')
+            if self.no_data is not None and not numpy.isnan(self.no_data):
+                valid &= data != self.no_data
+            mask = valid if mask is None else mask | valid
+
+        return CoverageIndex(mask, decimation, self.samples, self.lines)
+
+    def plan_tiling(self, budget, cost=1.0, raster_bands=None, workers=1,
+                    halo=0):
+        """
+        Plan the largest tile shape, aligned to the block size of the
+        stack, whose memory requirement fits within a budget.
+        See `eotools.tiling.plan_tile_size`.
+
+        :param budget:
+            The memory budget in bytes, shared by all the workers.
+
+        :param cost:
+            The working memory of the algorithm as a multiple of the
+            input in float32, eg `eotools.bulk_stats.MEMORY_COST` for
+            `z_axis_stats`. Default is 1.0.
+
+        :param raster_bands:
+            The raster bands read for each tile. Default is all bands.
+
+        :param workers:
+            The number of tiles held in memory at once. Default is 1.
+
+        :param halo:
+            The number of pixels of overlap read around each tile.
+            Default is 0.
+
+        :return:
+            A tuple (xsize, ysize) for `init_tiling`.
+
+        Example:
+
+            >>> xsize, ysize = ds.plan_tiling(2**30, MEMORY_COST, workers=4)
+            >>> ds.init_tiling(xsize, ysize)
+            >>> ds.z_axis_stats(out_fname, workers=4)
+        """
+        bands = self.bands if raster_bands is None else len(raster_bands)
+        return plan_tile_size(self.samples, self.lines, bands, self.dtype,
+                              budget, cost,
+                              (self.block_xsize, self.block_ysize),
+                              workers, halo)
+
     def get_tile(self, index=0):
         """
         Retrieves a tile given an index.
@@ -283,20 +1029,41 @@ class StackedDataset:
 
         return tile
 
-    def read_tile(self, tile, raster_bands=1):
+    def read_tile(self, tile, raster_bands=1, decimation=1):
         """
         Read an x & y block specified by tile for a given raster band
         or raster bands using GDAL.
 
         :param tile:
             A tuple containing the start and end array indices, of the
-            form ((ystart, yend), (xstart,xend)).
+            form ((ystart, yend), (xstart,xend)); or a (read_window,
+            core_window) pair of tiles, whereby the read window
+            (including the halo) is read. See `generate_tiles`.
 
         :param raster_bands:
             If reading from a single band, provide which raster band
             to read from. If raster_bands is a list, then it should
             contain the raster band numbers from which to read.
             Default is raster band 1.
+
+        :param decimation:
+            An integer reduction factor applied to both the x & y
+            dimensions, eg 8 returns a block at 1/8 resolution of
+            ceil(ysize / 8) by ceil(xsize / 8) pixels. GDAL will use
+            the most appropriate overview if any are present, otherwise
+            the block is subsampled. Default is 1 (full resolution).
+        """
+
+        window, _ = split_tile(tile)
+        with self.stats.timer('read', tile) as timer:
+            subset = self._read_tile(window, raster_bands, decimation)
+            timer.nbytes = subset.nbytes
+
+        return subset
+
+    def _read_tile(self, tile, raster_bands=1, decimation=1):
+        """
+        Read an x & y block; see `read_tile`.
         """
 
         ystart = int(tile[0][0])
@@ -306,25 +1073,42 @@ class StackedDataset:
         xsize = int(xend - xstart)
         ysize = int(yend - ystart)
 
-        # Open the dataset.
-        ds = gdal.Open(self.fname)
+        if self.memmapped:
+            return self._read_memmap(xstart, ystart, xsize, ysize,
+                                     raster_bands, decimation)
+
+        if decimation > 1:
+            return self._read_decimated(xstart, ystart, xsize, ysize,
+                                        raster_bands, decimation)
+
+        if (isinstance(raster_bands, collections.Sequence) and
+                self._time_major is not None and
+                self._time_major.has_bands(raster_bands)):
+            return self._time_major.read_tile(tile, raster_bands)
+
+        if self._cache is not None:
+            if isinstance(raster_bands, collections.Sequence):
+                return self._read_cached(xstart, ystart, xsize, ysize,
+                                         raster_bands)
+            return self._read_cached(xstart, ystart, xsize, ysize,
+                                     [raster_bands])[0]
+
+        if (isinstance(raster_bands, collections.Sequence) and
+                self._use_sources()):
+            return self._read_sources(xstart, ystart, xsize, ysize,
+                                      raster_bands)
 
         if isinstance(raster_bands, collections.Sequence):
-            band = ds.GetRasterBand(1)
-            dtype = gdal_2_numpy_dtypes[band.DataType]
-            n_bands = len(raster_bands)
-            subset = ds.ReadRaster(xstart, ystart, xsize, ysize,
-                                   band_list=raster_bands)
-            subset = numpy.frombuffer(subset, dtype=dtype).reshape(n_bands,
-                                                                   ysize,
-                                                                   xsize)
-            ds.FlushCache()
-            subset.flags['WRITEABLE'] = True
-        else:
-            band = ds.GetRasterBand(raster_bands)
-            # Read the block and flush the cache (potentianl GDAL memory leak)
-            subset = band.ReadAsArray(xstart, ystart, xsize, ysize)
-            band.FlushCache()
+            return self._read_gdal(xstart, ystart, xsize, ysize,
+                                   raster_bands)
+
+        # Open the dataset.
+        ds = self._open()
+
+        band = ds.GetRasterBand(raster_bands)
+        # Read the block and flush the cache (potentianl GDAL memory leak)
+        subset = band.ReadAsArray(xstart, ystart, xsize, ysize)
+        band.FlushCache()
 
         # Close the dataset
         band = None
@@ -332,6 +1116,34 @@ class StackedDataset:
 
         return subset
 
+    def _read_decimated(self, xstart, ystart, xsize, ysize, raster_bands,
+                        decimation):
+        """
+        Read a reduced resolution block via GDAL, by requesting a
+        buffer smaller than the window. GDAL satisfies the read from
+        the most appropriate overview when overviews are present.
+        """
+        buf_xsize = (xsize + decimation - 1) // decimation
+        buf_ysize = (ysize + decimation - 1) // decimation
+
+        if isinstance(raster_bands, collections.Sequence):
+            return self._read_gdal(xstart, ystart, xsize, ysize,
+                                   raster_bands, buf_xsize, buf_ysize)
+
+        # Open the dataset.
+        ds = self._open()
+
+        band = ds.GetRasterBand(raster_bands)
+        subset = band.ReadAsArray(xstart, ystart, xsize, ysize,
+                                  buf_xsize, buf_ysize)
+        band.FlushCache()
+        band = None
+
+        # Close the dataset
+        ds = None
+
+        return subset
+
     def read_tile_all_rasters(self, tile):
         """
         Read an x & y block specified by tile from all raster bands
@@ -339,7 +1151,20 @@ class StackedDataset:
 
         :param tile:
             A tuple containing the start and end array indices, of the
-            form ((ystart, yend), (xstart, xend)).
+            form ((ystart, yend), (xstart, xend)); or a (read_window,
+            core_window) pair of tiles. See `read_tile`.
+        """
+
+        window, _ = split_tile(tile)
+        with self.stats.timer('read', tile) as timer:
+            subset = self._read_tile_all_rasters(window)
+            timer.nbytes = subset.nbytes
+
+        return subset
+
+    def _read_tile_all_rasters(self, tile):
+        """
+        See `read_tile_all_rasters`.
         """
 
         ystart = int(tile[0][0])
@@ -349,8 +1174,26 @@ class StackedDataset:
         xsize = int(xend - xstart)
         ysize = int(yend - ystart)
 
+        if self.memmapped:
+            # Mimic GDAL which returns a 2D array for single band files
+            subset = self._get_memmap()[:, ystart:yend, xstart:xend]
+            if self.bands == 1:
+                subset = subset[0]
+            return numpy.array(subset)
+
+        if self._cache is not None:
+            subset = self._read_cached(xstart, ystart, xsize, ysize,
+                                       range(1, self.bands + 1))
+            if self.bands == 1:
+                subset = subset[0]
+            return subset
+
+        if self._use_sources() and self.bands > 1:
+            return self._read_sources(xstart, ystart, xsize, ysize,
+                                      range(1, self.bands + 1))
+
         # Open the dataset.
-        ds = gdal.Open(self.fname)
+        ds = self._open()
 
         # Read the array and flush the cache (potentianl GDAL memory leak)
         subset = ds.ReadAsArray(xstart, ystart, xsize, ysize)
@@ -361,7 +1204,7 @@ class StackedDataset:
 
         return subset
 
-    def read_raster_band(self, raster_band=1):
+    def read_raster_band(self, raster_band=1, decimation=1):
         """
         Read the entire 2D block for a given raster band.
         By default the first raster band is read into memory.
@@ -369,13 +1212,40 @@ class StackedDataset:
         :param raster_band:
             The band index of interest. Default is the first band.
 
+        :param decimation:
+            An integer reduction factor applied to both the x & y
+            dimensions. Default is 1 (full resolution).
+            See `read_tile`.
+
         :return:
             A NumPy 2D array of the same dimensions and datatype of
             the band of interest.
         """
 
+        with self.stats.timer('read') as timer:
+            subset = self._read_raster_band(raster_band, decimation)
+            timer.nbytes = subset.nbytes
+
+        return subset
+
+    def _read_raster_band(self, raster_band=1, decimation=1):
+        """
+        See `read_raster_band`.
+        """
+
+        if decimation > 1:
+            tile = ((0, self.lines), (0, self.samples))
+            return self._read_tile(tile, raster_band, decimation)
+
+        if self.memmapped:
+            return numpy.array(self._get_memmap()[raster_band - 1])
+
+        if self._cache is not None:
+            return self._read_cached(0, 0, self.samples, self.lines,
+                                     [raster_band])[0]
+
         # Open the dataset.
-        ds = gdal.Open(self.fname)
+        ds = self._open()
 
         band = ds.GetRasterBand(raster_band)
         array = band.ReadAsArray()
@@ -389,7 +1259,9 @@ class StackedDataset:
 
         return array
 
-    def z_axis_stats(self, out_fname=None, raster_bands=None):
+    def z_axis_stats(self, out_fname=None, raster_bands=None, workers=1,
+                     processes=False, decimation=1, fmt="ENVI",
+                     coverage=None):
         """
         Compute statistics over the z-axis of the StackedDataset.
         An image containing 14 raster bands, each describing a
@@ -420,8 +1292,33 @@ class StackedDataset:
             a list containing the raster bands of interest. This can be
             sequential or non-sequential.
 
+        :param workers:
+            The number of workers used to read and compute the tiles.
+            Default is 1 (serial).
+
+        :param processes:
+            If set to True, then the workers are processes rather than
+            threads. Default is False (threads).
+
+        :param decimation:
+            An integer reduction factor. If greater than 1, then the
+            statistics are computed at reduced resolution, eg 8 for
+            a 1/8 resolution quick look. The output image has a
+            correspondingly scaled pixel size. Default is 1.
+
+        :param fmt:
+            A GDAL compliant file format for the output image, or
+            'ZARR' for a chunked, compressed array store whose chunks
+            are aligned to the tiles. Default is ENVI.
+
+        :param coverage:
+            An optional instance of `eotools.tiling.CoverageIndex`, or
+            True to build one via `coverage_index`. Tiles containing no
+            valid data are skipped and their statistics set to NaN.
+
         :return:
-            An instance of StackedDataset referencing the stats file.
+            An instance of StackedDataset referencing the stats file,
+            or a `ChunkedStore` if `fmt` is 'ZARR'.
         """
         # Check if the image tiling has been initialised
         if self.n_tiles == 0:
@@ -443,27 +1340,10 @@ class StackedDataset:
                       '3rd Quantile (non-interpolated value)',
                       'Geometric Mean']
 
-        # out number of bands
-        out_nb = 14
-
         # Construct the output image file to contain the result
         if out_fname is None:
             out_fname = pjoin(self.fname, '_z_axis_stats')
 
-        geobox = GriddedGeoBox(shape=(self.lines, self.samples),
-                               origin=(self.geotransform[0],
-                                       self.geotransform[3]),
-                               pixelsize=(self.geotransform[1],
-                                          self.geotransform[5]),
-                               crs=self.projection)
-
-        outds = TiledOutput(out_fname, self.samples, self.lines, out_nb,
-                            geobox, no_data=numpy.nan, dtype=gdal.GDT_Float32)
-
-        # Write the band names
-        for i in range(out_nb):
-            outds.out_bands[i].SetDescription(band_names[i])
-
         # If we have None, set to read all bands
         if raster_bands is None:
             raster_bands = range(1, self.bands + 1)
@@ -474,13 +1354,22 @@ class StackedDataset:
             msg = msg.format(type(raster_bands))
             raise TypeError(msg)
 
-        # Loop over every tile
-        for tile_n in range(self.n_tiles):
-            tile = self.get_tile(tile_n)
-            subset = self.read_tile(tile, raster_bands)
-            stats = bulk_stats(subset, no_data=self.no_data)
-            outds.write_tile(stats, tile)
+        spec = OutputSpec(out_fname, bands=len(band_names),
+                          dtype=gdal.GDT_Float32, nodata=numpy.nan,
+                          fmt=fmt, band_names=band_names)
+
+        # Reduced resolution outputs use their own tiling
+        tiles = self.tiles if decimation == 1 else None
+
+        if coverage is True:
+            coverage = self.coverage_index()
+
+        stats = partial(bulk_stats, no_data=self.no_data)
+        map_tiles(stats, (self, list(raster_bands)), spec, workers=workers,
+                  processes=processes, tiles=tiles, decimation=decimation,
+                  stats=self.stats, coverage=coverage)
 
-        outds.close()
+        if fmt == CHUNKED_FORMAT:
+            return ChunkedStore(out_fname)
 
         return StackedDataset(out_fname)
@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+
+# ===============================================================================
+# Copyright 2015 Geoscience Australia
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+"""
+A chunked, time-major (band interleaved by pixel) cache of a stacked
+dataset. Each chunk holds every band for a ychunk by xchunk block of
+pixels, such that the full temporal profile of a pixel is contiguous
+on disk.
+"""
+
+from __future__ import absolute_import
+import json
+import numpy
+from eotools.tiling import generate_tiles
+
+
+def _header_fname(fname):
+    """
+    The sidecar file containing the cache description.
+    """
+    return fname + '.json'
+
+
+def build_time_major(stacked_dataset, out_fname, xchunk=64, ychunk=64,
+                     raster_bands=None, max_bytes=2**28):
+    """
+    Reorganise a `StackedDataset` into a chunked, time-major cache file.
+
+    The cache is built with a streaming transpose; strips of chunks are
+    read from the stacked dataset, transposed to [y, x, bands] and
+    written to their chunks, such that no more than `max_bytes` of
+    image data is held in memory at once.
+
+    :param stacked_dataset:
+        An instance of a `StackedDataset`.
+
+    :param out_fname:
+        A string containing the full file path name of the cache file.
+        A JSON sidecar file, out_fname + '.json', describing the cache
+        is also written.
+
+    :param xchunk:
+        The chunk size in the x-direction. Default is 64.
+
+    :param ychunk:
+        The chunk size in the y-direction. Default is 64.
+
+    :param raster_bands:
+        A list of the raster bands to include in the cache.
+        Default is all raster bands.
+
+    :param max_bytes:
+        The approximate maximum number of bytes read from the stacked
+        dataset at once. Default is 256MB.
+
+    :return:
+        An instance of `TimeMajorDataset` referencing the cache.
+    """
+    if raster_bands is None:
+        raster_bands = list(range(1, stacked_dataset.bands + 1))
+    raster_bands = list(raster_bands)
+
+    samples = stacked_dataset.samples
+    lines = stacked_dataset.lines
+    bands = len(raster_bands)
+    dtype = numpy.dtype(stacked_dataset.dtype)
+
+    header = {'samples': samples,
+              'lines': lines,
+              'raster_bands': raster_bands,
+              'dtype': dtype.str,
+              'xchunk': xchunk,
+              'ychunk': ychunk,
+              'no_data': stacked_dataset.no_data,
+              'geotransform': list(stacked_dataset.geotransform),
+              'projection': stacked_dataset.projection}
+
+    with open(_header_fname(out_fname), 'w') as out_header:
+        json.dump(header, out_header, indent=4)
+
+    # Read as many whole chunks across as fit within max_bytes
+    chunk_bytes = xchunk * ychunk * bands * dtype.itemsize
+    n_across = max(1, max_bytes // chunk_bytes)
+
+    cache = TimeMajorDataset(out_fname, mode='w+')
+    tiles = generate_tiles(samples, lines, xtile=xchunk * n_across,
+                           ytile=ychunk)
+    for tile in tiles:
+        subset = stacked_dataset.read_tile(tile, raster_bands)
+        cache.write_tile(subset, tile)
+
+    cache.flush()
+
+    return TimeMajorDataset(out_fname)
+
+
+class TimeMajorDataset(object):
+
+    def __init__(self, fname, mode='r'):
+        """
+        A reader for a time-major cache file created by
+        `build_time_major`.
+
+        :param fname:
+            A string containing the full file path name of the cache.
+
+        :param mode:
+            The `numpy.memmap` access mode. Default is 'r' (read only).
+
+        :example:
+            >>> cache = build_time_major(StackedDataset(fname), 'cache')
+            >>> # A single contiguous read of a pixel's time series
+            >>> cache.read_pixel(100, 2000).shape
+            (22,)
+        """
+        self.fname = fname
+
+        with open(_header_fname(fname), 'r') as src:
+            header = json.load(src)
+
+        self.samples = header['samples']
+        self.lines = header['lines']
+        self.raster_bands = header['raster_bands']
+        self.bands = len(self.raster_bands)
+        self.dtype = numpy.dtype(str(header['dtype']))
+        self.xchunk = header['xchunk']
+        self.ychunk = header['ychunk']
+        self.no_data = header['no_data']
+        self.geotransform = tuple(header['geotransform'])
+        self.projection = header['projection']
+
+        # Lookup of raster band number to position within a chunk
+        self._band_index = dict((b, i) for i, b in
+                                enumerate(self.raster_bands))
+
+        # Chunks are padded to full size at the image edges
+        self.ychunks = (self.lines + self.ychunk - 1) // self.ychunk
+        self.xchunks = (self.samples + self.xchunk - 1) // self.xchunk
+        shape = (self.ychunks, self.xchunks, self.ychunk, self.xchunk,
+                 self.bands)
+        self._array = numpy.memmap(fname, dtype=self.dtype, mode=mode,
+                                   shape=shape)
+
+    def __getstate__(self):
+        """
+        Exclude the memory map when pickling.
+        """
+        state = self.__dict__.copy()
+        state['_array'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        shape = (self.ychunks, self.xchunks, self.ychunk, self.xchunk,
+                 self.bands)
+        self._array = numpy.memmap(self.fname, dtype=self.dtype, mode='r',
+                                   shape=shape)
+
+    def has_bands(self, raster_bands):
+        """
+        True if all of `raster_bands` are held within the cache.
+        """
+        return all(b in self._band_index for b in raster_bands)
+
+    def _band_selection(self, raster_bands):
+        """
+        Convert raster band numbers to a selection along the band axis.
+        """
+        if raster_bands is None or list(raster_bands) == self.raster_bands:
+            return slice(None)
+        return [self._band_index[b] for b in raster_bands]
+
+    def read_pixel(self, x, y, raster_bands=None):
+        """
+        Read the time series of a single pixel with one contiguous
+        read.
+
+        :param x:
+            The x (sample) image co-ordinate.
+
+        :param y:
+            The y (line) image co-ordinate.
+
+        :param raster_bands:
+            A list of the raster bands to return. Default is all
+            the raster bands held in the cache.
+
+        :return:
+            A 1D NumPy array.
+        """
+        series = self._array[y // self.ychunk, x // self.xchunk,
+                             y % self.ychunk, x % self.xchunk]
+        return series[self._band_selection(raster_bands)]
+
+    def read_tile_bip(self, tile, raster_bands=None):
+        """
+        Read an x & y block specified by tile, returning a
+        [y, x, bands] array, the natural layout for per-pixel time
+        series algorithms.
+
+        :param tile:
+            A tuple containing the start and end array indices, of the
+            form ((ystart, yend), (xstart, xend)).
+
+        :param raster_bands:
+            A list of the raster bands to return. Default is all
+            the raster bands held in the cache.
+        """
+        (ystart, yend), (xstart, xend) = tile
+        ystart, yend, xstart, xend = [int(i) for i in
+                                      (ystart, yend, xstart, xend)]
+        selection = self._band_selection(raster_bands)
+
+        nb = self.bands if raster_bands is None else len(raster_bands)
+        subset = numpy.empty((yend - ystart, xend - xstart, nb),
+                             dtype=self.dtype)
+
+        for yc in range(ystart // self.ychunk,
+                        (yend - 1) // self.ychunk + 1):
+            cys = yc * self.ychunk
+            ys = max(ystart, cys)
+            ye = min(yend, cys + self.ychunk)
+            for xc in range(xstart // self.xchunk,
+                            (xend - 1) // self.xchunk + 1):
+                cxs = xc * self.xchunk
+                xs = max(xstart, cxs)
+                xe = min(xend, cxs + self.xchunk)
+                chunk = self._array[yc, xc, ys - cys:ye - cys,
+                                    xs - cxs:xe - cxs]
+                subset[ys - ystart:ye - ystart,
+                       xs - xstart:xe - xstart] = chunk[..., selection]
+
+        return subset
+
+    def read_tile(self, tile, raster_bands=None):
+        """
+        Read an x & y block specified by tile, returning a
+        [bands, y, x] array as per `StackedDataset.read_tile`.
+        """
+        return self.read_tile_bip(tile, raster_bands).transpose(2, 0, 1)
+
+    def write_tile(self, array, tile):
+        """
+        Write a [bands, y, x] array into the cache.
+        """
+        (ystart, yend), (xstart, xend) = tile
+        ystart, yend, xstart, xend = [int(i) for i in
+                                      (ystart, yend, xstart, xend)]
+        bip = array.transpose(1, 2, 0)
+
+        for yc in range(ystart // self.ychunk,
+                        (yend - 1) // self.ychunk + 1):
+            cys = yc * self.ychunk
+            ys = max(ystart, cys)
+            ye = min(yend, cys + self.ychunk)
+            for xc in range(xstart // self.xchunk,
+                            (xend - 1) // self.xchunk + 1):
+                cxs = xc * self.xchunk
+                xs = max(xstart, cxs)
+                xe = min(xend, cxs + self.xchunk)
+                self._array[yc, xc, ys - cys:ye - cys,
+                            xs - cxs:xe - cxs] = bip[ys - ystart:ye - ystart,
+                                                     xs - xstart:xe - xstart]
+
+    def flush(self):
+        """
+        Flush any pending writes to disk.
+        """
+        self._array.flush()
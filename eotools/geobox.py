@@ -226,6 +226,21 @@ class GriddedGeoBox(object):
 
         return GriddedGeoBox(self.shape, newOrigin, newPixelSize, crs=crs)
 
+    def decimate(self, factor):
+        """
+        Return a reduced resolution GriddedGeoBox covering this
+        GriddedGeoBox, whose pixels are `factor` times larger in both
+        dimensions. The shape is rounded up such that the full extent
+        is enclosed.
+
+        :param factor:
+            An integer reduction factor.
+        """
+        shape = tuple([(v + factor - 1) // factor for v in self.shape])
+        pixelsize = (self.pixelsize[0] * factor, self.pixelsize[1] * factor)
+
+        return GriddedGeoBox(shape, self.origin, pixelsize, crs=self.crs)
+
     def __str__(self):
         return 'GriddedGeoBox(origin=%s,shape=%s,pixelsize=%s,crs: %s)' % \
             (self.origin, self.shape, str(self.pixelsize),
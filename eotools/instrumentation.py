@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+
+# ===============================================================================
+# Copyright 2015 Geoscience Australia
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+"""
+Lightweight I/O instrumentation for `StackedDataset`, `TiledOutput`
+and `map_tiles`.
+
+Example:
+
+    >>> stats = IOStats(trace='z_axis_stats_trace.jsonl')
+    >>> ds = StackedDataset(fname, stats=stats)
+    >>> ds.z_axis_stats(out_fname)
+    >>> summary = stats.summary()
+    >>> summary['read']
+    {'count': 400, 'seconds': 12.8, 'bytes': 1408000000}
+    >>> stats.close()
+"""
+
+from __future__ import absolute_import
+import collections
+import json
+import os
+import threading
+import time
+
+
+def _tile_key(tile):
+    """
+    Convert a tile to a hashable, JSON serialisable tuple of ints.
+    A (read_window, core_window) pair is keyed by its core window.
+    """
+    if tile is None:
+        return None
+    if isinstance(tile[0][0], (tuple, list)):
+        tile = tile[1]
+    return tuple(tuple(int(v) for v in axis) for axis in tile)
+
+
+class _Timer(object):
+
+    """
+    Context manager timing a single event. The number of bytes
+    transferred can be assigned to `nbytes` within the block.
+    """
+
+    def __init__(self, stats, category, tile=None, nbytes=0):
+        self.stats = stats
+        self.category = category
+        self.tile = tile
+        self.nbytes = nbytes
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.time() - self.start
+        self.stats.record(self.category, seconds, self.nbytes, self.tile)
+        return False
+
+
+class _NullTimer(object):
+
+    """
+    A context manager that records nothing.
+    """
+
+    nbytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+class NullStats(object):
+
+    """
+    A drop in replacement for `IOStats` that records nothing; used
+    whenever instrumentation is disabled.
+    """
+
+    enabled = False
+
+    def timer(self, category, tile=None, nbytes=0):
+        return _NullTimer()
+
+    def record(self, category, seconds, nbytes=0, tile=None):
+        pass
+
+    def drain(self):
+        return None
+
+    def merge(self, state):
+        pass
+
+    def summary(self):
+        return {}
+
+    def close(self):
+        pass
+
+
+# Shared instance used when instrumentation is disabled
+NULL_STATS = NullStats()
+
+
+class IOStats(object):
+
+    enabled = True
+
+    def __init__(self, trace=None):
+        """
+        Accumulates per category call counts, bytes and wall time,
+        along with per tile timings, for events such as open, read,
+        compute and write.
+
+        :param trace:
+            An optional file path name. If set, every event is also
+            appended to the file as a JSON object per line.
+        """
+        self.trace_fname = trace
+        self._init_state()
+
+    def _init_state(self):
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self.counts = collections.defaultdict(int)
+        self.seconds = collections.defaultdict(float)
+        self.nbytes = collections.defaultdict(int)
+        self.tiles = collections.OrderedDict()
+        self._trace = None
+        if self.trace_fname is not None:
+            self._trace = open(self.trace_fname, 'a')
+
+    def _check_process(self):
+        """
+        Start afresh within a forked process, rather than sharing the
+        parent's statistics, lock and trace file handle. Every event is
+        flushed to the trace as it is written, so the handle inherited
+        from the parent holds nothing that could be written twice.
+        """
+        if self._pid != os.getpid():
+            self._init_state()
+
+    def __getstate__(self):
+        """
+        Only the trace file name is pickled; each process accumulates
+        its own statistics and appends to the same trace. See `drain`
+        and `merge` for returning the statistics to the parent.
+        """
+        return {'trace_fname': self.trace_fname}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_state()
+
+    def timer(self, category, tile=None, nbytes=0):
+        """
+        Return a context manager that records the wall time of the
+        enclosed block under `category`.
+
+        :param category:
+            The event category, eg 'open', 'read', 'compute' or 'write'.
+
+        :param tile:
+            An optional tile of the form ((ystart, yend), (xstart, xend))
+            to which the event belongs.
+
+        :param nbytes:
+            The number of bytes transferred. It can also be assigned to
+            the `nbytes` attribute of the context manager.
+        """
+        return _Timer(self, category, tile, nbytes)
+
+    def record(self, category, seconds, nbytes=0, tile=None):
+        """
+        Record a single event.
+
+        :param category:
+            The event category, eg 'open', 'read', 'compute' or 'write'.
+
+        :param seconds:
+            The wall time of the event.
+
+        :param nbytes:
+            The number of bytes transferred. Default is 0.
+
+        :param tile:
+            An optional tile of the form ((ystart, yend), (xstart, xend))
+            to which the event belongs.
+        """
+        tile = _tile_key(tile)
+        self._check_process()
+        with self._lock:
+            self.counts[category] += 1
+            self.seconds[category] += seconds
+            self.nbytes[category] += nbytes
+
+            if tile is not None:
+                timings = self.tiles.setdefault(tile, {})
+                timings[category] = timings.get(category, 0.0) + seconds
+
+            if self._trace is not None:
+                event = {'time': time.time(),
+                         'pid': os.getpid(),
+                         'thread': threading.current_thread().name,
+                         'category': category,
+                         'seconds': seconds,
+                         'bytes': nbytes,
+                         'tile': tile}
+                self._trace.write(json.dumps(event) + '\n')
+                self._trace.flush()
+
+    def drain(self):
+        """
+        Return the statistics accumulated so far and reset them, such
+        that a worker process can return its statistics to the parent
+        alongside each result.
+
+        :return:
+            A picklable dictionary, to be passed to `merge`.
+        """
+        self._check_process()
+        with self._lock:
+            state = {'counts': dict(self.counts),
+                     'seconds': dict(self.seconds),
+                     'bytes': dict(self.nbytes),
+                     'tiles': list(self.tiles.items())}
+            self.counts.clear()
+            self.seconds.clear()
+            self.nbytes.clear()
+            self.tiles.clear()
+
+        return state
+
+    def merge(self, state):
+        """
+        Add the statistics returned by `drain`, eg from a worker
+        process. The events are not traced again, as the worker has
+        already traced them.
+        """
+        if state is None:
+            return
+
+        self._check_process()
+        with self._lock:
+            for category, count in state['counts'].items():
+                self.counts[category] += count
+                self.seconds[category] += state['seconds'][category]
+                self.nbytes[category] += state['bytes'][category]
+
+            for tile, timings in state['tiles']:
+                merged = self.tiles.setdefault(tile, {})
+                for category, seconds in timings.items():
+                    merged[category] = merged.get(category, 0.0) + seconds
+
+    def summary(self):
+        """
+        Return the accumulated statistics.
+
+        :return:
+            A dictionary keyed by category, each containing a dictionary
+            of the count, seconds and bytes. The key 'tiles' contains a
+            list of per tile dictionaries containing the tile and the
+            seconds spent in each category.
+        """
+        with self._lock:
+            summary = {}
+            for category in self.counts:
+                summary[category] = {'count': self.counts[category],
+                                     'seconds': self.seconds[category],
+                                     'bytes': self.nbytes[category]}
+
+            tiles = []
+            for tile, timings in self.tiles.items():
+                item = dict(timings)
+                item['tile'] = tile
+                tiles.append(item)
+            summary['tiles'] = tiles
+
+        return summary
+
+    def close(self):
+        """
+        Close the trace file, if any.
+        """
+        with self._lock:
+            if self._trace is not None:
+                self._trace.close()
+                self._trace = None
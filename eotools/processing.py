@@ -0,0 +1,756 @@
+#!/usr/bin/env python
+
+# ===============================================================================
+# Copyright 2015 Geoscience Australia
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+"""
+A generic tiled processing engine; reads each tile from one or more
+stacked datasets, applies a user function, and writes the result via
+`TiledOutput`.
+"""
+
+from __future__ import absolute_import
+import collections
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import time
+from osgeo import gdal
+from eotools.tiling import generate_tiles
+from eotools.tiling import split_tile
+from eotools.tiling import order_tiles
+from eotools.tiling import decimated_shape
+from eotools.tiling import decimate_tile
+from eotools.tiling import TiledOutput
+from eotools.tiling import MultiTiledOutput
+from eotools.chunked_store import ChunkedOutput
+from eotools.chunked_store import CHUNKED_FORMAT
+from eotools.instrumentation import NULL_STATS
+
+# The task executed by worker processes; set via the pool initializer
+_TASK = None
+
+# A tile's result along with the seconds spent in each named stage,
+# see `Pipeline`
+TimedResult = collections.namedtuple('TimedResult', ['result', 'timings'])
+
+
+class OutputSpec(object):
+
+    def __init__(self, out_fname, bands=1, dtype=gdal.GDT_Float32,
+                 nodata=None, fmt="ENVI", band_names=None,
+                 async_write=False, options=None, overviews=None, cog=False,
+                 memmap=False):
+        """
+        Describes the output image created by `map_tiles`.
+
+        :param out_fname:
+            A string containing the full filepath name used for
+            creating the image on disk.
+
+        :param bands:
+            The number of bands contained in the image. Default is 1.
+
+        :param dtype:
+            An integer indicating the GDAL datatype for the output
+            image. Default is gdal.GDT_Float32.
+
+        :param nodata:
+            The no data value for the image.
+
+        :param fmt:
+            A GDAL compliant file format for the output image, or
+            'ZARR' for a chunked, compressed array store
+            (see `eotools.chunked_store.ChunkedOutput`).
+            Default is ENVI.
+
+        :param band_names:
+            An optional list of band descriptions, one for each band.
+
+        :param async_write:
+            If set to True, then tiles are written by a background
+            thread, overlapping the writes with the processing.
+            See `TiledOutput`. Default is False.
+
+        :param options:
+            An optional list of GDAL creation options.
+
+        :param overviews:
+            An optional list of overview decimation factors, filled
+            as each tile is written. See `TiledOutput`.
+
+        :param cog:
+            If set to True, then the output is finalised as a cloud
+            optimised GeoTIFF. See `TiledOutput`. Default is False.
+
+        :param memmap:
+            If set to True, then the output is preallocated and
+            written through a `numpy.memmap`, and parallel workers
+            write their tiles directly. See `TiledOutput`.
+            Default is False.
+        """
+        self.out_fname = out_fname
+        self.bands = bands
+        self.dtype = dtype
+        self.nodata = nodata
+        self.fmt = fmt
+        self.band_names = band_names
+        self.async_write = async_write
+        self.options = options
+        self.overviews = overviews
+        self.cog = cog
+        self.memmap = memmap
+
+    def create(self, samples, lines, geobox, stats=None, chunks=None,
+               async_write=None):
+        """
+        Create the output image.
+
+        :param stats:
+            An optional instance of `eotools.instrumentation.IOStats`
+            passed to the output.
+
+        :param chunks:
+            A tuple (ysize, xsize) of the processing tile dimensions,
+            used as the chunk shape of a chunked store.
+
+        :param async_write:
+            If set, overrides the `async_write` of the spec.
+
+        :return:
+            An instance of `TiledOutput`, or `ChunkedOutput` if `fmt`
+            is 'ZARR'.
+        """
+        if async_write is None:
+            async_write = self.async_write
+
+        if self.fmt == CHUNKED_FORMAT:
+            if chunks is None:
+                chunks = (min(lines, 256), min(samples, 256))
+            return ChunkedOutput(self.out_fname, samples, lines, self.bands,
+                                 geobox, nodata=self.nodata, dtype=self.dtype,
+                                 chunks=chunks, band_names=self.band_names,
+                                 stats=stats)
+
+        outds = TiledOutput(self.out_fname, samples, lines, self.bands,
+                            geobox, fmt=self.fmt, nodata=self.nodata,
+                            dtype=self.dtype, stats=stats,
+                            async_write=async_write,
+                            options=self.options, overviews=self.overviews,
+                            cog=self.cog, memmap=self.memmap)
+
+        if self.band_names is not None:
+            for i, name in enumerate(self.band_names):
+                outds.out_bands[i + 1].SetDescription(name)
+
+        return outds
+
+
+class TileTask(object):
+
+    def __init__(self, func, inputs, decimation=1, output=None):
+        """
+        A callable that reads a tile from each input and applies `func`.
+
+        :param func:
+            The function to apply to the data read for each tile.
+
+        :param inputs:
+            A dictionary mapping a name to a (dataset, raster_bands)
+            tuple, or None if there is a single unnamed input whose
+            data is passed to `func` directly.
+
+        :param decimation:
+            An integer reduction factor. If greater than 1, then tiles
+            are defined on the reduced resolution grid and read at
+            reduced resolution. Default is 1.
+
+        :param output:
+            An optional `eotools.tiling.MemmapTileWriter`. If set, then
+            each result is written directly by the worker rather than
+            returned.
+        """
+        self.func = func
+        self.inputs = inputs
+        self.decimation = decimation
+        self.output = output
+
+    def read(self, tile):
+        """
+        Read `tile` from each of the inputs.
+        """
+        data = {}
+        for name, (dataset, raster_bands) in self.inputs.items():
+            if self.decimation > 1:
+                window = decimate_tile(tile, self.decimation,
+                                       dataset.samples, dataset.lines)
+                data[name] = dataset.read_tile(window, raster_bands,
+                                               decimation=self.decimation)
+            else:
+                data[name] = dataset.read_tile(tile, raster_bands)
+
+        if list(data.keys()) == [None]:
+            return data[None]
+        return data
+
+    def __call__(self, tile):
+        """
+        Read and process `tile`.
+
+        :return:
+            A tuple (tile, result, read_time, compute_time, write_time,
+            timings). The result is None if it was written by the
+            worker, and timings is None unless `func` returned a
+            `TimedResult`.
+        """
+        st = time.time()
+        data = self.read(tile)
+        read_time = time.time() - st
+
+        st = time.time()
+        result = self.func(data)
+        compute_time = time.time() - st
+
+        timings = None
+        if isinstance(result, TimedResult):
+            result, timings = result
+
+        write_time = 0.0
+        if self.output is not None:
+            st = time.time()
+            self.output.write_tile(result, tile)
+            write_time = time.time() - st
+            result = None
+
+        return tile, result, read_time, compute_time, write_time, timings
+
+    def _stats(self):
+        """
+        The distinct instrumentation of the inputs and output, in a
+        fixed order.
+        """
+        objects = [getattr(dataset, 'stats', NULL_STATS)
+                   for dataset, _ in self.inputs.values()]
+        if self.output is not None:
+            objects.append(self.output.stats)
+
+        distinct = []
+        for stats in objects:
+            if stats.enabled and all(stats is not s for s in distinct):
+                distinct.append(stats)
+        return distinct
+
+    def drain_stats(self):
+        """
+        Return and reset the statistics accumulated by a copy of the
+        task in a worker process. See `merge_stats`.
+        """
+        return [stats.drain() for stats in self._stats()]
+
+    def merge_stats(self, states):
+        """
+        Merge the statistics returned by `drain_stats` into the
+        instrumentation of the task's inputs and output.
+        """
+        for stats, state in zip(self._stats(), states):
+            stats.merge(state)
+
+
+def _init_worker(task):
+    """
+    Install the task within a worker process.
+    """
+    global _TASK
+    _TASK = task
+
+
+def _run_task(tile):
+    """
+    Execute the installed task for `tile` within a worker process.
+
+    :return:
+        A tuple (result, states); the result of the task, and the
+        statistics recorded by the worker whilst executing it.
+    """
+    return _TASK(tile), _TASK.drain_stats()
+
+
+def _normalise_inputs(inputs):
+    """
+    Convert the supported forms of `inputs` to a dictionary mapping
+    a name to a (dataset, raster_bands) tuple.
+    """
+    if not isinstance(inputs, dict):
+        inputs = {None: inputs}
+
+    normalised = {}
+    for name, value in inputs.items():
+        if isinstance(value, tuple):
+            dataset, raster_bands = value
+        else:
+            dataset, raster_bands = value, None
+        if raster_bands is None:
+            raster_bands = list(range(1, dataset.bands + 1))
+        normalised[name] = (dataset, raster_bands)
+
+    return normalised
+
+
+def _create_output(output_spec, samples, lines, geobox, stats, chunks):
+    """
+    Create the output of `map_tiles`; a single output, or a
+    `MultiTiledOutput` for a dictionary of `OutputSpec`s.
+    """
+    if not isinstance(output_spec, dict):
+        return output_spec.create(samples, lines, geobox, stats, chunks)
+
+    # The products of each tile are queued as a single background write
+    async_write = any(spec.async_write for spec in output_spec.values())
+    outds = MultiTiledOutput(samples, lines, geobox, stats, async_write)
+    try:
+        for name, spec in output_spec.items():
+            outds.add(name, spec.create(samples, lines, geobox, stats,
+                                        chunks, async_write=False))
+    except Exception:
+        outds.close()
+        raise
+
+    return outds
+
+
+def map_tiles(func, inputs, output_spec, workers=1, prefetch=2,
+              processes=False, tiles=None, xtile=None, ytile=None,
+              progress=None, decimation=1, stats=None, halo=0,
+              coverage=None, order=None):
+    """
+    Apply a function to every tile of one or more `StackedDataset`s
+    and write the result to disk.
+
+    Tiles are read and processed by a pool of `workers`, while the
+    results are written by the calling process in tile order; or, for
+    a memory mapped output (see `OutputSpec`), by the workers directly.
+
+    :param func:
+        A function accepting the data read for a tile and returning
+        a 2D or 3D (bands, rows, cols) NumPy array. For a single
+        input the data is a 3D (bands, rows, cols) NumPy array, and
+        for multiple inputs it is a dictionary of 3D arrays keyed by
+        input name. If `processes` is True then `func` must be
+        picklable, ie a module level function or a `functools.partial`
+        of one.
+
+    :param inputs:
+        Either a single `StackedDataset`; a (`StackedDataset`,
+        raster_bands) tuple; or a dictionary mapping a name to either
+        of those forms. If raster_bands is not given, then all raster
+        bands are read. All inputs must share the same dimensions.
+
+    :param output_spec:
+        An instance of `OutputSpec` describing the output image, or a
+        dictionary mapping a name to an `OutputSpec` for functions
+        producing several products per tile. In the latter case `func`
+        returns a dictionary of arrays keyed by the same names, and the
+        outputs are written via a `MultiTiledOutput`.
+
+    :param workers:
+        The number of workers used to read and process tiles.
+        Default is 1, which processes every tile serially within
+        the calling process.
+
+    :param prefetch:
+        The number of tiles, in addition to the number of workers,
+        that are allowed to be in flight at any one time. This bounds
+        the memory held by completed tiles waiting to be written.
+        Default is 2.
+
+    :param processes:
+        If set to True, then workers are processes rather than
+        threads. Default is False (threads).
+
+    :param tiles:
+        An optional list of tiles of the form
+        ((ystart, yend), (xstart, xend)), or of (read_window,
+        core_window) pairs. Default is to use the tiling of the first
+        input, unless `xtile`, `ytile` or `halo` are given.
+
+    :param xtile:
+        The tile size in the x-direction. Default is the number of
+        samples.
+
+    :param ytile:
+        The tile size in the y-direction. Default is 10.
+
+    :param progress:
+        An optional callable, called as progress(n_done, n_tiles)
+        after each tile has been written.
+
+    :param decimation:
+        An integer reduction factor. If greater than 1, then the inputs
+        are read at reduced resolution and the output image, and any
+        `tiles`, are defined on the reduced resolution grid.
+        Default is 1.
+
+    :param stats:
+        An optional instance of `eotools.instrumentation.IOStats`.
+        If set, the compute time of each tile is recorded, and the
+        output image records its writes. Reads are recorded by the
+        input datasets' own instrumentation.
+
+    :param halo:
+        The number of pixels of overlap read around each tile, for
+        neighbourhood operations. `func` receives data covering the
+        tile plus its halo (clipped to the image bounds) and must
+        return an array of the same spatial shape; only the core of
+        the result is written. Default is 0.
+
+    :param coverage:
+        An optional instance of `eotools.tiling.CoverageIndex`, defined
+        on the full resolution grid of the inputs. Tiles containing no
+        valid data are not read or processed; the output is filled
+        with its no data value instead.
+
+    :param order:
+        An optional tile traversal order; one of 'row', 'column',
+        'hilbert' or 'morton' (see `eotools.tiling.tile_order`). Tiles
+        are handed to the workers, and written, in this order, so a
+        space filling curve keeps the tiles in flight at any one time
+        spatially close, and their source blocks and halos shared in
+        the caches. Default is the order of `tiles`, or row-major.
+
+    :return:
+        A dictionary containing the number of tiles processed and
+        skipped, and the accumulated read, compute and write times, and
+        the total wall time (seconds), using the keys tiles, skipped,
+        read, compute, write and wall. If `func` returns a
+        `TimedResult`, then the key stages holds the accumulated
+        seconds of each stage.
+    """
+    st_wall = time.time()
+    stats = NULL_STATS if stats is None else stats
+
+    inputs = _normalise_inputs(inputs)
+    datasets = [dataset for dataset, _ in inputs.values()]
+    dataset = datasets[0]
+
+    # Check that all the inputs share the same dimensions
+    for ds in datasets[1:]:
+        if (ds.samples, ds.lines) != (dataset.samples, dataset.lines):
+            msg = ("Inputs have differing dimensions: {} and {}")
+            msg = msg.format((dataset.lines, dataset.samples),
+                             (ds.lines, ds.samples))
+            raise ValueError(msg)
+
+    samples, lines = decimated_shape(dataset.samples, dataset.lines,
+                                     decimation)
+    geobox = dataset.get_geobox()
+    if decimation > 1:
+        geobox = geobox.decimate(decimation)
+
+    if tiles is None:
+        if (xtile is None and ytile is None and decimation == 1 and
+                halo == 0):
+            tiles = dataset.tiles
+        else:
+            xtile = samples if xtile is None else xtile
+            ytile = 10 if ytile is None else ytile
+            tiles = generate_tiles(samples, lines, xtile, ytile,
+                                   generator=False, halo=halo)
+
+    # Chunked outputs align their chunks to the largest tile of the
+    # tiling, regardless of which tiles are ordered first or skipped
+    cores = [split_tile(tile)[1] for tile in tiles]
+    chunks = (int(max(yend - ystart for (ystart, yend), _ in cores)),
+              int(max(xend - xstart for _, (xstart, xend) in cores)))
+
+    if order is not None:
+        tiles = order_tiles(tiles, order)
+
+    empty = []
+    if coverage is not None:
+        def full_res_core(tile):
+            core = split_tile(tile)[1]
+            if decimation > 1:
+                core = decimate_tile(core, decimation, dataset.samples,
+                                     dataset.lines)
+            return core
+
+        # Pair each tile with its full resolution core window, such
+        # that the core is tested while the tile itself is retained
+        valid, empty = coverage.split([(tile, full_res_core(tile))
+                                       for tile in tiles])
+        tiles = [tile for tile, _ in valid]
+        empty = [tile for tile, _ in empty]
+
+    n_tiles = len(tiles) + len(empty)
+    outds = _create_output(output_spec, samples, lines, geobox, stats,
+                           chunks)
+
+    # Parallel workers write directly into a memory mapped output
+    direct = None
+    if workers > 1 and getattr(outds, 'memmapped', False):
+        direct = outds.attach()
+    task = TileTask(func, inputs, decimation, direct)
+
+    summary = {'tiles': 0,
+               'skipped': 0,
+               'read': 0.0,
+               'compute': 0.0,
+               'write': 0.0,
+               'stages': collections.OrderedDict()}
+
+    def write(tile, result, read_time, compute_time, write_time, timings):
+        st = time.time()
+        if result is not None:
+            outds.write_tile(result, tile)
+        summary['write'] += time.time() - st + write_time
+        summary['read'] += read_time
+        summary['compute'] += compute_time
+        summary['tiles'] += 1
+        stats.record('compute', compute_time, tile=tile)
+        if timings is not None:
+            stages = summary['stages']
+            for name, seconds in timings:
+                stages[name] = stages.get(name, 0.0) + seconds
+                stats.record('compute:{}'.format(name), seconds, tile=tile)
+        if progress is not None:
+            progress(summary['tiles'] + summary['skipped'], n_tiles)
+
+    # Empty tiles are filled without being read or processed
+    for tile in empty:
+        st = time.time()
+        outds.fill_tile(tile)
+        summary['write'] += time.time() - st
+        summary['skipped'] += 1
+        if progress is not None:
+            progress(summary['tiles'] + summary['skipped'], n_tiles)
+
+    if workers <= 1:
+        for tile in tiles:
+            write(*task(tile))
+    else:
+        if processes:
+            pool = multiprocessing.Pool(workers, _init_worker, (task,))
+            run = _run_task
+        else:
+            pool = ThreadPool(workers)
+            run = task
+
+        def get(pending):
+            result = pending.popleft().get()
+            if processes:
+                # Return the statistics of the worker to the parent
+                result, states = result
+                task.merge_stats(states)
+            return result
+
+        # Bound the number of tiles in flight, and write in tile order
+        pending = collections.deque()
+        try:
+            for tile in tiles:
+                if len(pending) >= workers + prefetch:
+                    write(*get(pending))
+                pending.append(pool.apply_async(run, (tile,)))
+            while pending:
+                write(*get(pending))
+
+            # Let the workers exit cleanly
+            pool.close()
+        except Exception:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+            if direct is not None:
+                direct.close()
+
+    outds.close()
+
+    summary['wall'] = time.time() - st_wall
+
+    return summary
+
+
+class Pipeline(object):
+
+    def __init__(self, inputs=None):
+        """
+        A chain of named stages applied to each tile in turn, eg
+        masking, then computing, then classifying. Every stage of a
+        tile runs in the same worker, and its intermediate results
+        are held in memory only for as long as a later stage needs
+        them, so each input is read once and each product written
+        once, with no intermediate images.
+
+        The data read for a tile is available to the stages as
+        'input' for a single input, or by name for a dictionary of
+        inputs. See `map_tiles`.
+
+        Example:
+
+            >>> def apply_pq(nbar, pq):
+            ...     mask = extract_pq_flags(pq, combine=True)
+            ...     return numpy.where(mask, nbar, -999)
+            >>> pipeline = Pipeline(['nbar', 'pq'])
+            >>> pipeline.add_stage('masked', apply_pq, ['nbar', 'pq'])
+            >>> pipeline.add_stage('stats',
+            ...                    partial(bulk_stats, no_data=-999))
+            >>> pipeline.add_stage('water', WaterClassifier().classify,
+            ...                    ['masked'])
+            >>> pipeline.add_product('stats', OutputSpec('stats.img', 14))
+            >>> pipeline.add_product('water',
+            ...                      OutputSpec('water.img',
+            ...                                 dtype=gdal.GDT_Byte))
+            >>> summary = pipeline.run({'nbar': (nbar_ds, [1, 2, 3, 4, 5, 6]),
+            ...                         'pq': (pq_ds, [1])}, workers=4)
+            >>> summary['stages']
+            {'masked': 10.2, 'stats': 121.7, 'water': 33.5}
+
+        :param inputs:
+            A list of the names of the inputs, which stages may not
+            reuse. Default is ['input'], for a single input.
+        """
+        self.inputs = ['input'] if inputs is None else list(inputs)
+        self.stages = []
+        self.products = collections.OrderedDict()
+
+    def add_stage(self, name, func, requires=None):
+        """
+        Append a stage.
+
+        :param name:
+            The name of the stage's result.
+
+        :param func:
+            A function called with the results named by `requires`, as
+            positional arguments, and returning a NumPy array (or any
+            value used by later stages). If worker processes are used,
+            then `func` must be picklable.
+
+        :param requires:
+            A list of the names of the inputs or previous stages passed
+            to `func`. Default is the previous stage, or 'input' for
+            the first stage.
+        """
+        names = [stage[0] for stage in self.stages]
+        if name in names:
+            msg = "A stage named {} already exists"
+            raise ValueError(msg.format(name))
+
+        if name in self.inputs:
+            msg = "Stage {} has the same name as an input"
+            raise ValueError(msg.format(name))
+
+        if requires is None:
+            requires = [names[-1]] if names else ['input']
+
+        self.stages.append((name, func, list(requires)))
+
+    def add_product(self, name, output_spec):
+        """
+        Write the result of the stage (or input) `name` to an output
+        image.
+
+        :param output_spec:
+            An instance of `OutputSpec` describing the output image.
+        """
+        self.products[name] = output_spec
+
+    def _last_use(self):
+        """
+        The index of the last stage requiring each name.
+        """
+        last = {}
+        for i, (_, _, requires) in enumerate(self.stages):
+            for required in requires:
+                last[required] = i
+        return last
+
+    def __call__(self, data):
+        """
+        Run every stage over the data read for a single tile.
+
+        :return:
+            A `TimedResult` containing a dictionary of the products,
+            and the seconds spent in each stage.
+        """
+        if isinstance(data, dict):
+            results = dict(data)
+        else:
+            results = {'input': data}
+
+        last = self._last_use()
+        timings = []
+        for i, (name, func, requires) in enumerate(self.stages):
+            st = time.time()
+            results[name] = func(*[results[r] for r in requires])
+            timings.append((name, time.time() - st))
+
+            # Release the intermediates no longer required
+            for required in set(requires):
+                if last[required] == i and required not in self.products:
+                    del results[required]
+
+        products = dict((name, results[name]) for name in self.products)
+
+        return TimedResult(products, timings)
+
+    def validate(self, input_names):
+        """
+        Ensure every stage's requirements, and every product, are
+        available.
+
+        :param input_names:
+            The names of the inputs; ['input'] for a single input.
+        """
+        available = set(input_names)
+        for name, _, requires in self.stages:
+            if name in input_names:
+                msg = "Stage {} has the same name as an input"
+                raise ValueError(msg.format(name))
+            for required in requires:
+                if required not in available:
+                    msg = "Stage {} requires {}, which isn't available"
+                    raise ValueError(msg.format(name, required))
+            available.add(name)
+
+        if not self.products:
+            raise ValueError("The pipeline has no products")
+
+        for name in self.products:
+            if name not in available:
+                msg = "Product {} isn't an input or stage"
+                raise ValueError(msg.format(name))
+
+    def run(self, inputs, **kwargs):
+        """
+        Run the pipeline over every tile of the inputs.
+
+        :param inputs:
+            The inputs read for each tile; see `map_tiles`.
+
+        :param kwargs:
+            Any further keywords of `map_tiles`, eg workers, processes,
+            xtile, ytile, coverage or stats.
+
+        :return:
+            The summary returned by `map_tiles`, whose key stages
+            contains the accumulated seconds of each stage.
+        """
+        if isinstance(inputs, dict):
+            self.validate(list(inputs))
+        else:
+            self.validate(['input'])
+
+        return map_tiles(self, inputs, dict(self.products), **kwargs)
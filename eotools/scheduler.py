@@ -0,0 +1,415 @@
+#!/usr/bin/env python
+
+# ===============================================================================
+# Copyright 2015 Geoscience Australia
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+"""
+Dynamic work queues, as an alternative to the static partitioning of
+`eotools.tiling.scatter`. Workers repeatedly claim small chunks of
+items (eg tile indices) until none remain, so workers given cheap
+tiles simply claim more of them.
+
+    * `WorkQueue`; shared between the processes of a single node.
+    * `FileWorkQueue`; shared between nodes via a file on a shared
+      file system, guarded by a lock.
+
+Both record the items processed and the time each worker spent busy,
+such that `report` gives the utilisation of every worker.
+
+Example:
+
+    >>> tiles = ds.tiles
+    >>> queue = WorkQueue(len(tiles), workers=4, chunk_size=2, steal=True)
+    >>> def work(worker):
+    ...     for i in queue.iterate(worker):
+    ...         process(tiles[i])
+    >>> procs = [multiprocessing.Process(target=work, args=(w,))
+    ...          for w in range(4)]
+    >>> for proc in procs:
+    ...     proc.start()
+    >>> for proc in procs:
+    ...     proc.join()
+    >>> for item in queue.report():
+    ...     print(item['worker'], item['items'], item['utilisation'])
+"""
+
+from __future__ import absolute_import
+import fcntl
+import json
+import multiprocessing
+import os
+import socket
+import time
+
+# The layout of each worker's statistics within the shared array
+_ITEMS, _CLAIMS, _STEALS, _BUSY, _START, _END = range(6)
+_N_STATS = 6
+
+
+def _report(stats):
+    """
+    Convert per worker statistics to a report, computing the
+    utilisation relative to the wall time of the whole run.
+
+    :param stats:
+        A list of (worker, items, claims, steals, busy, start, end)
+        tuples. Workers that never started have a start of 0.
+    """
+    started = [s for s in stats if s[5] > 0]
+    if started:
+        wall = max(s[6] for s in started) - min(s[5] for s in started)
+    else:
+        wall = 0.0
+
+    report = []
+    for worker, items, claims, steals, busy, start, end in stats:
+        utilisation = busy / wall if wall > 0 else 0.0
+        report.append({'worker': worker,
+                       'items': int(items),
+                       'claims': int(claims),
+                       'steals': int(steals),
+                       'busy': busy,
+                       'wall': wall,
+                       'utilisation': utilisation})
+
+    return report
+
+
+class _Queue(object):
+
+    """
+    The claim loop shared by the work queues.
+    """
+
+    def claim(self, worker):
+        raise NotImplementedError
+
+    def _record(self, worker, busy, start=None, end=None):
+        raise NotImplementedError
+
+    def iterate(self, worker):
+        """
+        A generator yielding the items claimed by `worker`, until the
+        queue is exhausted. The time between each item being yielded
+        and the next being requested is recorded as busy time.
+
+        :param worker:
+            The worker identifier.
+        """
+        self._record(worker, 0.0, start=time.time())
+        busy = 0.0
+        try:
+            while True:
+                items = self.claim(worker)
+                if not items:
+                    break
+                for item in items:
+                    st = time.time()
+                    yield item
+                    busy += time.time() - st
+
+                # Publish the busy time with every claim
+                self._record(worker, busy)
+                busy = 0.0
+        finally:
+            self._record(worker, busy, end=time.time())
+
+
+class WorkQueue(_Queue):
+
+    def __init__(self, n_items, workers, chunk_size=1, steal=False):
+        """
+        A work queue shared by the processes of a single node. It must
+        be created before the worker processes, and passed to them
+        either on creation, or as an initializer argument of a
+        `multiprocessing.Pool`.
+
+        :param n_items:
+            The number of items; claims are of item indices
+            0 to n_items - 1.
+
+        :param workers:
+            The number of workers. Workers are identified by an integer
+            from 0 to workers - 1.
+
+        :param chunk_size:
+            The number of items taken with each claim. Larger chunks
+            reduce contention, smaller chunks balance the load more
+            finely. Default is 1.
+
+        :param steal:
+            If set to False (Default), then every worker claims the next
+            chunk from a single shared counter. If set to True, then
+            the items are initially divided into contiguous blocks, one
+            per worker (as per `scatter`), to keep each worker's tiles
+            spatially close; a worker that runs out steals the second
+            half of the largest remaining block.
+        """
+        self.n_items = n_items
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.steal = steal
+
+        self._lock = multiprocessing.Lock()
+        self._next = multiprocessing.Value('l', 0, lock=False)
+        self._ranges = multiprocessing.Array('l', 2 * workers, lock=False)
+        self._stats = multiprocessing.Array('d', _N_STATS * workers,
+                                            lock=False)
+
+        q, r = n_items // workers, n_items % workers
+        for i in range(workers):
+            self._ranges[2 * i] = i * q + min(i, r)
+            self._ranges[2 * i + 1] = (i + 1) * q + min(i + 1, r)
+
+    def claim(self, worker):
+        """
+        Claim the next chunk of items for `worker`.
+
+        :return:
+            A list of item indices, which is empty once the queue is
+            exhausted.
+        """
+        with self._lock:
+            if not self.steal:
+                start = self._next.value
+                end = min(start + self.chunk_size, self.n_items)
+                self._next.value = end
+            else:
+                start, end = self._claim_range(worker)
+
+            if end > start:
+                stats = _N_STATS * worker
+                self._stats[stats + _ITEMS] += end - start
+                self._stats[stats + _CLAIMS] += 1
+
+        return list(range(start, end))
+
+    def _claim_range(self, worker):
+        """
+        Claim a chunk from the worker's own block, stealing half of the
+        largest remaining block if it is exhausted. The lock must be
+        held.
+        """
+        ranges = self._ranges
+        start = ranges[2 * worker]
+        end = ranges[2 * worker + 1]
+
+        if start >= end:
+            remaining = [ranges[2 * i + 1] - ranges[2 * i]
+                         for i in range(self.workers)]
+            victim = remaining.index(max(remaining))
+            if remaining[victim] <= 0:
+                return 0, 0
+
+            # Take the back half, leaving the victim its next items
+            half = (remaining[victim] + 1) // 2
+            end = ranges[2 * victim + 1]
+            start = end - half
+            ranges[2 * victim + 1] = start
+            self._stats[_N_STATS * worker + _STEALS] += 1
+
+        claimed = min(start + self.chunk_size, end)
+        ranges[2 * worker] = claimed
+        ranges[2 * worker + 1] = end
+
+        return start, claimed
+
+    def _record(self, worker, busy, start=None, end=None):
+        """
+        Accumulate the busy time, and optionally the start and end
+        times, of `worker`.
+        """
+        stats = _N_STATS * worker
+        with self._lock:
+            self._stats[stats + _BUSY] += busy
+            if start is not None:
+                self._stats[stats + _START] = start
+            if end is not None:
+                self._stats[stats + _END] = end
+
+    def report(self):
+        """
+        Report the statistics of every worker.
+
+        :return:
+            A list containing a dictionary for each worker, with the
+            keys worker, items, claims, steals, busy (seconds), wall
+            (the seconds from the first worker starting to the last
+            finishing) and utilisation (busy / wall).
+        """
+        with self._lock:
+            stats = []
+            for worker in range(self.workers):
+                values = self._stats[_N_STATS * worker:
+                                     _N_STATS * (worker + 1)]
+                stats.append(tuple([worker] + list(values)))
+
+        return _report(stats)
+
+
+class FileWorkQueue(_Queue):
+
+    def __init__(self, fname, n_items=None, chunk_size=1):
+        """
+        A work queue held in a JSON document on a shared file system,
+        for workers spread across several nodes. Every claim is made
+        while holding a POSIX (fcntl) lock on a companion lock file.
+
+        :param fname:
+            A string containing the full file path name of the queue
+            document.
+
+        :param n_items:
+            The number of items. If the queue document doesn't exist,
+            then it is created with this many items; otherwise the
+            existing queue is joined. Default is None (join only).
+
+        :param chunk_size:
+            The number of items taken with each claim. As each claim
+            involves a round trip to the shared file system, chunks
+            should be larger than for `WorkQueue`. Default is 1.
+
+        Workers may be identified by any string, and default to
+        <hostname>:<pid>. Start and end times are taken from each
+        node's clock, so utilisation assumes the clocks are in sync.
+        """
+        self.fname = fname
+        self.lock_fname = fname + '.lock'
+        self.chunk_size = chunk_size
+
+        with self._locked():
+            if not os.path.exists(fname):
+                if n_items is None:
+                    msg = "No work queue at {}, and n_items wasn't given"
+                    raise IOError(msg.format(fname))
+                self._write({'n_items': n_items, 'next': 0, 'workers': {}})
+
+        self.n_items = self._read()['n_items']
+
+    def _locked(self):
+        """
+        A context manager holding the exclusive lock.
+        """
+        return _FileLock(self.lock_fname)
+
+    def _read(self):
+        with open(self.fname, 'r') as src:
+            return json.load(src)
+
+    def _write(self, state):
+        """
+        Replace the queue document atomically.
+        """
+        tmp_fname = '{}.{}.{}.tmp'.format(self.fname, socket.gethostname(),
+                                          os.getpid())
+        with open(tmp_fname, 'w') as src:
+            json.dump(state, src)
+            src.flush()
+            os.fsync(src.fileno())
+        os.rename(tmp_fname, self.fname)
+
+    @staticmethod
+    def default_worker():
+        """
+        The default worker identifier; <hostname>:<pid>.
+        """
+        return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+    def _worker_state(self, state, worker):
+        default = {'items': 0, 'claims': 0, 'busy': 0.0, 'start': 0.0,
+                   'end': 0.0}
+        return state['workers'].setdefault(worker, default)
+
+    def claim(self, worker=None):
+        """
+        Claim the next chunk of items.
+
+        :return:
+            A list of item indices, which is empty once the queue is
+            exhausted.
+        """
+        worker = self.default_worker() if worker is None else worker
+        with self._locked():
+            state = self._read()
+            start = state['next']
+            end = min(start + self.chunk_size, state['n_items'])
+            if end > start:
+                state['next'] = end
+                item = self._worker_state(state, worker)
+                item['items'] += end - start
+                item['claims'] += 1
+                self._write(state)
+
+        return list(range(start, end))
+
+    def iterate(self, worker=None):
+        """
+        See `WorkQueue.iterate`. The worker defaults to
+        <hostname>:<pid>.
+        """
+        worker = self.default_worker() if worker is None else worker
+        return _Queue.iterate(self, worker)
+
+    def _record(self, worker, busy, start=None, end=None):
+        with self._locked():
+            state = self._read()
+            item = self._worker_state(state, worker)
+            item['busy'] += busy
+            if start is not None:
+                item['start'] = start
+            if end is not None:
+                item['end'] = end
+            self._write(state)
+
+    def report(self):
+        """
+        Report the statistics of every worker that has joined the
+        queue. See `WorkQueue.report`; there is no stealing, so steals
+        are always 0.
+        """
+        with self._locked():
+            state = self._read()
+
+        stats = []
+        for worker in sorted(state['workers']):
+            item = state['workers'][worker]
+            stats.append((worker, item['items'], item['claims'], 0,
+                          item['busy'], item['start'], item['end']))
+
+        return _report(stats)
+
+
+class _FileLock(object):
+
+    """
+    An exclusive POSIX lock on a file, which unlike flock is honoured
+    across NFS clients.
+    """
+
+    def __init__(self, fname):
+        self.fname = fname
+        self._fd = None
+
+    def __enter__(self):
+        self._fd = os.open(self.fname, os.O_RDWR | os.O_CREAT)
+        fcntl.lockf(self._fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        fcntl.lockf(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
+        return False
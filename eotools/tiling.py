@@ -17,13 +17,25 @@
 # ===============================================================================
 
 from __future__ import absolute_import
+import collections
+import threading
 import gdal
+import gdal_array
+import os
 import numpy
+from eotools.instrumentation import NULL_STATS
+from eotools.drivers.raw import RAW_DRIVERS
+from eotools.drivers.raw import raw_layout
+from eotools.drivers.raw import open_memmap
 
 # Author: Josh Sixsmith; joshua.sixsmith@ga.gov.au
 
+# The supported tile traversal orders
+TILE_ORDERS = ('row', 'column', 'hilbert', 'morton')
 
-def generate_tiles(samples, lines, xtile=100, ytile=100, generator=True):
+
+def generate_tiles(samples, lines, xtile=100, ytile=100, generator=True,
+                   halo=0, coverage=None, order='row'):
     """
     Generates a list of tile indices for a 2D array.
     If generator is set to True (Default), then a Python generator
@@ -48,6 +60,22 @@ def generate_tiles(samples, lines, xtile=100, ytile=100, generator=True):
         rather than a list.  True (Default) will return a Python
         generator object.
 
+    :param halo:
+        (Optional) The number of pixels of overlap with neighbouring
+        tiles, for neighbourhood operations such as focal filters.
+        Default is 0 (disjoint tiles).
+
+    :param coverage:
+        (Optional) An instance of `CoverageIndex`. If set, then tiles
+        containing no valid data are skipped.
+
+    :param order:
+        (Optional) The order in which the tiles are traversed; one of
+        'row' (row-major), 'column' (column-major), 'hilbert' or
+        'morton' (Z-order). The space filling curves keep consecutive
+        tiles spatially close, improving the re-use of cached source
+        blocks and halos. Default is 'row'.
+
     :return:
         If generator is set to True (Default), then a Python generator
         object will be returned. If set to False then a list of tuples
@@ -55,6 +83,12 @@ def generate_tiles(samples, lines, xtile=100, ytile=100, generator=True):
         array.
         Each tuple in the list or generator contains
         ((ystart,yend),(xstart,xend)).
+        If `halo` is greater than 0, then each item is instead a
+        (read_window, core_window) pair of tiles, where the read window
+        is the core window expanded by `halo` pixels and clipped to
+        the array bounds. The core windows are disjoint and cover the
+        array. `StackedDataset.read_tile` reads the read window of a
+        pair and `TiledOutput.write_tile` writes its core window.
 
     Example:
 
@@ -74,26 +108,45 @@ def generate_tiles(samples, lines, xtile=100, ytile=100, generator=True):
         >>>     # Or simply move the tile window across an array
         >>>     subset = array[ystart:yend,xstart:xend] # 2D
         >>>     subset = array[:,ystart:yend,xstart:xend] # 3D
+        >>> # A 3x3 focal filter without seams
+        >>> for tile in generate_tiles(samples, lines, 1000, 400, halo=1):
+        >>>     subset = ds.read_tile(tile, 1)
+        >>>     outds.write_tile(median_filter(subset, 3), tile)
     """
     def create_tiles(samples, lines, xstart, ystart):
         """
         Creates a generator object for the tiles.
         """
-        for ystep in ystart:
+        rows, cols = tile_order(len(ystart), len(xstart), order)
+        for row, col in zip(rows, cols):
+            ystep = ystart[row]
+            xstep = xstart[col]
             if ystep + ytile < lines:
                 yend = ystep + ytile
             else:
                 yend = lines
-            for xstep in xstart:
-                if xstep + xtile < samples:
-                    xend = xstep + xtile
-                else:
-                    xend = samples
-                yield ((ystep, yend), (xstep, xend))
+            if xstep + xtile < samples:
+                xend = xstep + xtile
+            else:
+                xend = samples
+            tile = ((ystep, yend), (xstep, xend))
+            if coverage is not None and coverage.is_empty(tile):
+                continue
+            if halo > 0:
+                window = ((max(ystep - halo, 0), min(yend + halo, lines)),
+                          (max(xstep - halo, 0), min(xend + halo, samples)))
+                yield (window, tile)
+            else:
+                yield tile
 
     xstart = numpy.arange(0, samples, xtile)
     ystart = numpy.arange(0, lines, ytile)
 
+    # Validate the order before any tiles are requested
+    if order not in TILE_ORDERS:
+        msg = "Unknown tile order {}; expected one of {}"
+        raise ValueError(msg.format(order, TILE_ORDERS))
+
     tiles = create_tiles(samples, lines, xstart, ystart)
     if generator:
         return tiles
@@ -101,10 +154,934 @@ def generate_tiles(samples, lines, xtile=100, ytile=100, generator=True):
         return list(tiles)
 
 
+def plan_tile_size(samples, lines, bands, dtype, budget, cost=1.0,
+                   block_size=None, workers=1, halo=0,
+                   work_dtype='float32'):
+    """
+    Plans the largest tile shape whose memory requirement fits within
+    a budget, aligned to the block size of the input.
+
+    The memory required per pixel is that of the input itself plus
+    the algorithm's working memory:
+
+        bands * (dtype.itemsize + cost * work_dtype.itemsize)
+
+    :param samples:
+        An integer expressing the total number of samples in an array.
+
+    :param lines:
+        An integer expressing the total number of lines in an array.
+
+    :param bands:
+        The number of bands read for each tile.
+
+    :param dtype:
+        The NumPy datatype of the input.
+
+    :param budget:
+        The memory budget in bytes, shared by all the workers.
+
+    :param cost:
+        The working memory of the algorithm as a multiple of the input
+        in `work_dtype`, eg `eotools.bulk_stats.MEMORY_COST` for
+        `bulk_stats`. Default is 1.0.
+
+    :param block_size:
+        A tuple (xsize, ysize) of the block size of the input. Tiles
+        are a whole number of blocks, other than at the image edges.
+        If a single block exceeds the budget, then the alignment is
+        relaxed. Default is None (no alignment).
+
+    :param workers:
+        The number of tiles held in memory at once. Default is 1.
+
+    :param halo:
+        The number of pixels of overlap read around each tile.
+        Default is 0.
+
+    :param work_dtype:
+        The NumPy datatype of the algorithm's working arrays.
+        Default is float32.
+
+    :return:
+        A tuple (xtile, ytile) of the tile shape, suitable for
+        `generate_tiles` or `StackedDataset.init_tiling`.
+
+    Example:
+
+        >>> from eotools.bulk_stats import MEMORY_COST
+        >>> xtile, ytile = plan_tile_size(8624, 7567, 400, 'int16', 2**30,
+        ...                               MEMORY_COST, (8624, 1), workers=4)
+        >>> xtile, ytile
+        (8624, 3)
+    """
+    pixel_bytes = bands * (numpy.dtype(dtype).itemsize +
+                           cost * numpy.dtype(work_dtype).itemsize)
+    max_pixels = budget / float(max(workers, 1)) / pixel_bytes
+
+    if block_size is None:
+        block_size = (1, 1)
+    bxsize = max(min(int(block_size[0]), samples), 1)
+    bysize = max(min(int(block_size[1]), lines), 1)
+
+    # Relax the alignment, first in y then in x, until a tile fits
+    for bx, by in [(bxsize, bysize), (bxsize, 1), (1, 1)]:
+        # Every block aligned width, and the tallest aligned height for each
+        xtile = numpy.arange(bx, samples + bx, bx)
+        xtile = numpy.minimum(xtile, samples)
+        ytile = numpy.floor(max_pixels / (xtile + 2 * halo)) - 2 * halo
+        ytile = numpy.minimum((ytile // by) * by, lines)
+
+        # An image edge is also a valid tile boundary
+        ytile = numpy.where(max_pixels / (xtile + 2 * halo) - 2 * halo >=
+                            lines, lines, ytile)
+
+        fits = ytile >= 1
+        if fits.any():
+            xtile = xtile[fits]
+            ytile = ytile[fits].astype('int64')
+            # The largest area, preferring wider tiles
+            best = numpy.lexsort((xtile, xtile * ytile))[-1]
+            return int(xtile[best]), int(ytile[best])
+
+    msg = "A budget of {} bytes can't hold a single pixel of {} bytes"
+    raise ValueError(msg.format(budget, pixel_bytes * max(workers, 1)))
+
+
+def _hilbert_index(rows, cols, n):
+    """
+    The distance along a Hilbert curve, covering an n x n grid where
+    n is a power of 2, of each (row, col) grid position.
+    """
+    x = cols.copy()
+    y = rows.copy()
+    index = numpy.zeros(x.shape, dtype='int64')
+    s = n // 2
+    while s > 0:
+        rx = ((x & s) > 0).astype('int64')
+        ry = ((y & s) > 0).astype('int64')
+        index += s * s * ((3 * rx) ^ ry)
+
+        # Rotate the quadrant
+        flip = (ry == 0) & (rx == 1)
+        x = numpy.where(flip, n - 1 - x, x)
+        y = numpy.where(flip, n - 1 - y, y)
+        swap = ry == 0
+        x, y = numpy.where(swap, y, x), numpy.where(swap, x, y)
+        s //= 2
+
+    return index
+
+
+def _morton_index(rows, cols, n):
+    """
+    The Z-order (Morton) index, covering an n x n grid where n is
+    a power of 2, of each (row, col) grid position.
+    """
+    index = numpy.zeros(rows.shape, dtype='int64')
+    bit = 0
+    while (1 << bit) < n:
+        index |= ((cols >> bit) & 1) << (2 * bit)
+        index |= ((rows >> bit) & 1) << (2 * bit + 1)
+        bit += 1
+
+    return index
+
+
+def _curve_index(rows, cols, order):
+    """
+    The sort key of each (row, col) grid position for the given
+    traversal order.
+    """
+    rows = numpy.asarray(rows, dtype='int64')
+    cols = numpy.asarray(cols, dtype='int64')
+    if rows.size == 0:
+        return rows
+
+    nrows = int(rows.max()) + 1
+    ncols = int(cols.max()) + 1
+
+    if order == 'row':
+        return rows * ncols + cols
+    if order == 'column':
+        return cols * nrows + rows
+
+    # The curves are defined over a square, power of 2 grid
+    n = 1
+    while n < max(nrows, ncols):
+        n *= 2
+
+    if order == 'hilbert':
+        return _hilbert_index(rows, cols, n)
+    if order == 'morton':
+        return _morton_index(rows, cols, n)
+
+    msg = "Unknown tile order {}; expected one of {}"
+    raise ValueError(msg.format(order, TILE_ORDERS))
+
+
+def tile_order(nrows, ncols, order='row'):
+    """
+    The traversal order of a grid of tiles.
+
+    :param nrows:
+        The number of rows of tiles.
+
+    :param ncols:
+        The number of columns of tiles.
+
+    :param order:
+        One of 'row' (row-major), 'column' (column-major), 'hilbert'
+        or 'morton' (Z-order). Grids that aren't a square power of 2
+        in size visit the positions of the enclosing curve that lie
+        within the grid. Default is 'row'.
+
+    :return:
+        A tuple (rows, cols) of NumPy arrays containing the grid
+        position of each tile in traversal order.
+    """
+    rows, cols = numpy.divmod(numpy.arange(nrows * ncols), max(ncols, 1))
+    index = numpy.argsort(_curve_index(rows, cols, order), kind='mergesort')
+
+    return rows[index], cols[index]
+
+
+def order_tiles(tiles, order='row'):
+    """
+    Re-order an arbitrary list of tiles, eg the tiles of a
+    `StackedDataset`, by their position within the tile grid.
+
+    :param tiles:
+        A list of tiles of the form ((ystart, yend), (xstart, xend)),
+        or of (read_window, core_window) pairs.
+
+    :param order:
+        One of 'row' (row-major), 'column' (column-major), 'hilbert'
+        or 'morton' (Z-order). See `tile_order`. Default is 'row'.
+
+    :return:
+        A new list of the tiles in traversal order.
+    """
+    tiles = list(tiles)
+    if len(tiles) == 0:
+        return tiles
+
+    cores = [split_tile(tile)[1] for tile in tiles]
+    ystart = numpy.array([core[0][0] for core in cores])
+    xstart = numpy.array([core[1][0] for core in cores])
+
+    # The grid position is the rank of the tile's start co-ordinates
+    rows = numpy.unique(ystart, return_inverse=True)[1]
+    cols = numpy.unique(xstart, return_inverse=True)[1]
+    index = numpy.argsort(_curve_index(rows, cols, order), kind='mergesort')
+
+    return [tiles[i] for i in index]
+
+
+# The record of a single tile within a `TileIndex`
+TILE_DTYPE = numpy.dtype([('ystart', 'int64'),
+                          ('yend', 'int64'),
+                          ('xstart', 'int64'),
+                          ('xend', 'int64')])
+
+
+class TileIndex(object):
+
+    def __init__(self, array, samples, lines, halo=0):
+        """
+        A compact, array backed list of tiles; a drop in replacement
+        for the list returned by `generate_tiles`, that stores each
+        tile as a single record of a structured NumPy array rather
+        than as nested tuples.
+
+        Indexing with an integer returns a tile of the form
+        ((ystart, yend), (xstart, xend)), or a (read_window,
+        core_window) pair if `halo` is greater than 0. Indexing with a
+        slice, or an array of indices or booleans, returns a new
+        `TileIndex`.
+
+        :param array:
+            A NumPy array of dtype `TILE_DTYPE`.
+
+        :param samples:
+            An integer expressing the total number of samples in the
+            tiled array.
+
+        :param lines:
+            An integer expressing the total number of lines in the
+            tiled array.
+
+        :param halo:
+            The number of pixels of overlap read around each tile.
+            Default is 0.
+
+        Example:
+
+            >>> index = TileIndex.from_grid(100000, 100000, 256, 256)
+            >>> len(index)
+            152881
+            >>> index[0]
+            ((0, 256), (0, 256))
+            >>> index.tile_of(1000, 300)
+            394
+            >>> parts = index.shuffle(seed=0).partition(8)
+        """
+        self.array = numpy.asarray(array, dtype=TILE_DTYPE)
+        self.samples = samples
+        self.lines = lines
+        self.halo = halo
+        self._lookup = None
+
+    @classmethod
+    def from_grid(cls, samples, lines, xtile=100, ytile=100, order='row',
+                  halo=0):
+        """
+        Build the index of a regular grid of tiles without creating any
+        Python objects per tile. The arguments match `generate_tiles`.
+        """
+        ystart = numpy.arange(0, lines, ytile)
+        xstart = numpy.arange(0, samples, xtile)
+        rows, cols = tile_order(len(ystart), len(xstart), order)
+
+        array = numpy.empty(len(rows), dtype=TILE_DTYPE)
+        array['ystart'] = ystart[rows]
+        array['yend'] = numpy.minimum(array['ystart'] + ytile, lines)
+        array['xstart'] = xstart[cols]
+        array['xend'] = numpy.minimum(array['xstart'] + xtile, samples)
+
+        return cls(array, samples, lines, halo)
+
+    @classmethod
+    def from_tiles(cls, tiles, samples, lines, halo=0):
+        """
+        Build the index from a list of tiles of the form
+        ((ystart, yend), (xstart, xend)), or of (read_window,
+        core_window) pairs.
+        """
+        cores = [split_tile(tile)[1] for tile in tiles]
+        array = numpy.array([(ys, ye, xs, xe)
+                             for (ys, ye), (xs, xe) in cores],
+                            dtype=TILE_DTYPE)
+
+        return cls(array, samples, lines, halo)
+
+    def __len__(self):
+        return len(self.array)
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, numpy.integer)):
+            return self._tile(self.array[key])
+        return TileIndex(self.array[key], self.samples, self.lines,
+                         self.halo)
+
+    def __iter__(self):
+        for record in self.array:
+            yield self._tile(record)
+
+    def __eq__(self, other):
+        if isinstance(other, TileIndex):
+            return ((self.samples, self.lines, self.halo) ==
+                    (other.samples, other.lines, other.halo) and
+                    numpy.array_equal(self.array, other.array))
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    def _tile(self, record):
+        """
+        Convert a single record to a tile.
+        """
+        ystart, yend, xstart, xend = [int(v) for v in record]
+        tile = ((ystart, yend), (xstart, xend))
+        if self.halo > 0:
+            halo = self.halo
+            window = ((max(ystart - halo, 0), min(yend + halo, self.lines)),
+                      (max(xstart - halo, 0),
+                       min(xend + halo, self.samples)))
+            return (window, tile)
+        return tile
+
+    def tolist(self):
+        """
+        The tiles as a list, as returned by `generate_tiles`.
+        """
+        return list(self)
+
+    def shuffle(self, seed=None):
+        """
+        Return a new index containing the tiles in a random order,
+        eg to balance the load of unevenly expensive tiles.
+
+        :param seed:
+            An optional seed for the random number generator.
+        """
+        state = numpy.random.RandomState(seed)
+        return self[state.permutation(len(self))]
+
+    def partition(self, n):
+        """
+        Split the index into `n` contiguous parts of roughly equal
+        size, one for each of `n` workers. See `scatter`.
+
+        :return:
+            A list of `n` instances of `TileIndex`.
+        """
+        return scatter(self, n)
+
+    def tile_of(self, x, y):
+        """
+        Find the tile containing the image co-ordinate (x, y).
+
+        :param x:
+            The x (sample) co-ordinate; an integer or an array of
+            integers.
+
+        :param y:
+            The y (line) co-ordinate; an integer or an array of
+            integers.
+
+        :return:
+            The position within the index of the tile containing each
+            co-ordinate, or -1 where no tile contains it.
+        """
+        if self._lookup is None:
+            self._lookup = self._build_lookup()
+        ybounds, xbounds, grid = self._lookup
+
+        x, y = numpy.broadcast_arrays(x, y)
+        shape = x.shape
+        x = x.ravel()
+        y = y.ravel()
+
+        row = numpy.searchsorted(ybounds, y, side='right') - 1
+        col = numpy.searchsorted(xbounds, x, side='right') - 1
+        inside = ((row >= 0) & (row < grid.shape[0]) &
+                  (col >= 0) & (col < grid.shape[1]))
+
+        position = numpy.full(x.shape, -1, dtype='int64')
+        position[inside] = grid[row[inside], col[inside]]
+
+        # Exclude co-ordinates in gaps between the tiles
+        found = position >= 0
+        record = self.array[position[found]]
+        found[found] = ((record['yend'] > y[found]) &
+                        (record['xend'] > x[found]))
+        position[~found] = -1
+
+        if len(shape) == 0:
+            return int(position[0])
+        return position.reshape(shape)
+
+    def _build_lookup(self):
+        """
+        Build a grid mapping each (row, column) of tile start
+        co-ordinates to the position of the tile within the index.
+        """
+        ybounds, rows = numpy.unique(self.array['ystart'],
+                                     return_inverse=True)
+        xbounds, cols = numpy.unique(self.array['xstart'],
+                                     return_inverse=True)
+        grid = numpy.full((len(ybounds), len(xbounds)), -1, dtype='int64')
+        grid[rows, cols] = numpy.arange(len(self.array))
+
+        return ybounds, xbounds, grid
+
+
+class CoverageIndex(object):
+
+    def __init__(self, mask, decimation, samples, lines):
+        """
+        A low resolution index of where an image contains valid data,
+        used to skip tiles that contain none.
+
+        :param mask:
+            A 2D boolean NumPy array, at 1/`decimation` resolution of
+            the image, set to True wherever there is valid data.
+            The mask is dilated by a single (low resolution) pixel, so
+            that valid data missed by the low resolution sampling
+            isn't skipped.
+
+        :param decimation:
+            The reduction factor of `mask` relative to the image.
+
+        :param samples:
+            The number of samples in the full resolution image.
+
+        :param lines:
+            The number of lines in the full resolution image.
+        """
+        mask = numpy.asarray(mask, dtype='bool')
+        dilated = mask.copy()
+        dilated[1:] |= mask[:-1]
+        dilated[:-1] |= mask[1:]
+        rows = dilated.copy()
+        dilated[:, 1:] |= rows[:, :-1]
+        dilated[:, :-1] |= rows[:, 1:]
+
+        self.mask = dilated
+        self.decimation = decimation
+        self.samples = samples
+        self.lines = lines
+
+    @property
+    def coverage(self):
+        """
+        The fraction of the (low resolution) image containing valid data.
+        """
+        return self.mask.mean()
+
+    def is_empty(self, tile):
+        """
+        True if `tile` contains no valid data. For a (read_window,
+        core_window) pair the core window is tested.
+        """
+        (ystart, yend), (xstart, xend) = split_tile(tile)[1]
+        d = self.decimation
+        subset = self.mask[int(ystart) // d:(int(yend) + d - 1) // d,
+                           int(xstart) // d:(int(xend) + d - 1) // d]
+        return not subset.any()
+
+    def split(self, tiles):
+        """
+        Split a list of tiles into those containing valid data and
+        those that are empty.
+
+        :return:
+            A tuple (valid_tiles, empty_tiles).
+        """
+        valid = []
+        empty = []
+        for tile in tiles:
+            if self.is_empty(tile):
+                empty.append(tile)
+            else:
+                valid.append(tile)
+        return valid, empty
+
+
+def split_tile(tile):
+    """
+    Split a tile into its read and core windows.
+
+    :param tile:
+        Either a tile of the form ((ystart, yend), (xstart, xend)),
+        or a (read_window, core_window) pair of such tiles as produced
+        by `generate_tiles` when using a halo.
+
+    :return:
+        A tuple (read_window, core_window). For a plain tile both
+        windows are the tile itself.
+    """
+    if isinstance(tile[0][0], (tuple, list)):
+        return tile[0], tile[1]
+    return tile, tile
+
+
+def crop_tile(array, tile):
+    """
+    Crop an array read using the read window of `tile` to its core
+    window.
+
+    :param array:
+        A 2D or 3D NumPy array covering the read window of `tile`,
+        with the spatial dimensions last.
+
+    :param tile:
+        A tile, or a (read_window, core_window) pair of tiles.
+        See `split_tile`.
+
+    :return:
+        A tuple (array, core_window).
+    """
+    window, core = split_tile(tile)
+    if window is core:
+        return array, core
+
+    (rys, _), (rxs, _) = window
+    (ys, ye), (xs, xe) = core
+    subset = array[..., ys - rys:ye - rys, xs - rxs:xe - rxs]
+
+    return subset, core
+
+
+def decimated_shape(samples, lines, decimation):
+    """
+    The dimensions of an array reduced in resolution by `decimation`.
+
+    :param samples:
+        An integer expressing the total number of samples in an array.
+
+    :param lines:
+        An integer expressing the total number of lines in an array.
+
+    :param decimation:
+        An integer reduction factor applied to both dimensions.
+
+    :return:
+        A tuple (samples, lines) of the reduced resolution array.
+    """
+    samples = (samples + decimation - 1) // decimation
+    lines = (lines + decimation - 1) // decimation
+    return samples, lines
+
+
+def decimate_tile(tile, decimation, samples, lines):
+    """
+    Convert a tile defined on a reduced resolution grid into the
+    window it covers at full resolution.
+
+    :param tile:
+        A tuple of the form ((ystart, yend), (xstart, xend)) defined
+        on the reduced resolution grid, or a (read_window, core_window)
+        pair of them.
+
+    :param decimation:
+        An integer reduction factor applied to both dimensions.
+
+    :param samples:
+        The number of samples in the full resolution array.
+
+    :param lines:
+        The number of lines in the full resolution array.
+
+    :return:
+        A tuple of the form ((ystart, yend), (xstart, xend)) defined
+        on the full resolution grid. Reading this window with the
+        same `decimation` yields a block the size of `tile`. For a
+        pair, both windows are converted and a pair is returned.
+
+    Example:
+
+        >>> decimate_tile(((10, 20), (0, 5)), 8, 42, 150)
+        ((80, 150), (0, 40))
+    """
+    if isinstance(tile[0][0], (tuple, list)):
+        return tuple(decimate_tile(window, decimation, samples, lines)
+                     for window in tile)
+
+    (ystart, yend), (xstart, xend) = tile
+    window = ((ystart * decimation, min(yend * decimation, lines)),
+              (xstart * decimation, min(xend * decimation, samples)))
+    return window
+
+
+# GDAL reports the interleave of some raw formats by their ENVI names
+INTERLEAVE_ALIASES = {'BSQ': 'BAND',
+                      'BIL': 'LINE',
+                      'BIP': 'PIXEL'}
+
+
+def decimated_index(start, size, decimation):
+    """
+    The pixels sampled by a reduced resolution read of a window, or
+    by a nearest neighbour overview, such that memory mapped reads and
+    overviews sample the same pixels as GDAL's nearest neighbour
+    resampling; the pixel nearest the centre of each output pixel.
+
+    :param start:
+        The first pixel of the window along an axis.
+
+    :param size:
+        The size of the window along the axis.
+
+    :param decimation:
+        An integer reduction factor.
+
+    :return:
+        A 1D NumPy array of pixel indices.
+    """
+    nbuf = (size + decimation - 1) // decimation
+    increment = size / float(nbuf)
+    index = (numpy.arange(nbuf) + 0.5) * increment + 1e-10
+    return start + numpy.minimum(index.astype('int'), size - 1)
+
+
+def nearest_block(array, tile, factor, samples, lines):
+    """
+    Subsample a tile of a (bands, rows, cols) array for an overview
+    of `factor`, using nearest neighbour sampling. As per GDAL, each
+    overview pixel takes the value of the pixel nearest its centre;
+    see `decimated_index`.
+
+    :param samples:
+        The number of samples in the full resolution image.
+
+    :param lines:
+        The number of lines in the full resolution image.
+
+    :return:
+        A tuple (data, xoff, yoff) of the subsampled array and its
+        offset within the overview, or None if the tile contributes
+        no overview pixels.
+    """
+    (ystart, yend), (xstart, xend) = tile
+    ystart, yend, xstart, xend = [int(v) for v in (ystart, yend, xstart,
+                                                   xend)]
+
+    # The overview pixels whose samples lie within the tile
+    ys = decimated_index(0, lines, factor)
+    xs = decimated_index(0, samples, factor)
+    yindex = numpy.nonzero((ys >= ystart) & (ys < yend))[0]
+    xindex = numpy.nonzero((xs >= xstart) & (xs < xend))[0]
+    if yindex.size == 0 or xindex.size == 0:
+        return None
+
+    data = array[:, ys[yindex, numpy.newaxis] - ystart, xs[xindex] - xstart]
+
+    return data, int(xindex[0]), int(yindex[0])
+
+
+def average_block(array, tile, factor, samples, lines, nodata=None):
+    """
+    Average a tile of a (bands, rows, cols) array over blocks of
+    `factor` by `factor` pixels for an overview of `factor`. The
+    tile must be aligned to `factor`; partial blocks at the image
+    edge are averaged over the pixels they contain. NaN's and pixels
+    equal to `nodata` are ignored; blocks without any valid pixels are
+    set to `nodata` (NaN if `nodata` is None).
+
+    :return:
+        A tuple (data, xoff, yoff) of the averaged array and its
+        offset within the overview.
+    """
+    (ystart, yend), (xstart, xend) = tile
+    ystart, yend, xstart, xend = [int(v) for v in (ystart, yend, xstart,
+                                                   xend)]
+
+    if (ystart % factor or xstart % factor or
+            (yend % factor and yend != lines) or
+            (xend % factor and xend != samples)):
+        msg = ("Tile {} is not aligned to the overview factor {}; "
+               "use NEAREST resampling")
+        raise ValueError(msg.format(tile, factor))
+
+    bands, ysize, xsize = array.shape
+    ny = (ysize + factor - 1) // factor
+    nx = (xsize + factor - 1) // factor
+
+    padded = numpy.zeros((bands, ny * factor, nx * factor), dtype='float64')
+    valid = numpy.zeros(padded.shape, dtype='bool')
+    padded[:, :ysize, :xsize] = array
+    valid[:, :ysize, :xsize] = True
+    valid &= numpy.isfinite(padded)
+    if nodata is not None:
+        valid &= padded != nodata
+    padded[~valid] = 0
+
+    shape = (bands, ny, factor, nx, factor)
+    sums = padded.reshape(shape).sum(axis=(2, 4))
+    counts = valid.reshape(shape).sum(axis=(2, 4))
+
+    data = sums / numpy.maximum(counts, 1)
+    data[counts == 0] = numpy.nan if nodata is None else nodata
+    if array.dtype.kind in 'iu':
+        data = numpy.round(data)
+
+    return data, xstart // factor, ystart // factor
+
+
+class BackgroundWriter(object):
+
+    def __init__(self, max_bytes=2**28):
+        """
+        A dedicated thread that performs queued writes in order, so
+        that the caller can continue processing. A single writer can
+        be shared by several outputs.
+
+        :param max_bytes:
+            The maximum number of bytes held by queued writes. Further
+            writes block until enough pending writes have completed.
+            A single write larger than `max_bytes` is still accepted
+            once the queue is empty. Default is 2**28 (256MB).
+        """
+        self.max_bytes = max_bytes
+        self._cond = threading.Condition()
+        self._queue = collections.deque()
+        self._nbytes = 0
+        self._pending = collections.defaultdict(int)
+        self._errors = {}
+        self._thread = None
+        self._closed = False
+
+    def submit(self, owner, func, args=(), nbytes=0):
+        """
+        Queue `func(*args)` for execution by the writer thread,
+        blocking while the queue is full.
+
+        :param owner:
+            The object on whose behalf the write is made, eg a
+            `TiledOutput`. Errors are reported per owner.
+
+        :param nbytes:
+            The size of the data held by the queued write.
+        """
+        self.check(owner)
+
+        with self._cond:
+            if self._closed:
+                raise ValueError("BackgroundWriter is closed")
+
+            while self._queue and self._nbytes + nbytes > self.max_bytes:
+                self._cond.wait()
+
+            self._queue.append((owner, func, args, nbytes))
+            self._nbytes += nbytes
+            self._pending[id(owner)] += 1
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name='BackgroundWriter')
+                self._thread.daemon = True
+                self._thread.start()
+
+            self._cond.notify_all()
+
+    def _run(self):
+        """
+        Drain the queue until closed.
+        """
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                # Leave the item queued until it has been written
+                owner, func, args, nbytes = self._queue[0]
+
+            try:
+                func(*args)
+            except Exception as err:
+                with self._cond:
+                    self._errors.setdefault(id(owner), err)
+
+            with self._cond:
+                self._queue.popleft()
+                self._nbytes -= nbytes
+                self._pending[id(owner)] -= 1
+                self._cond.notify_all()
+
+    def check(self, owner):
+        """
+        Re-raise the first error raised by a write made on behalf of
+        `owner`, if any.
+        """
+        with self._cond:
+            err = self._errors.pop(id(owner), None)
+        if err is not None:
+            raise err
+
+    def wait(self, owner=None):
+        """
+        Block until every write made on behalf of `owner` (Default is
+        every owner) has completed, then re-raise any error.
+        """
+        with self._cond:
+            if owner is None:
+                while self._queue:
+                    self._cond.wait()
+            else:
+                while self._pending[id(owner)]:
+                    self._cond.wait()
+                del self._pending[id(owner)]
+
+        if owner is not None:
+            self.check(owner)
+
+    def close(self):
+        """
+        Wait for every queued write to complete and stop the thread.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+class MemmapTileWriter(object):
+
+    def __init__(self, layout, stats=None):
+        """
+        Writes tiles directly into a preallocated raw image through a
+        `numpy.memmap`, such that each write is a plain slice
+        assignment. Writers in separate processes can write disjoint
+        tiles into the same image concurrently; the writer is pickled
+        as its layout and re-opens the memmap upon unpickling.
+
+        Instances are normally obtained from `TiledOutput.attach`.
+
+        :param layout:
+            A dictionary describing the image, as returned by
+            `eotools.drivers.raw.raw_layout`.
+
+        :param stats:
+            An optional instance of `eotools.instrumentation.IOStats`
+            used to record the counts, bytes and time of the writes.
+            Default is None (no instrumentation).
+        """
+        self.layout = layout
+        self.stats = NULL_STATS if stats is None else stats
+        self.array = open_memmap(layout, mode='r+')
+
+    def __getstate__(self):
+        """
+        Exclude the memmap when pickling.
+        """
+        return {'layout': self.layout, 'stats': self.stats}
+
+    def __setstate__(self, state):
+        self.__init__(state['layout'], state['stats'])
+
+    def write_tile(self, array, tile, raster_band=None):
+        """
+        Write a tile; see `TiledOutput.write_tile`.
+        """
+        array, tile = crop_tile(array, tile)
+        with self.stats.timer('write', tile, array.nbytes):
+            self._write(array, tile, raster_band)
+
+    def _write(self, array, tile, raster_band=None):
+        """
+        Assign a tile into the memmap.
+        """
+        (ystart, yend), (xstart, xend) = tile
+        idx = (slice(int(ystart), int(yend)), slice(int(xstart), int(xend)))
+        if array.ndim == 3:
+            self.array[(slice(None),) + idx] = array
+        else:
+            band = 1 if raster_band is None else raster_band
+            self.array[(band - 1,) + idx] = array
+
+    def flush(self):
+        """
+        Flush the modified pages of the memmap to disk.
+        """
+        self.array.base.flush()
+
+    def close(self):
+        """
+        Flush and release the memmap.
+        """
+        if self.array is not None:
+            self.flush()
+            self.array = None
+
+
 class TiledOutput(object):
 
     def __init__(self, out_fname, samples=None, lines=None, bands=1,
-                 geobox=None, fmt="ENVI", nodata=None, dtype=gdal.GDT_Byte):
+                 geobox=None, fmt="ENVI", nodata=None, dtype=gdal.GDT_Byte,
+                 stats=None, flush_interval=None, async_write=False,
+                 writer=None, options=None, overviews=None,
+                 overview_resampling='NEAREST', cog=False, memmap=False,
+                 tile_size=None):
         """
         A class to aid in data processing using a tiling scheme.
         The `TiledOutput` class takes care of writing each tile/chunk
@@ -138,6 +1115,63 @@ class TiledOutput(object):
             An integer indicating datatype for the output image.
             Default is gdal.GDT_Byte which corresponds to 1.
 
+        :param stats:
+            An optional instance of `eotools.instrumentation.IOStats`
+            used to record the counts, bytes and time of the writes.
+            Default is None (no instrumentation).
+
+        :param flush_interval:
+            If set to an integer, then the GDAL cache is flushed to
+            disk after every `flush_interval` tiles. Default is None,
+            whereby the cache is only flushed upon `flush` or `close`.
+
+        :param async_write:
+            If set to True, then `write_tile` queues each tile and
+            returns immediately, and a `BackgroundWriter` thread
+            writes the tiles to disk. Errors are raised on the next
+            call to `write_tile` or upon `close`, which waits for
+            every queued tile. Default is False.
+
+        :param writer:
+            An optional `BackgroundWriter`, eg shared by several
+            outputs. Implies `async_write`.
+
+        :param options:
+            An optional list of GDAL creation options, eg
+            ['TILED=YES', 'COMPRESS=DEFLATE', 'BIGTIFF=IF_SAFER'].
+
+        :param overviews:
+            An optional list of overview decimation factors, eg
+            [2, 4, 8, 16]. The overviews are created empty and are
+            filled from each tile as it is written, so the full
+            resolution image is never re-read.
+
+        :param overview_resampling:
+            Either 'NEAREST' (Default) or 'AVERAGE'. AVERAGE requires
+            every tile to be aligned to the largest overview factor,
+            and excludes no data pixels from the average.
+
+        :param tile_size:
+            An optional tuple (ysize, xsize) of the tiles that will be
+            written. If given with AVERAGE overviews, then the overview
+            factors are checked against it upon creation, rather than
+            failing upon the first misaligned tile.
+
+        :param cog:
+            If set to True, then the output is written as a cloud
+            optimised GeoTIFF. The image is written to a temporary
+            tiled GeoTIFF that is copied, along with its overviews, to
+            `out_fname` using the creation `options` upon `close`.
+            Requires `fmt` to be GTiff. Default is False.
+
+        :param memmap:
+            If set to True, then the image is preallocated on disk and
+            tiles are written directly into a `numpy.memmap` of the
+            file, bypassing GDAL. Worker processes can write disjoint
+            tiles into the image concurrently via `attach`. Tiles that
+            are never written contain 0. Requires a raw `fmt` (ENVI or
+            EHdr) and no `overviews`. Default is False.
+
         :example:
             >>> a = numpy.random.randint(0, 256, (1000, 1000)).astype('uint8')
             >>> tiles = generate_tiles(a.shape[1], a.shape[0], 100, 100, generator=False)
@@ -203,18 +1237,138 @@ class TiledOutput(object):
                    "Lines: {nl}").format(ns=samples, nl=lines)
             raise TypeError(msg)
 
+        if cog and fmt != 'GTiff':
+            msg = "Cloud optimised output requires GTiff, not {}"
+            raise ValueError(msg.format(fmt))
+
+        if memmap and (fmt not in RAW_DRIVERS or overviews):
+            msg = ("Memory mapped output requires one of {} without "
+                   "overviews, not {}")
+            raise ValueError(msg.format(RAW_DRIVERS, fmt))
+
+        if overview_resampling not in ('NEAREST', 'AVERAGE'):
+            msg = "Unsupported overview resampling: {}"
+            raise ValueError(msg.format(overview_resampling))
+
+        if overview_resampling == 'AVERAGE' and tile_size is not None:
+            for factor in overviews or []:
+                if any(size % factor for size in tile_size):
+                    msg = ("Tile size {} is not aligned to the overview "
+                           "factor {}; use NEAREST resampling")
+                    raise ValueError(msg.format(tuple(tile_size), factor))
+
+        self.stats = NULL_STATS if stats is None else stats
+
+        self.out_fname = out_fname
+        self.samples = samples
+        self.lines = lines
+        self.options = [] if options is None else list(options)
+        self.overviews = [] if overviews is None else list(overviews)
+        self.overview_resampling = overview_resampling
+        self.cog = cog
+
+        # A COG is written to a temporary tiled file then copied
+        create_fname = out_fname
+        create_options = self.options
+        if cog:
+            create_fname = out_fname + '.tmp.tif'
+            create_options = ['TILED=YES', 'BIGTIFF=IF_SAFER']
+
         driver = gdal.GetDriverByName(fmt)
-        self.outds = driver.Create(out_fname, samples, lines, bands, dtype)
+        with self.stats.timer('create'):
+            self.outds = driver.Create(create_fname, samples, lines, bands,
+                                       dtype, create_options)
+            if self.overviews:
+                # Allocate empty overviews, to be filled tile by tile
+                self.outds.BuildOverviews('NONE', self.overviews)
+        self._create_fname = create_fname
 
         self.nodata = nodata
         self.geobox = geobox
         self.bands = bands
+        self.dtype = numpy.dtype(gdal_array.GDALTypeCodeToNumericTypeCode(
+            dtype))
+        self.flush_interval = flush_interval
+        self._unflushed = 0
+
+        # Writes are made by a background thread if requested
+        self._own_writer = writer is None and async_write
+        if self._own_writer:
+            writer = BackgroundWriter()
+        self.writer = writer
+
+        # The on disk layout determines the layout of the write buffer
+        interleave = self.outds.GetMetadataItem('INTERLEAVE',
+                                                'IMAGE_STRUCTURE')
+        self.interleave = INTERLEAVE_ALIASES.get(interleave, interleave)
+        if self.interleave is None:
+            self.interleave = 'BAND'
 
         self._set_geobox()
         self._set_bands_lookup()
         self._set_nodata()
+
+        self._direct = None
+        if memmap:
+            self._direct = MemmapTileWriter(self._preallocate(), self.stats)
+
         self.closed = False
 
+    @property
+    def memmapped(self):
+        """
+        True if tiles are written directly via a `numpy.memmap`.
+        """
+        return self._direct is not None
+
+    def _preallocate(self):
+        """
+        Write the header and extend the (sparse) data file to its full
+        size, so that it can be memory mapped.
+
+        :return:
+            The raw layout of the image; see
+            `eotools.drivers.raw.raw_layout`.
+        """
+        with self.stats.timer('create'):
+            # Write the header
+            self.outds.FlushCache()
+
+            fname = self.outds.GetFileList()[0]
+            nbytes = (self.bands * self.lines * self.samples *
+                      self.dtype.itemsize)
+            if os.path.getsize(fname) < nbytes:
+                with open(fname, 'r+b') as src:
+                    src.truncate(nbytes)
+
+            layout = raw_layout(self.outds, self.dtype)
+
+        if layout is None:
+            msg = "Unable to memory map {}"
+            raise IOError(msg.format(self.out_fname))
+
+        return layout
+
+    def attach(self):
+        """
+        Return a writer for the memory mapped image, eg for use by a
+        separate worker process. Each writer must write disjoint tiles,
+        and be closed before this output is closed.
+
+        :return:
+            An instance of `MemmapTileWriter`.
+
+        Example:
+
+            >>> outds = TiledOutput(out_fname, samples, lines, bands,
+            ...                     dtype=gdal.GDT_Float32, memmap=True)
+            >>> pool = multiprocessing.Pool(4, init_worker,
+            ...                             (outds.attach(),))
+        """
+        if self._direct is None:
+            raise ValueError("attach requires a memory mapped output")
+        return MemmapTileWriter(self._direct.layout, self.stats)
+
     def _set_geobox(self):
         """
         Assign the georeference information (if we have any) to the output
@@ -260,6 +1414,16 @@ class TiledOutput(object):
         assumed that `array` will have the dimensions (bands, rows, cols),
         whereby the number of bands will written to disk seqentially.
         The `raster_band` parameter will be ignored if `array` is 3D.
+
+        All bands of a 3D `array` are written with a single call,
+        and the GDAL cache is flushed according to `flush_interval`.
+
+        If writes are asynchronous, then the tile is queued and `array`
+        must not be modified afterwards.
+
+        If `tile` is a (read_window, core_window) pair, see
+        `generate_tiles`, then `array` covers the read window and only
+        the core window is written.
         """
 
         dims = array.ndim
@@ -268,22 +1432,181 @@ class TiledOutput(object):
                    "Array dimensions: {dims}").format(dims=dims)
             raise TypeError(msg)
 
-        ystart = tile[0][0]
-        xstart = tile[1][0]
-        if dims == 3:
-            for i in range(self.bands):
-                band = i + 1
-                self.out_bands[band].WriteArray(array[i], xstart, ystart)
-                self.out_bands[band].FlushCache()
+        # Only the core window of a tile with a halo is written
+        array, tile = crop_tile(array, tile)
+
+        if self.writer is not None:
+            self.writer.submit(self, self._write_tile,
+                               (array, tile, raster_band), array.nbytes)
         else:
-            band = 1 if raster_band is None else raster_band
-            self.out_bands[band].WriteArray(array, xstart, ystart)
-            self.out_bands[band].FlushCache()
+            self._write_tile(array, tile, raster_band)
+
+    def _write_tile(self, array, tile, raster_band=None):
+        """
+        Write a tile to disk; see `write_tile`.
+        """
+        dims = array.ndim
+        ystart = int(tile[0][0])
+        xstart = int(tile[1][0])
+        with self.stats.timer('write', tile, array.nbytes):
+            if self._direct is not None:
+                self._direct._write(array, tile, raster_band)
+            elif dims == 3:
+                self._write_bands(array, xstart, ystart)
+            else:
+                band = 1 if raster_band is None else raster_band
+                self.out_bands[band].WriteArray(array, xstart, ystart)
+
+            if self.overviews:
+                self._write_overviews(array, tile, raster_band)
+
+            self._unflushed += 1
+            if (self.flush_interval is not None and
+                    self._unflushed >= self.flush_interval):
+                self._flush()
+
+    def _write_bands(self, array, xstart, ystart):
+        """
+        Write every band of a 3D (bands, rows, cols) array with a
+        single dataset level `WriteRaster` call. The buffer is
+        arranged to match the interleave of the output file; ie
+        (rows, cols, bands) for pixel interleaved and
+        (rows, bands, cols) for line interleaved outputs.
+        """
+        bands, ysize, xsize = array.shape
+        itemsize = self.dtype.itemsize
+
+        if self.interleave == 'PIXEL':
+            buf = numpy.ascontiguousarray(array.transpose(1, 2, 0),
+                                          dtype=self.dtype)
+            pixel_space = bands * itemsize
+            line_space = xsize * bands * itemsize
+            band_space = itemsize
+        elif self.interleave == 'LINE':
+            buf = numpy.ascontiguousarray(array.transpose(1, 0, 2),
+                                          dtype=self.dtype)
+            pixel_space = itemsize
+            line_space = bands * xsize * itemsize
+            band_space = xsize * itemsize
+        else:
+            buf = numpy.ascontiguousarray(array, dtype=self.dtype)
+            pixel_space = itemsize
+            line_space = xsize * itemsize
+            band_space = ysize * xsize * itemsize
+
+        # The contiguous buffer is passed without copying it to bytes
+        self.outds.WriteRaster(xstart, ystart, xsize, ysize, buf,
+                               xsize, ysize,
+                               band_list=list(range(1, bands + 1)),
+                               buf_pixel_space=pixel_space,
+                               buf_line_space=line_space,
+                               buf_band_space=band_space)
+
+    def fill_tile(self, tile, value=None):
+        """
+        Fill every band of `tile` with a constant, eg for tiles that
+        were skipped as containing no valid data.
+
+        :param tile:
+            A tile of the form ((ystart, yend), (xstart, xend)), or a
+            (read_window, core_window) pair.
+
+        :param value:
+            The fill value. Default is the no data value, or 0 if no
+            data isn't set.
+        """
+        if value is None:
+            value = 0 if self.nodata is None else self.nodata
+
+        (ystart, yend), (xstart, xend) = split_tile(tile)[1]
+        shape = (self.bands, int(yend - ystart), int(xend - xstart))
+        array = numpy.empty(shape, dtype=self.dtype)
+        array.fill(value)
+
+        self.write_tile(array, tile)
+
+    def _write_overviews(self, array, tile, raster_band=None):
+        """
+        Write the reduced resolution version of a tile into each
+        overview level.
+        """
+        if array.ndim == 2:
+            array = array[numpy.newaxis]
+            bands = [1 if raster_band is None else raster_band]
+        else:
+            bands = range(1, array.shape[0] + 1)
+
+        for i, factor in enumerate(self.overviews):
+            if self.overview_resampling == 'AVERAGE':
+                block = average_block(array, tile, factor, self.samples,
+                                      self.lines, self.nodata)
+            else:
+                block = nearest_block(array, tile, factor, self.samples,
+                                      self.lines)
+
+            if block is None:
+                continue
+
+            data, xoff, yoff = block
+            data = data.astype(self.dtype)
+            for j, band in enumerate(bands):
+                overview = self.out_bands[band].GetOverview(i)
+                overview.WriteArray(data[j], xoff, yoff)
+                overview = None
+
+    def flush(self):
+        """
+        Flush the GDAL cache of the output image to disk, after any
+        queued tiles have been written.
+        """
+        if self.writer is not None:
+            self.writer.wait(self)
+        self._flush()
+
+    def _flush(self):
+        """
+        Flush the GDAL cache, or the memmap; see `flush`.
+        """
+        if self._direct is not None:
+            self._direct.flush()
+        self.outds.FlushCache()
+        self._unflushed = 0
 
     def close(self):
         """
         Close the output image and flush everything still in cache to disk.
+        Any error raised by a queued write is re-raised once the image
+        has been closed. Closing a closed image does nothing.
+
+        For a cloud optimised GeoTIFF, the temporary image is removed
+        even if the image couldn't be completed.
+        """
+        if self.closed:
+            return
+
+        with self.stats.timer('close'):
+            try:
+                try:
+                    self.flush()
+                finally:
+                    self._release()
+
+                if self.cog:
+                    self._finalise_cog()
+            finally:
+                if self.cog and os.path.exists(self._create_fname):
+                    gdal.GetDriverByName('GTiff').Delete(self._create_fname)
+
+    def _release(self):
         """
+        Stop our own writer, and release the memmap and GDAL handles.
+        """
+        if self._own_writer:
+            self.writer.close()
+
+        if self._direct is not None:
+            self._direct.close()
+            self._direct = None
 
         for band in self.out_bands:
             self.out_bands[band] = None
@@ -292,6 +1615,228 @@ class TiledOutput(object):
         self.outds = None
         self.closed = True
 
+    def _finalise_cog(self):
+        """
+        Copy the temporary image and its overviews to a cloud optimised
+        GeoTIFF. The temporary image is removed by `close`.
+        """
+        driver = gdal.GetDriverByName('GTiff')
+        options = [o for o in self.options
+                   if not o.upper().startswith('TILED')]
+        options = ['TILED=YES', 'COPY_SRC_OVERVIEWS=YES'] + options
+
+        src = gdal.Open(self._create_fname)
+        outds = driver.CreateCopy(self.out_fname, src, options=options)
+        outds.FlushCache()
+
+        # Close the datasets
+        outds = None
+        src = None
+
+
+class MultiTiledOutput(object):
+
+    def __init__(self, samples, lines, geobox=None, stats=None,
+                 async_write=False, writer=None):
+        """
+        Fans each tile out to several named outputs, eg a statistics
+        image, a composite and a QA mask, which may differ in their
+        band counts, datatypes and formats. All the outputs of a tile
+        are written together, and closed with a single `close`.
+
+        :param samples:
+            An integer indicating the number of samples/columns contained
+            in each image.
+
+        :param lines:
+            An integer indicating the number of lines/rows contained in
+            each image.
+
+        :param geobox:
+            An instance of a GriddedGeoBox object, shared by the images.
+
+        :param stats:
+            An optional instance of `eotools.instrumentation.IOStats`
+            shared by the images.
+
+        :param async_write:
+            If set to True, then the outputs of each tile are queued as
+            a single write, and a `BackgroundWriter` thread writes them
+            to disk. See `TiledOutput`. Default is False.
+
+        :param writer:
+            An optional `BackgroundWriter`, eg shared with other
+            outputs. Implies `async_write`.
+
+        Example:
+
+            >>> outds = MultiTiledOutput(samples, lines, geobox,
+            ...                          async_write=True)
+            >>> outds.create('stats', 'stats.img', bands=14,
+            ...              dtype=gdal.GDT_Float32, nodata=numpy.nan)
+            >>> outds.create('qa', 'qa.img', dtype=gdal.GDT_Byte)
+            >>> for tile in tiles:
+            ...     outds.write_tile({'stats': bulk_stats(data),
+            ...                       'qa': qa_mask(data)}, tile)
+            >>> outds.close()
+        """
+        self.samples = samples
+        self.lines = lines
+        self.geobox = geobox
+        self.stats = NULL_STATS if stats is None else stats
+        self.outputs = collections.OrderedDict()
+
+        self._own_writer = writer is None and async_write
+        if self._own_writer:
+            writer = BackgroundWriter()
+        self.writer = writer
+        self.closed = False
+
+    def __getitem__(self, name):
+        return self.outputs[name]
+
+    def __contains__(self, name):
+        return name in self.outputs
+
+    def add(self, name, output):
+        """
+        Register an existing output, eg a `TiledOutput` or
+        `eotools.chunked_store.ChunkedOutput`, under `name`.
+
+        :return:
+            The output.
+        """
+        if name in self.outputs:
+            msg = "An output named {} already exists"
+            raise ValueError(msg.format(name))
+
+        self.outputs[name] = output
+        return output
+
+    def create(self, name, out_fname, bands=1, dtype=gdal.GDT_Byte,
+               **kwargs):
+        """
+        Create a `TiledOutput` sharing the dimensions, geobox and
+        instrumentation of this output, and register it under `name`.
+
+        :param name:
+            The name of the output, used as the key of the arrays passed
+            to `write_tile`.
+
+        :param out_fname:
+            A string containing the full filepath name used for
+            creating the image on disk.
+
+        :param bands:
+            The number of bands contained in the image. Default is 1.
+
+        :param dtype:
+            An integer indicating the GDAL datatype for the image.
+            Default is gdal.GDT_Byte.
+
+        :param kwargs:
+            Any further keywords of `TiledOutput`, eg fmt, nodata or
+            options.
+
+        :return:
+            The `TiledOutput`.
+        """
+        output = TiledOutput(out_fname, self.samples, self.lines, bands,
+                             self.geobox, dtype=dtype, stats=self.stats,
+                             **kwargs)
+        return self.add(name, output)
+
+    def write_tile(self, arrays, tile):
+        """
+        Write the arrays of a single tile.
+
+        :param arrays:
+            A dictionary mapping an output name to the 2D or 3D array
+            written to that output. Outputs that are missing from the
+            dictionary are not written.
+
+        :param tile:
+            A tile of the form ((ystart, yend), (xstart, xend)), or a
+            (read_window, core_window) pair. See
+            `TiledOutput.write_tile`.
+        """
+        for name in arrays:
+            if name not in self.outputs:
+                msg = "Unknown output {}; expected one of {}"
+                raise KeyError(msg.format(name, list(self.outputs)))
+
+        if self.writer is not None:
+            nbytes = sum(array.nbytes for array in arrays.values())
+            self.writer.submit(self, self._write_tile, (arrays, tile),
+                               nbytes)
+        else:
+            self._write_tile(arrays, tile)
+
+    def _write_tile(self, arrays, tile):
+        """
+        Write the arrays of a single tile to each output; see
+        `write_tile`.
+        """
+        for name, array in arrays.items():
+            self.outputs[name].write_tile(array, tile)
+
+    def fill_tile(self, tile, value=None):
+        """
+        Fill `tile` in every output with a constant; see
+        `TiledOutput.fill_tile`.
+        """
+        if self.writer is not None:
+            self.writer.submit(self, self._fill_tile, (tile, value))
+        else:
+            self._fill_tile(tile, value)
+
+    def _fill_tile(self, tile, value=None):
+        for output in self.outputs.values():
+            output.fill_tile(tile, value)
+
+    def flush(self):
+        """
+        Flush every output to disk, after any queued tiles have been
+        written.
+        """
+        if self.writer is not None:
+            self.writer.wait(self)
+
+        for output in self.outputs.values():
+            if hasattr(output, 'flush'):
+                output.flush()
+
+    def close(self):
+        """
+        Close every output. Every output is closed even if one of them
+        fails, after which the first error is re-raised. Closing a
+        closed instance does nothing.
+        """
+        if self.closed:
+            return
+
+        error = None
+        try:
+            if self.writer is not None:
+                self.writer.wait(self)
+        except Exception as err:
+            error = err
+        finally:
+            if self._own_writer:
+                self.writer.close()
+
+        for output in self.outputs.values():
+            try:
+                output.close()
+            except Exception as err:
+                if error is None:
+                    error = err
+
+        self.closed = True
+
+        if error is not None:
+            raise error
+
 
 def scatter(iterable, n):
     """
@@ -308,6 +1853,9 @@ def scatter(iterable, n):
     :return:
         A `list` consisting of `n` blocks of roughly equal size, each
         containing elements from `iterable`.
+
+    The partitioning is static; see `eotools.scheduler` for work
+    queues that balance unevenly expensive items between workers.
     """
 
     q, r = len(iterable) // n, len(iterable) % n
@@ -5,22 +5,7 @@ import logging
 import gc
 import argparse
 from osgeo import gdal
-
-
-def gdal_to_numpy_dtype(val):
-    return {
-           1: 'uint8',
-           2: 'uint16',
-           3: 'int16',
-           4: 'uint32',
-           5: 'int32',
-           6: 'float32',
-           7: 'float64',
-           8: 'complex64',
-           9: 'complex64',
-           10: 'complex64',
-           11: 'complex128',
-           }.get(val, 'float64')
+from eotools.drivers.stack_collection import StackCollection
 
 
 class WaterClassifier(object):
@@ -271,61 +256,36 @@ class WaterClassifier(object):
 
         return classified
 
-if __name__ == '__main__':
 
-    desc = 'Executes a predefined decision tree.'
-    parser = argparse.ArgumentParser()
-    parser = argparse.ArgumentParser(description=desc)
-    parser.add_argument('--B1_Stack', required=True, help='Band 1 stack.')
-    parser.add_argument('--B2_Stack', required=True, help='Band 2 stack.')
-    parser.add_argument('--B3_Stack', required=True, help='Band 3 stack.')
-    parser.add_argument('--B4_Stack', required=True, help='Band 4 stack.')
-    parser.add_argument('--B5_Stack', required=True, help='Band 5 stack.')
-    parser.add_argument('--B7_Stack', required=True, help='Band 7 stack.')
-    parser.add_argument('--outfile', required=True,
-                        help='The output filename.')
-    parser.add_argument('--driver', default='ENVI',
-                        help=("The file driver type for the output file. "
-                              "See GDAL's list of valid file types. "
-                              "(Defaults to ENVI)."))
+def classify_stacks(stack_fnames, outfile, driver='ENVI'):
+    """
+    Classify every time slice of a group of per-band stacks, writing
+    one output band per time slice.
 
-    parsed_args = parser.parse_args()
+    :param stack_fnames:
+        A list of the file path names of the band 1, 2, 3, 4, 5 and 7
+        stacks. The stacks must share the same grid and number of
+        raster bands.
+
+    :param outfile:
+        A string containing the full file path name of the output.
+
+    :param driver:
+        The GDAL driver used to write the output. Default is 'ENVI'.
+    """
+    # Group the per-band stacks; they must share the same grid
+    stacks = StackCollection(stack_fnames)
 
-    B1_Stack = parsed_args.B1_Stack
-    B2_Stack = parsed_args.B2_Stack
-    B3_Stack = parsed_args.B3_Stack
-    B4_Stack = parsed_args.B4_Stack
-    B5_Stack = parsed_args.B5_Stack
-    B7_Stack = parsed_args.B7_Stack
-    outfile = parsed_args.outfile
-    driver = parsed_args.driver
-
-    # Open each dataset
-    ds1 = gdal.Open(B1_Stack)
-    ds2 = gdal.Open(B2_Stack)
-    ds3 = gdal.Open(B3_Stack)
-    ds4 = gdal.Open(B4_Stack)
-    ds5 = gdal.Open(B5_Stack)
-    ds7 = gdal.Open(B7_Stack)
-
-    # Create a list of opened datasets
-    datasets = [ds1, ds2, ds3, ds4, ds5, ds7]
-
-    # Get the number of bands, columns, rows, spectral_bands
-    nb = ds1.RasterCount
-    rows = ds1.RasterYSize
-    cols = ds1.RasterXSize
-    sb = len(datasets)
-
-    # Get the datatype
-    band = ds1.GetRasterBand(1)
-    dtype = gdal_to_numpy_dtype(band.DataType)
+    # Get the number of bands, columns, rows
+    nb = stacks.bands
+    rows = stacks.lines
+    cols = stacks.samples
 
     # Setup the output dataset
     driver = gdal.GetDriverByName(driver)
     outds = driver.Create(outfile, cols, rows, nb, 1)  # Uint8
-    outds.SetGeoTransform(ds1.GetGeoTransform())
-    outds.SetProjection(ds1.GetProjection())
+    outds.SetGeoTransform(stacks.geotransform)
+    outds.SetProjection(stacks.projection)
     outband = []
     for i in range(nb):
         outband.append(outds.GetRasterBand(i+1))
@@ -334,15 +294,13 @@ if __name__ == '__main__':
     classifier = WaterClassifier()
 
     # Loop over each timeslice (number of bands per spectral band stack).
+    # The spectral band stacks are read concurrently.
+    tile = ((0, rows), (0, cols))
     for i in range(nb):
-        images = numpy.zeros((sb, rows, cols), dtype=dtype)
+        images = stacks.read_time_slice(tile, i+1)
         bground = numpy.zeros((rows, cols), dtype='bool')
-        for j in range(len(datasets)):
-            band = datasets[j].GetRasterBand(i+1)
-            images[j] = band.ReadAsArray()
-            no_data = band.GetNoDataValue()
+        for j, no_data in enumerate(stacks.no_data):
             bground |= images[j] == no_data
-            band = None
 
         water_class = classifier.classify(images)
         water_class[bground] = 0
@@ -350,4 +308,32 @@ if __name__ == '__main__':
         outband[i].FlushCache()
 
     # Close the output file
+    outband = None
     outds = None
+
+
+if __name__ == '__main__':
+
+    desc = 'Executes a predefined decision tree.'
+    parser = argparse.ArgumentParser()
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('--B1_Stack', required=True, help='Band 1 stack.')
+    parser.add_argument('--B2_Stack', required=True, help='Band 2 stack.')
+    parser.add_argument('--B3_Stack', required=True, help='Band 3 stack.')
+    parser.add_argument('--B4_Stack', required=True, help='Band 4 stack.')
+    parser.add_argument('--B5_Stack', required=True, help='Band 5 stack.')
+    parser.add_argument('--B7_Stack', required=True, help='Band 7 stack.')
+    parser.add_argument('--outfile', required=True,
+                        help='The output filename.')
+    parser.add_argument('--driver', default='ENVI',
+                        help=("The file driver type for the output file. "
+                              "See GDAL's list of valid file types. "
+                              "(Defaults to ENVI)."))
+
+    parsed_args = parser.parse_args()
+
+    stack_fnames = [parsed_args.B1_Stack, parsed_args.B2_Stack,
+                    parsed_args.B3_Stack, parsed_args.B4_Stack,
+                    parsed_args.B5_Stack, parsed_args.B7_Stack]
+
+    classify_stacks(stack_fnames, parsed_args.outfile, parsed_args.driver)
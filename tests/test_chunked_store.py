@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+# ===============================================================================
+# Copyright 2015 Geoscience Australia
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+'''Unit tests for eotools/chunked_store.py'''
+
+from __future__ import absolute_import
+from os.path import join as pjoin
+import shutil
+import tempfile
+import unittest
+
+import numpy
+import numpy.testing as npt
+from osgeo import gdal
+
+from eotools.chunked_store import ChunkedOutput
+from eotools.chunked_store import ChunkedStore
+from eotools.geobox import GriddedGeoBox
+from eotools.tiling import generate_tiles
+
+
+class TestChunkedStore(unittest.TestCase):
+
+    """
+    Test writing and reading back a chunked store.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.fname = pjoin(self.tmpdir, 'store.zarr')
+        self.data = numpy.random.random((3, 45, 37)).astype('float32')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_round_trip(self):
+        outds = ChunkedOutput(self.fname, 37, 45, 3, nodata=numpy.nan,
+                              dtype=gdal.GDT_Float32, chunks=(10, 16),
+                              band_names=['a', 'b', 'c'])
+
+        # Tiles spanning two chunks in y, with partial edge chunks
+        for tile in generate_tiles(37, 45, 16, 20):
+            (ys, ye), (xs, xe) = tile
+            outds.write_tile(self.data[:, ys:ye, xs:xe], tile)
+        outds.close()
+
+        store = ChunkedStore(self.fname)
+        self.assertEqual(store.band_names, ['a', 'b', 'c'])
+        self.assertEqual(store.chunks, (10, 16))
+        npt.assert_array_equal(store.read_tile(((0, 45), (0, 37)),
+                                               [1, 2, 3]), self.data)
+        npt.assert_array_equal(store.read_tile(((3, 41), (5, 30)), 2),
+                               self.data[1, 3:41, 5:30])
+
+    def test_georeferencing(self):
+        geobox = GriddedGeoBox((45, 37), origin=(130.0, -30.0))
+        outds = ChunkedOutput(self.fname, 37, 45, 3, geobox=geobox,
+                              chunks=(10, 16))
+        outds.close()
+
+        store = ChunkedStore(self.fname)
+        self.assertEqual(tuple(store.geotransform),
+                         geobox.affine.to_gdal())
+        self.assertEqual(store.projection, geobox.crs.ExportToWkt())
+        self.assertEqual(store.attrs['_CRS'],
+                         {'wkt': geobox.crs.ExportToWkt()})
+
+    def test_unwritten(self):
+        outds = ChunkedOutput(self.fname, 37, 45, 1, nodata=-999,
+                              dtype=gdal.GDT_Int16, chunks=(10, 10))
+        outds.write_tile(numpy.ones((10, 10), dtype='int16'),
+                         ((0, 10), (0, 10)))
+        outds.close()
+
+        img = ChunkedStore(self.fname).read_raster_band(1)
+        self.assertTrue((img[:10, :10] == 1).all())
+        self.assertTrue((img[10:] == -999).all())
+
+    def test_unaligned(self):
+        outds = ChunkedOutput(self.fname, 37, 45, 1, chunks=(10, 10))
+        with self.assertRaises(ValueError):
+            outds.write_tile(numpy.zeros((5, 5)), ((5, 10), (0, 5)))
+
+
+if __name__ == '__main__':
+    unittest.main()
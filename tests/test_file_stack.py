@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+
+# ===============================================================================
+# Copyright 2015 Geoscience Australia
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+'''Unit tests for eotools/drivers/file_stack.py'''
+
+from __future__ import absolute_import
+import datetime
+from os.path import join as pjoin
+import shutil
+import tempfile
+import threading
+import unittest
+
+import numpy
+import numpy.testing as npt
+from osgeo import gdal
+
+from eotools.drivers.stacked_dataset import StackedDataset
+
+
+def write_band(fname, array):
+    """
+    Write a single band GeoTIFF.
+    """
+    lines, samples = array.shape
+    driver = gdal.GetDriverByName('GTiff')
+    outds = driver.Create(fname, samples, lines, 1, gdal.GDT_Int16)
+    outds.SetGeoTransform((144.0, 0.00025, 0.0, -34.0, 0.0, -0.00025))
+    outds.GetRasterBand(1).WriteArray(array)
+    outds = None
+
+
+class TestFileStack(unittest.TestCase):
+
+    """
+    Test a stack built from a list of single band files.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.data = numpy.random.randint(0, 1000, (4, 30, 20))
+        self.data = self.data.astype('int16')
+        self.fnames = []
+        for i in range(4):
+            fname = pjoin(self.tmpdir, 'band_{}.tif'.format(i))
+            write_band(fname, self.data[i])
+            self.fnames.append(fname)
+        self.dates = [datetime.datetime(1995, 7, 2),
+                      datetime.datetime(1995, 8, 3),
+                      datetime.datetime(1996, 1, 10),
+                      datetime.datetime(1996, 2, 11)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_reads(self):
+        for threads in (None, 2):
+            ds = StackedDataset.from_files(self.fnames, self.dates,
+                                           source_threads=threads)
+            self.assertEqual(ds.bands, 4)
+            tile = ((5, 25), (2, 12))
+            npt.assert_array_equal(ds.read_tile(tile, [4, 1]),
+                                   self.data[[3, 0], 5:25, 2:12])
+            npt.assert_array_equal(ds.read_tile(tile, 2),
+                                   self.data[1, 5:25, 2:12])
+            npt.assert_array_equal(ds.read_tile_all_rasters(tile),
+                                   self.data[:, 5:25, 2:12])
+            npt.assert_array_equal(ds.read_raster_band(3), self.data[2])
+
+    def test_thread_handles(self):
+        ds = StackedDataset.from_files(self.fnames, self.dates,
+                                       source_threads=2)
+        ds.use_thread_handles(True)
+
+        # Pooled handles are never the calling thread's cached handle
+        fname = self.fnames[0]
+        cached = ds._open(fname)
+        pooled = ds._handles.acquire(fname)
+        self.assertIsNot(pooled, cached)
+        self.assertIsNot(ds._handles.acquire(fname), pooled)
+
+        errors = []
+
+        def read(offset):
+            try:
+                for i in range(10):
+                    ystart = (offset + i) % 10
+                    tile = ((ystart, ystart + 20), (2, 12))
+                    npt.assert_array_equal(ds.read_tile_all_rasters(tile),
+                                           self.data[:, ystart:ystart + 20,
+                                                     2:12])
+            except Exception as err:
+                errors.append(err)
+
+        threads = [threading.Thread(target=read, args=(i,))
+                   for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_yearly_iterator(self):
+        ds = StackedDataset.from_files(self.fnames, self.dates)
+        ds.init_yearly_iterator()
+        self.assertEqual(ds.get_yearly_iterator(),
+                         {1995: [1, 2], 1996: [3, 4]})
+        self.assertEqual(ds.get_raster_band_datetime(3), self.dates[2])
+
+    def test_yearly_iterator_final_year(self):
+        ds = StackedDataset.from_files(self.fnames[:3], self.dates[:3])
+        ds.init_yearly_iterator()
+        self.assertEqual(ds.get_yearly_iterator(),
+                         {1995: [1, 2], 1996: [3]})
+
+    def test_validation(self):
+        fname = pjoin(self.tmpdir, 'small.tif')
+        write_band(fname, self.data[0, :10])
+        with self.assertRaises(ValueError):
+            StackedDataset.from_files(self.fnames + [fname])
+        with self.assertRaises(ValueError):
+            StackedDataset.from_files(self.fnames, self.dates[:2])
+
+
+if __name__ == '__main__':
+    unittest.main()
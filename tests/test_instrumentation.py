@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+# ===============================================================================
+# Copyright 2015 Geoscience Australia
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+'''Unit tests for eotools/instrumentation.py'''
+
+from __future__ import absolute_import
+import json
+import multiprocessing
+from os.path import join as pjoin
+import shutil
+import tempfile
+import unittest
+
+from eotools.instrumentation import IOStats
+from eotools.instrumentation import NULL_STATS
+
+
+class TestIOStats(unittest.TestCase):
+
+    """
+    Unittests for the IOStats class.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_summary(self):
+        """Test the accumulated counts, bytes and tile timings:"""
+        stats = IOStats()
+        tile = ((0, 10), (0, 20))
+        with stats.timer('read', tile) as timer:
+            timer.nbytes = 400
+        stats.record('read', 1.0, 600, tile=((10, 20), (0, 20)))
+        stats.record('compute', 2.0, tile=tile)
+
+        summary = stats.summary()
+        self.assertEqual(summary['read']['count'], 2)
+        self.assertEqual(summary['read']['bytes'], 1000)
+        self.assertEqual(summary['compute']['seconds'], 2.0)
+        self.assertEqual(len(summary['tiles']), 2)
+        self.assertEqual(summary['tiles'][0]['tile'], tile)
+        self.assertEqual(summary['tiles'][0]['compute'], 2.0)
+
+    def test_trace(self):
+        """Test the JSON lines trace:"""
+        fname = pjoin(self.tmpdir, 'trace.jsonl')
+        stats = IOStats(trace=fname)
+        stats.record('write', 0.5, 100, tile=((0, 1), (0, 2)))
+        stats.record('open', 0.1)
+        stats.close()
+
+        with open(fname) as src:
+            events = [json.loads(line) for line in src]
+
+        self.assertEqual([e['category'] for e in events], ['write', 'open'])
+        self.assertEqual(events[0]['bytes'], 100)
+        self.assertEqual(events[0]['tile'], [[0, 1], [0, 2]])
+
+    def test_trace_processes(self):
+        """Test that each process traces its own events once:"""
+        fname = pjoin(self.tmpdir, 'trace.jsonl')
+        stats = IOStats(trace=fname)
+        stats.record('open', 0.1)
+
+        proc = multiprocessing.Process(target=stats.record,
+                                       args=('read', 0.2))
+        proc.start()
+        proc.join()
+        stats.record('write', 0.3)
+        stats.close()
+
+        with open(fname) as src:
+            events = [json.loads(line) for line in src]
+
+        self.assertEqual(sorted(e['category'] for e in events),
+                         ['open', 'read', 'write'])
+        self.assertEqual(len(set(e['pid'] for e in events)), 2)
+        self.assertNotIn('read', stats.summary())
+
+    def test_merge(self):
+        """Test draining the statistics of one instance into another:"""
+        tile = ((0, 10), (0, 20))
+        worker = IOStats()
+        worker.record('read', 1.0, 100, tile=tile)
+        worker.record('read', 2.0, 300)
+
+        stats = IOStats()
+        stats.record('read', 0.5, 50, tile=tile)
+        stats.merge(worker.drain())
+
+        summary = stats.summary()
+        self.assertEqual(summary['read'], {'count': 3, 'seconds': 3.5,
+                                           'bytes': 450})
+        self.assertEqual(summary['tiles'], [{'tile': tile, 'read': 1.5}])
+        self.assertEqual(worker.summary(), {'tiles': []})
+
+    def test_disabled(self):
+        """Test that the null instrumentation records nothing:"""
+        with NULL_STATS.timer('read') as timer:
+            timer.nbytes = 10
+        NULL_STATS.record('read', 1.0)
+        NULL_STATS.merge(NULL_STATS.drain())
+        self.assertEqual(NULL_STATS.summary(), {})
+
+        # Timers aren't shared, so nothing leaks between them
+        self.assertEqual(NULL_STATS.timer('write').nbytes, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
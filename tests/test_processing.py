@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+
+# ===============================================================================
+# Copyright 2015 Geoscience Australia
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+'''Unit tests for eotools/processing.py'''
+
+from __future__ import absolute_import
+from os.path import join as pjoin
+import shutil
+import tempfile
+import unittest
+
+import numpy
+import numpy.testing as npt
+from osgeo import gdal
+
+from eotools.chunked_store import ChunkedStore
+from eotools.drivers.stacked_dataset import StackedDataset
+from eotools.instrumentation import IOStats
+from eotools.processing import map_tiles
+from eotools.processing import OutputSpec
+from eotools.processing import Pipeline
+from eotools.tiling import CoverageIndex
+
+
+def band_sum(data):
+    """Sum over the band axis."""
+    return data.sum(axis=0, dtype='float32')
+
+
+def band_difference(data):
+    """Difference between the sums of two inputs."""
+    return band_sum(data['a']) - band_sum(data['b'])
+
+
+def sum_and_max(data):
+    """The sum and maximum over the band axis."""
+    return {'sum': band_sum(data), 'max': data.max(axis=0)}
+
+
+def threshold(data):
+    """Zero the values of 50 or less."""
+    return numpy.where(data > 50, data, 0)
+
+
+def band_max(data):
+    """Maximum over the band axis."""
+    return data.max(axis=0)
+
+
+def focal_max(data):
+    """3x3 maximum of the first band, with edge replication."""
+    padded = numpy.pad(data[0], 1, mode='edge')
+    rows, cols = data[0].shape
+    result = numpy.zeros((rows, cols), dtype='float32')
+    result[:] = padded[:rows, :cols]
+    for y in range(3):
+        for x in range(3):
+            numpy.maximum(result, padded[y:y + rows, x:x + cols], result)
+    return result
+
+
+class TestMapTiles(unittest.TestCase):
+
+    """
+    Unittests for the map_tiles function.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.data = numpy.random.randint(0, 100, (5, 64, 48))
+        self.data = self.data.astype('int16')
+
+        self.fname = pjoin(self.tmpdir, 'stack')
+        driver = gdal.GetDriverByName('ENVI')
+        outds = driver.Create(self.fname, 48, 64, 5, gdal.GDT_Int16)
+        for i in range(5):
+            outds.GetRasterBand(i + 1).WriteArray(self.data[i])
+        outds = None
+
+        self.ds = StackedDataset(self.fname)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def read_output(self, out_fname):
+        return gdal.Open(out_fname).ReadAsArray()
+
+    def test_serial(self):
+        """Test a single worker:"""
+        out_fname = pjoin(self.tmpdir, 'serial')
+        summary = map_tiles(band_sum, self.ds, OutputSpec(out_fname),
+                            xtile=16, ytile=16)
+        self.assertEqual(summary['tiles'], 12)
+        npt.assert_array_equal(self.read_output(out_fname),
+                               self.data.sum(axis=0))
+
+    def test_threads(self):
+        """Test multiple threads:"""
+        out_fname = pjoin(self.tmpdir, 'threads')
+        map_tiles(band_sum, (self.ds, [1, 3]), OutputSpec(out_fname),
+                  workers=3, prefetch=1, xtile=10, ytile=7)
+        npt.assert_array_equal(self.read_output(out_fname),
+                               self.data[[0, 2]].sum(axis=0))
+
+    def test_processes(self):
+        """Test multiple processes:"""
+        out_fname = pjoin(self.tmpdir, 'processes')
+        inputs = {'a': self.ds, 'b': (self.ds, [2])}
+        map_tiles(band_difference, inputs, OutputSpec(out_fname),
+                  workers=2, processes=True, xtile=20, ytile=20)
+        control = self.data.sum(axis=0) - self.data[1]
+        npt.assert_array_equal(self.read_output(out_fname), control)
+
+    def test_processes_stats(self):
+        """Test the reads of worker processes reach the parent's stats:"""
+        out_fname = pjoin(self.tmpdir, 'processes_stats')
+        stats = IOStats()
+        ds = StackedDataset(self.fname, stats=stats)
+        summary = map_tiles(band_sum, ds, OutputSpec(out_fname),
+                            workers=2, processes=True, xtile=24, ytile=16,
+                            stats=stats)
+        self.assertEqual(summary['tiles'], 8)
+
+        io = stats.summary()
+        self.assertEqual(io['read']['count'], 8)
+        self.assertEqual(io['read']['bytes'], self.data.nbytes)
+        self.assertEqual(io['compute']['count'], 8)
+        self.assertEqual(len(io['tiles']), 8)
+
+    def test_memmap(self):
+        """Test worker processes writing directly into a memmap:"""
+        out_fname = pjoin(self.tmpdir, 'memmap')
+        spec = OutputSpec(out_fname, dtype=gdal.GDT_Float32, memmap=True)
+        map_tiles(band_sum, self.ds, spec, workers=2, processes=True,
+                  xtile=20, ytile=20)
+        npt.assert_array_equal(self.read_output(out_fname),
+                               self.data.sum(axis=0))
+
+    def test_multiple_outputs(self):
+        """Test a function producing several products per tile:"""
+        specs = {'sum': OutputSpec(pjoin(self.tmpdir, 'sum')),
+                 'max': OutputSpec(pjoin(self.tmpdir, 'max'),
+                                   dtype=gdal.GDT_Int16, async_write=True)}
+        map_tiles(sum_and_max, self.ds, specs, workers=2, xtile=16,
+                  ytile=16)
+        npt.assert_array_equal(self.read_output(specs['sum'].out_fname),
+                               self.data.sum(axis=0))
+        npt.assert_array_equal(self.read_output(specs['max'].out_fname),
+                               self.data.max(axis=0))
+
+    def test_pipeline(self):
+        """Test a pipeline of stages with two products:"""
+        for processes in (False, True):
+            pipeline = Pipeline()
+            pipeline.add_stage('masked', threshold)
+            pipeline.add_stage('sum', band_sum)
+            pipeline.add_stage('max', band_max, ['masked'])
+            sum_fname = pjoin(self.tmpdir, 'sum_{}'.format(processes))
+            max_fname = pjoin(self.tmpdir, 'max_{}'.format(processes))
+            pipeline.add_product('sum', OutputSpec(sum_fname))
+            pipeline.add_product('max', OutputSpec(max_fname,
+                                                   dtype=gdal.GDT_Int16))
+            summary = pipeline.run(self.ds, workers=2, processes=processes,
+                                   xtile=16, ytile=16)
+            self.assertEqual(list(summary['stages']), ['masked', 'sum', 'max'])
+
+            masked = threshold(self.data)
+            npt.assert_array_equal(self.read_output(sum_fname),
+                                   masked.sum(axis=0))
+            npt.assert_array_equal(self.read_output(max_fname),
+                                   masked.max(axis=0))
+
+        pipeline = Pipeline()
+        pipeline.add_stage('sum', band_sum, ['nbar'])
+        pipeline.add_product('sum', OutputSpec(sum_fname))
+        self.assertRaises(ValueError, pipeline.run, self.ds)
+
+    def test_pipeline_repeated(self):
+        """Test a stage requiring the same result twice:"""
+        out_fname = pjoin(self.tmpdir, 'squared')
+        pipeline = Pipeline()
+        pipeline.add_stage('sum', band_sum)
+        pipeline.add_stage('squared', numpy.multiply, ['sum', 'sum'])
+        pipeline.add_product('squared', OutputSpec(out_fname))
+        pipeline.run(self.ds, xtile=16, ytile=16)
+        total = self.data.sum(axis=0)
+        npt.assert_allclose(self.read_output(out_fname), total * total)
+
+    def test_pipeline_names(self):
+        """Test that stages can't reuse the name of an input:"""
+        pipeline = Pipeline()
+        self.assertRaises(ValueError, pipeline.add_stage, 'input', band_sum)
+
+        pipeline = Pipeline(['nbar', 'pq'])
+        self.assertRaises(ValueError, pipeline.add_stage, 'pq', band_sum,
+                          ['nbar'])
+
+        pipeline = Pipeline()
+        pipeline.add_stage('nbar', band_sum)
+        pipeline.add_product('nbar', OutputSpec(pjoin(self.tmpdir, 'nbar')))
+        self.assertRaises(ValueError, pipeline.run, {'nbar': self.ds})
+
+    def test_progress(self):
+        """Test that progress is reported for every tile:"""
+        out_fname = pjoin(self.tmpdir, 'progress')
+        reported = []
+        map_tiles(band_sum, self.ds, OutputSpec(out_fname), workers=2,
+                  ytile=32, progress=lambda n, total: reported.append(n))
+        self.assertEqual(reported, [1, 2])
+
+    def test_halo(self):
+        """Test that a focal filter with a halo has no seams:"""
+        out_fname = pjoin(self.tmpdir, 'halo')
+        map_tiles(focal_max, (self.ds, [1]), OutputSpec(out_fname),
+                  xtile=10, ytile=7, halo=1)
+        npt.assert_array_equal(self.read_output(out_fname),
+                               focal_max(self.data[0:1]))
+
+    def test_order(self):
+        """Test a Hilbert ordered schedule:"""
+        out_fname = pjoin(self.tmpdir, 'order')
+        written = []
+        map_tiles(band_sum, self.ds, OutputSpec(out_fname), workers=3,
+                  xtile=8, ytile=8, order='hilbert', halo=1,
+                  progress=lambda n, total: written.append(n))
+        self.assertEqual(len(written), 48)
+        npt.assert_array_equal(self.read_output(out_fname),
+                               self.data.sum(axis=0))
+
+    def test_halo_decimation(self):
+        """Test a halo at reduced resolution:"""
+        out_fname = pjoin(self.tmpdir, 'halo_decimated')
+        map_tiles(focal_max, (self.ds, [1]), OutputSpec(out_fname),
+                  xtile=10, ytile=7, halo=1, decimation=2)
+        npt.assert_array_equal(self.read_output(out_fname),
+                               focal_max(self.data[0:1, 1::2, 1::2]))
+
+    def test_coverage(self):
+        """Test that tiles without valid data are skipped and filled:"""
+        out_fname = pjoin(self.tmpdir, 'coverage')
+        mask = numpy.zeros((16, 12), dtype='bool')
+        mask[:4] = True
+        coverage = CoverageIndex(mask, 4, 48, 64)
+        spec = OutputSpec(out_fname, nodata=-999)
+        summary = map_tiles(band_sum, self.ds, spec, xtile=48, ytile=16,
+                            coverage=coverage)
+        self.assertEqual(summary['tiles'], 2)
+        self.assertEqual(summary['skipped'], 2)
+
+        img = self.read_output(out_fname)
+        npt.assert_array_equal(img[:32], self.data[:, :32].sum(axis=0))
+        self.assertTrue((img[32:] == -999).all())
+
+    def test_coverage_chunked(self):
+        """Test chunks follow the tiling when the edge tile is first:"""
+        out_fname = pjoin(self.tmpdir, 'coverage_chunked')
+        mask = numpy.zeros((8, 6), dtype='bool')
+        mask[7] = True
+        coverage = CoverageIndex(mask, 8, 48, 64)
+        spec = OutputSpec(out_fname, nodata=-999, fmt='ZARR')
+        summary = map_tiles(band_sum, self.ds, spec, xtile=48, ytile=24,
+                            coverage=coverage)
+        self.assertEqual(summary['tiles'], 1)
+        self.assertEqual(summary['skipped'], 2)
+
+        store = ChunkedStore(out_fname)
+        self.assertEqual(store.chunks, (24, 48))
+        img = store.read_raster_band(1)
+        npt.assert_array_equal(img[48:], self.data[:, 48:].sum(axis=0))
+        self.assertTrue((img[:48] == -999).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+# ===============================================================================
+# Copyright 2015 Geoscience Australia
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+'''Unit tests for eotools/scheduler.py'''
+
+from __future__ import absolute_import
+import multiprocessing
+from os.path import join as pjoin
+import shutil
+import tempfile
+import time
+import unittest
+
+from eotools.scheduler import WorkQueue
+from eotools.scheduler import FileWorkQueue
+
+
+def work(queue, worker, results):
+    """
+    Process the items claimed by a worker; the first 10 items are
+    expensive.
+    """
+    items = []
+    for item in queue.iterate(worker):
+        if item < 10:
+            time.sleep(0.02)
+        items.append(item)
+    results.put(items)
+
+
+def run(queue, workers):
+    """
+    Run a process per worker, and return the items processed by each.
+    """
+    results = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=work,
+                                     args=(queue, worker, results))
+             for worker in workers]
+    for proc in procs:
+        proc.start()
+    items = [results.get() for _ in procs]
+    for proc in procs:
+        proc.join()
+
+    return items
+
+
+class TestWorkQueue(unittest.TestCase):
+
+    """
+    Unittests for the WorkQueue class.
+    """
+
+    def check(self, queue, workers):
+        items = run(queue, workers)
+        self.assertEqual(sorted(sum(items, [])), list(range(queue.n_items)))
+
+        report = queue.report()
+        self.assertEqual(len(report), len(workers))
+        self.assertEqual(sum(r['items'] for r in report), queue.n_items)
+        for r in report:
+            self.assertTrue(0 <= r['utilisation'] <= 1)
+
+        return report
+
+    def test_shared_counter(self):
+        """Test chunked claims from a shared counter:"""
+        queue = WorkQueue(60, 3, chunk_size=4)
+        report = self.check(queue, range(3))
+        self.assertEqual(sum(r['claims'] for r in report), 15)
+        self.assertEqual(sum(r['steals'] for r in report), 0)
+
+    def test_steal(self):
+        """Test that idle workers steal from busy workers:"""
+        queue = WorkQueue(40, 4, chunk_size=2, steal=True)
+        report = self.check(queue, range(4))
+        self.assertTrue(sum(r['steals'] for r in report) > 0)
+
+        # More workers than items
+        self.check(WorkQueue(3, 4, steal=True), range(4))
+
+
+class TestFileWorkQueue(unittest.TestCase):
+
+    """
+    Unittests for the FileWorkQueue class.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.fname = pjoin(self.tmpdir, 'queue.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_queue(self):
+        """Test workers joining a queue on disk:"""
+        FileWorkQueue(self.fname, 50)
+        queue = FileWorkQueue(self.fname, chunk_size=3)
+        items = run(queue, [None] * 3)
+        self.assertEqual(sorted(sum(items, [])), list(range(50)))
+
+        report = queue.report()
+        self.assertEqual(len(report), 3)
+        self.assertEqual(sum(r['items'] for r in report), 50)
+
+        # The queue is exhausted
+        self.assertEqual(queue.claim('late'), [])
+
+    def test_join(self):
+        """Test that joining a missing queue fails:"""
+        self.assertRaises(IOError, FileWorkQueue, self.fname)
+
+
+if __name__ == '__main__':
+    unittest.main()
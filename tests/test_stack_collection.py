@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+
+# ===============================================================================
+# Copyright 2015 Geoscience Australia
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+'''Unit tests for eotools/drivers/stack_collection.py'''
+
+from __future__ import absolute_import
+from os.path import join as pjoin
+import shutil
+import tempfile
+import unittest
+
+import numpy
+import numpy.testing as npt
+from osgeo import gdal
+from osgeo import osr
+
+from eotools.drivers.stack_collection import StackCollection
+from eotools.water_classifier import WaterClassifier
+from eotools.water_classifier import classify_stacks
+
+
+def write_stack(fname, array, origin=(144.0, -34.0), no_data=None):
+    """
+    Write a [bands, lines, samples] array to a GeoTIFF.
+    """
+    bands, lines, samples = array.shape
+    sr = osr.SpatialReference()
+    sr.ImportFromEPSG(4326)
+
+    driver = gdal.GetDriverByName('GTiff')
+    outds = driver.Create(fname, samples, lines, bands, gdal.GDT_Int16)
+    outds.SetGeoTransform((origin[0], 0.00025, 0.0, origin[1], 0.0,
+                           -0.00025))
+    outds.SetProjection(sr.ExportToWkt())
+    for i in range(bands):
+        band = outds.GetRasterBand(i + 1)
+        if no_data is not None:
+            band.SetNoDataValue(no_data)
+        band.WriteArray(array[i])
+    band = None
+    outds = None
+
+
+class TestStackCollection(unittest.TestCase):
+
+    """
+    Test reading a group of aligned stacks.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.data = numpy.random.randint(0, 1000, (3, 4, 30, 20))
+        self.data = self.data.astype('int16')
+        self.fnames = []
+        for i in range(3):
+            fname = pjoin(self.tmpdir, 'B{}.tif'.format(i + 1))
+            write_stack(fname, self.data[i])
+            self.fnames.append(fname)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_read_tile(self):
+        for workers in (1, None):
+            stacks = StackCollection(self.fnames, workers=workers)
+            self.assertEqual(len(stacks), 3)
+            self.assertEqual(stacks.bands, 4)
+
+            tile = ((5, 25), (2, 12))
+            subset = stacks.read_tile(tile)
+            self.assertEqual(subset.shape, (3, 4, 20, 10))
+            npt.assert_array_equal(subset, self.data[:, :, 5:25, 2:12])
+            npt.assert_array_equal(stacks.read_tile(tile, [4, 2]),
+                                   self.data[:, [3, 1], 5:25, 2:12])
+
+    def test_read_time_slice(self):
+        stacks = StackCollection(self.fnames)
+        stacks.init_tiling(20, 7)
+        self.assertEqual(stacks.n_tiles, 5)
+
+        tile = stacks.get_tile(4)
+        self.assertEqual(tile, ((28, 30), (0, 20)))
+        subset = stacks.read_time_slice(tile, 3)
+        self.assertEqual(subset.shape, (3, 2, 20))
+        npt.assert_array_equal(subset, self.data[:, 2, 28:30])
+
+    def test_alignment(self):
+        fname = pjoin(self.tmpdir, 'shifted.tif')
+        write_stack(fname, self.data[0], origin=(144.5, -34.0))
+        with self.assertRaises(ValueError):
+            StackCollection(self.fnames + [fname])
+
+        fname = pjoin(self.tmpdir, 'short.tif')
+        write_stack(fname, self.data[0, :3])
+        with self.assertRaises(ValueError):
+            StackCollection(self.fnames + [fname])
+
+        with self.assertRaises(ValueError):
+            StackCollection(self.fnames, names=['B1', 'B2'])
+
+
+class TestClassifyStacks(unittest.TestCase):
+
+    """
+    Test the water classification of a group of per-band stacks.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_classify(self):
+        data = numpy.random.randint(0, 3000, (6, 2, 15, 10))
+        data = data.astype('int16')
+        data[2, 1, 0:3, 0:4] = -999
+
+        fnames = []
+        for i in range(6):
+            fname = pjoin(self.tmpdir, 'B{}.tif'.format(i + 1))
+            write_stack(fname, data[i], no_data=-999)
+            fnames.append(fname)
+
+        out_fname = pjoin(self.tmpdir, 'water')
+        classify_stacks(fnames, out_fname)
+        result = gdal.Open(out_fname).ReadAsArray()
+        self.assertEqual(result.shape, (2, 15, 10))
+
+        classifier = WaterClassifier()
+        for i in range(2):
+            control = classifier.classify(data[:, i])
+            control[(data[:, i] == -999).any(axis=0)] = 0
+            npt.assert_array_equal(result[i], control)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,736 @@
+#!/usr/bin/env python
+
+# ===============================================================================
+# Copyright 2015 Geoscience Australia
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+'''Unit tests for eotools/drivers/stacked_dataset.py'''
+
+from __future__ import absolute_import
+from os.path import join as pjoin
+import pickle
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy
+import numpy.testing as npt
+from osgeo import gdal
+
+from eotools.bulk_stats import bulk_stats
+from eotools.drivers import lazy_array
+from eotools.drivers.stacked_dataset import StackedDataset
+from eotools.drivers.stacked_dataset import band_runs
+from eotools.drivers.time_major import build_time_major
+from eotools.instrumentation import IOStats
+from eotools.profiles import z_profile
+
+
+def write_image(fname, array, fmt='ENVI', options=None):
+    """
+    Write a [bands, lines, samples] array to disk using GDAL.
+    """
+    if options is None:
+        options = []
+    bands, lines, samples = array.shape
+    driver = gdal.GetDriverByName(fmt)
+    outds = driver.Create(fname, samples, lines, bands, gdal.GDT_Int16,
+                          options)
+    for i in range(bands):
+        outds.GetRasterBand(i + 1).WriteArray(array[i])
+    outds = None
+
+
+class TestMemmapBackend(unittest.TestCase):
+
+    """
+    Test that the raw memmap backend returns the same data as GDAL.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.data = numpy.random.randint(0, 1000, (6, 50, 40))
+        self.data = self.data.astype('int16')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def check_interleave(self, interleave):
+        fname = pjoin(self.tmpdir, 'stack_{}'.format(interleave))
+        write_image(fname, self.data,
+                    options=['INTERLEAVE={}'.format(interleave)])
+
+        ds = StackedDataset(fname)
+        gdal_ds = StackedDataset(fname, memmap=False)
+        self.assertTrue(ds.memmapped)
+        self.assertFalse(gdal_ds.memmapped)
+
+        tile = ((10, 30), (5, 25))
+        npt.assert_array_equal(ds.read_tile(tile, 3),
+                               gdal_ds.read_tile(tile, 3))
+        npt.assert_array_equal(ds.read_tile(tile, [2, 3, 4]),
+                               self.data[1:4, 10:30, 5:25])
+        npt.assert_array_equal(ds.read_tile(tile, [5, 1, 2]),
+                               self.data[[4, 0, 1], 10:30, 5:25])
+        npt.assert_array_equal(ds.read_tile_all_rasters(tile),
+                               self.data[:, 10:30, 5:25])
+        npt.assert_array_equal(ds.read_raster_band(6), self.data[5])
+
+    def test_bsq(self):
+        """Test band sequential files:"""
+        self.check_interleave('BSQ')
+
+    def test_bil(self):
+        """Test band interleaved by line files:"""
+        self.check_interleave('BIL')
+
+    def test_bip(self):
+        """Test band interleaved by pixel files:"""
+        self.check_interleave('BIP')
+
+    def test_copies(self):
+        """Test that modifying a read doesn't alter later reads:"""
+        fname = pjoin(self.tmpdir, 'stack')
+        write_image(fname, self.data)
+        ds = StackedDataset(fname)
+        self.assertTrue(ds.memmapped)
+
+        tile = ((10, 30), (5, 25))
+        reads = [lambda: ds.read_tile(tile, 3),
+                 lambda: ds.read_tile(tile, [2, 3, 4]),
+                 lambda: ds.read_tile_all_rasters(tile),
+                 lambda: ds.read_raster_band(3)]
+        for read in reads:
+            subset = read()
+            expected = subset.copy()
+            subset[...] = -1
+            npt.assert_array_equal(read(), expected)
+
+        # bulk_stats overwrites the NaN's of its input
+        fname = pjoin(self.tmpdir, 'stack_float')
+        data = self.data.astype('float32')
+        data[:, 0:5] = numpy.nan
+        driver = gdal.GetDriverByName('ENVI')
+        outds = driver.Create(fname, 40, 50, 6, gdal.GDT_Float32)
+        for i in range(6):
+            outds.GetRasterBand(i + 1).WriteArray(data[i])
+        outds = None
+
+        ds = StackedDataset(fname)
+        bulk_stats(ds.read_tile(((0, 50), (0, 40)), list(range(1, 7))))
+        npt.assert_array_equal(ds.read_tile_all_rasters(((0, 50), (0, 40))),
+                               data)
+
+    def test_non_raw(self):
+        """Test that non raw formats fall back to GDAL:"""
+        fname = pjoin(self.tmpdir, 'stack.tif')
+        write_image(fname, self.data, fmt='GTiff')
+        ds = StackedDataset(fname)
+        self.assertFalse(ds.memmapped)
+        npt.assert_array_equal(ds.read_raster_band(2), self.data[1])
+
+    def test_decimation(self):
+        """Test reduced resolution reads:"""
+        fname = pjoin(self.tmpdir, 'stack')
+        write_image(fname, self.data)
+        ds = StackedDataset(fname)
+        gdal_ds = StackedDataset(fname, memmap=False)
+        self.assertTrue(ds.memmapped)
+
+        # Both backends sample the pixel nearest each block's centre
+        subset = ds.read_raster_band(2, decimation=4)
+        self.assertEqual(subset.shape, (13, 10))
+        npt.assert_array_equal(subset[:, 0], self.data[1, [1, 5, 9, 13, 17,
+                                                           21, 25, 28, 32,
+                                                           36, 40, 44, 48],
+                                                       2])
+        npt.assert_array_equal(subset,
+                               gdal_ds.read_raster_band(2, decimation=4))
+
+        tile = ((3, 50), (0, 33))
+        for raster_bands in ([1, 2], [5, 2, 3], 4):
+            subset = ds.read_tile(tile, raster_bands, 8)
+            npt.assert_array_equal(subset,
+                                   gdal_ds.read_tile(tile, raster_bands, 8))
+        self.assertEqual(ds.read_tile(tile, [1, 2], 8).shape, (2, 6, 5))
+
+    def test_band_runs(self):
+        """Test non-contiguous and duplicated band lists:"""
+        fname = pjoin(self.tmpdir, 'stack')
+        write_image(fname, self.data)
+        tile = ((10, 30), (5, 25))
+        bands = [5, 1, 2, 2, 6]
+        expected = self.data[[4, 0, 1, 1, 5], 10:30, 5:25]
+        for ds in (StackedDataset(fname),
+                   StackedDataset(fname, memmap=False),
+                   StackedDataset(fname, memmap=False, source_threads=2)):
+            npt.assert_array_equal(ds.read_tile(tile, bands), expected)
+
+    def test_copy_on_write(self):
+        """Test that modifying a read doesn't alter the file:"""
+        fname = pjoin(self.tmpdir, 'stack')
+        write_image(fname, self.data)
+        ds = StackedDataset(fname)
+        subset = ds.read_tile(((0, 10), (0, 10)), [1, 2])
+        subset[:] = -1
+        npt.assert_array_equal(StackedDataset(fname).read_raster_band(1),
+                               self.data[0])
+
+
+class TestBandRuns(unittest.TestCase):
+
+    """
+    Test the grouping of band lists into contiguous runs.
+    """
+
+    def test_runs(self):
+        unique, inverse, runs = band_runs([7, 1, 2, 3, 8, 2])
+        self.assertEqual(unique, [1, 2, 3, 7, 8])
+        self.assertEqual(runs, [(0, 1, 3), (3, 7, 2)])
+        npt.assert_array_equal(numpy.array(unique)[inverse],
+                               [7, 1, 2, 3, 8, 2])
+
+    def test_sorted(self):
+        unique, inverse, runs = band_runs([2, 3, 4])
+        self.assertIsNone(inverse)
+        self.assertEqual(runs, [(0, 2, 3)])
+
+
+class TestBlockCache(unittest.TestCase):
+
+    """
+    Test reads served via the block cache.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.data = numpy.random.randint(0, 1000, (3, 70, 90))
+        self.data = self.data.astype('int16')
+        self.fname = pjoin(self.tmpdir, 'stack.tif')
+        write_image(self.fname, self.data, fmt='GTiff',
+                    options=['TILED=YES', 'BLOCKXSIZE=32',
+                             'BLOCKYSIZE=32'])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_reads(self):
+        """Test that cached reads match the data:"""
+        ds = StackedDataset(self.fname, cache_size=2**20)
+        tile = ((5, 66), (30, 89))
+        npt.assert_array_equal(ds.read_tile(tile, 2),
+                               self.data[1, 5:66, 30:89])
+        npt.assert_array_equal(ds.read_tile(tile, [3, 1]),
+                               self.data[[2, 0], 5:66, 30:89])
+        npt.assert_array_equal(ds.read_tile_all_rasters(tile),
+                               self.data[:, 5:66, 30:89])
+        npt.assert_array_equal(ds.read_raster_band(1), self.data[0])
+
+    def test_hits(self):
+        """Test that repeated reads are served from the cache:"""
+        ds = StackedDataset(self.fname, cache_size=2**20,
+                            cache_compress=True)
+        tile = ((0, 10), (0, 10))
+        ds.read_tile(tile, 1)
+        info = ds.cache_info()
+        self.assertEqual(info['misses'], 1)
+        self.assertEqual(info['hits'], 0)
+        ds.read_tile(((20, 30), (5, 6)), 1)
+        self.assertEqual(ds.cache_info()['hits'], 1)
+
+    def test_eviction(self):
+        """Test that the cache is bounded:"""
+        block_bytes = 32 * 32 * 2
+        ds = StackedDataset(self.fname, cache_size=2 * block_bytes)
+        ds.read_raster_band(1)
+        info = ds.cache_info()
+        self.assertLessEqual(info['nbytes'], 2 * block_bytes)
+        self.assertGreater(info['evictions'], 0)
+
+
+class TestLazyArray(unittest.TestCase):
+
+    """
+    Test the lazy array view of a StackedDataset.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.data = numpy.random.randint(1, 1000, (5, 40, 30))
+        self.data = self.data.astype('int16')
+        self.fname = pjoin(self.tmpdir, 'stack')
+        write_image(self.fname, self.data)
+        self.ds = StackedDataset(self.fname)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_slicing(self):
+        """Test basic and fancy band slicing:"""
+        subset = self.ds[1:4, 5:25, 10:20]
+        self.assertEqual(subset.shape, (3, 20, 10))
+        npt.assert_array_equal(subset.compute(),
+                               self.data[1:4, 5:25, 10:20])
+        npt.assert_array_equal(numpy.asarray(self.ds[[4, 0], :, 3:4]),
+                               self.data[[4, 0], :, 3:4])
+        npt.assert_array_equal(self.ds[2].compute(), self.data[2])
+
+    def test_expression(self):
+        """Test elementwise operations and band reductions:"""
+        ratio = self.ds[4].astype('float32') / (self.ds[4] + self.ds[3])
+        control = (self.data[4].astype('float32') /
+                   (self.data[4] + self.data[3]))
+        npt.assert_allclose(ratio.compute(ytile=7, workers=2), control)
+
+        mean = self.ds.array.astype('float64').mean(axis=0)
+        npt.assert_allclose(mean.compute(ytile=3), self.data.mean(axis=0))
+        self.assertEqual(self.ds.array.max(workers=2), self.data.max())
+
+    def test_array_operands(self):
+        """Test spatially constant array operands:"""
+        offsets = numpy.arange(5).reshape(5, 1, 1)
+        shifted = offsets + self.ds.array * 2
+        self.assertEqual(shifted.shape, (5, 40, 30))
+        npt.assert_array_equal(shifted.compute(ytile=7),
+                               offsets + self.data * 2)
+
+        scaled = self.ds[1] * numpy.array([1, 2]).reshape(2, 1, 1)
+        self.assertEqual(scaled.shape, (2, 40, 30))
+        npt.assert_array_equal(scaled.compute(),
+                               [self.data[1], self.data[1] * 2])
+
+        with self.assertRaises(ValueError):
+            self.ds[1] + self.data[1]
+
+    def test_pickle(self):
+        """Test that expressions can be sent to worker processes:"""
+        ratio = self.ds[4].astype('float32') / (self.ds[4] + self.ds[3])
+        ratio = pickle.loads(pickle.dumps(ratio))
+        control = (self.data[4].astype('float32') /
+                   (self.data[4] + self.data[3]))
+        npt.assert_allclose(ratio.compute(), control)
+
+    def test_to_file(self):
+        """Test streaming an expression to disk:"""
+        out_fname = pjoin(self.tmpdir, 'sum')
+        total = self.ds.array.astype('int32').sum(axis=0)
+        total.to_file(out_fname, ytile=6, workers=2)
+        result = gdal.Open(out_fname).ReadAsArray()
+        npt.assert_array_equal(result, self.data.sum(axis=0))
+
+        out_fname = pjoin(self.tmpdir, 'mask')
+        (self.ds[0] > 500).to_file(out_fname)
+        outds = gdal.Open(out_fname)
+        self.assertEqual(outds.GetRasterBand(1).DataType, gdal.GDT_Byte)
+        npt.assert_array_equal(outds.ReadAsArray(), self.data[0] > 500)
+        outds = None
+
+    def test_block_size(self):
+        """Test that a reduction's blocks are sized from its reads:"""
+        stats = IOStats()
+        ds = StackedDataset(self.fname, stats=stats)
+        mean = ds.array.astype('float64').mean(axis=0)
+
+        # Only count the block reads, not the read inferring the dtype
+        self.assertEqual(mean.dtype, numpy.float64)
+        stats.drain()
+
+        # 4 rows of the 5 float64 bands
+        block_bytes = 5 * 30 * 8 * 4
+        original = lazy_array.BLOCK_BYTES
+        lazy_array.BLOCK_BYTES = block_bytes
+        try:
+            npt.assert_allclose(mean.compute(), self.data.mean(axis=0))
+        finally:
+            lazy_array.BLOCK_BYTES = original
+
+        summary = stats.summary()['read']
+        self.assertEqual(summary['count'], 10)
+        self.assertEqual(summary['bytes'] // summary['count'],
+                         5 * 30 * 2 * 4)
+
+
+@unittest.skipIf(sys.version_info < (3, 4), "asyncio requires Python 3")
+class TestAsyncReads(unittest.TestCase):
+
+    """
+    Test the asyncio read API.
+    """
+
+    def setUp(self):
+        import asyncio
+        self.tmpdir = tempfile.mkdtemp()
+        self.data = numpy.random.randint(0, 1000, (4, 30, 20))
+        self.data = self.data.astype('int16')
+        self.fname = pjoin(self.tmpdir, 'stack')
+        write_image(self.fname, self.data)
+        asyncio.set_event_loop(asyncio.new_event_loop())
+
+    def tearDown(self):
+        import asyncio
+        asyncio.get_event_loop().close()
+        asyncio.set_event_loop(None)
+        shutil.rmtree(self.tmpdir)
+
+    def run_loop(self, awaitable):
+        import asyncio
+        loop = asyncio.get_event_loop()
+        return loop.run_until_complete(awaitable)
+
+    def test_reads(self):
+        import asyncio
+        ds = StackedDataset(self.fname, memmap=False)
+        tile = ((5, 15), (2, 12))
+
+        def gather():
+            return asyncio.gather(ds.aread_tile(tile, [1, 3]),
+                                  ds.aread_raster_band(2),
+                                  ds.az_profile((4, 7)))
+
+        subset, band, profile = self.run_loop(gather())
+        npt.assert_array_equal(subset, self.data[[0, 2], 5:15, 2:12])
+        npt.assert_array_equal(band, self.data[1])
+        npt.assert_array_equal(profile, self.data[:, 7, 4])
+
+    def test_coalesce(self):
+        import asyncio
+        stats = IOStats()
+        ds = StackedDataset(self.fname, memmap=False, stats=stats)
+        tile = ((0, 10), (0, 10))
+
+        def gather():
+            return asyncio.gather(*[ds.aread_tile(tile, [1, 2])
+                                    for _ in range(5)])
+
+        results = self.run_loop(gather())
+        self.assertEqual(stats.summary()['read']['count'], 1)
+        for subset in results:
+            npt.assert_array_equal(subset, self.data[0:2, 0:10, 0:10])
+
+    def test_private_handles(self):
+        import asyncio
+        ds = StackedDataset(self.fname)
+        self.assertTrue(ds.memmapped)
+        tile = ((0, 10), (0, 10))
+
+        def gather():
+            return asyncio.gather(*[ds.aread_tile(tile, 1)
+                                    for _ in range(3)])
+
+        results = self.run_loop(gather())
+
+        # Coalesced callers never share an array
+        for i, subset in enumerate(results):
+            npt.assert_array_equal(subset, self.data[0, 0:10, 0:10])
+            for other in results[i + 1:]:
+                self.assertFalse(numpy.shares_memory(subset, other))
+
+        # The caller's dataset doesn't keep per thread handles
+        self.assertIsNone(ds._thread_handles)
+
+    def test_shared_state(self):
+        ds = StackedDataset(self.fname, memmap=False)
+        tile = ((0, 10), (0, 10))
+        subset = self.run_loop(ds.aread_tile(tile, [1, 2]))
+        npt.assert_array_equal(subset, self.data[0:2, 0:10, 0:10])
+
+        # A cache attached after the reader was created, built from
+        # different data, serves the reader's subsequent reads
+        other_fname = pjoin(self.tmpdir, 'other')
+        write_image(other_fname, self.data[::-1])
+        cache_fname = pjoin(self.tmpdir, 'other_time_major')
+        StackedDataset(other_fname).build_time_major(cache_fname)
+        ds.attach_time_major(cache_fname)
+
+        subset = self.run_loop(ds.aread_tile(tile, [1, 2]))
+        npt.assert_array_equal(subset, self.data[::-1][0:2, 0:10, 0:10])
+
+
+VRT_BAND = """    <VRTRasterBand dataType="Int16" band="{band}">
+        <Metadata>
+            <MDI key="tile_pathname">{fname}</MDI>
+            <MDI key="tile_layer">{layer}</MDI>
+        </Metadata>
+        <SimpleSource>
+            <SourceFilename relativeToVRT="1">{fname}</SourceFilename>
+            <SourceBand>{layer}</SourceBand>
+        </SimpleSource>
+    </VRTRasterBand>
+"""
+
+
+class TestSourceThreads(unittest.TestCase):
+
+    """
+    Test that reads made directly from the source files of a VRT stack
+    match reads made through the VRT.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.data = numpy.random.randint(0, 1000, (2, 2, 30, 20))
+        self.data = self.data.astype('int16')
+        for i, name in enumerate(['a.tif', 'b.tif']):
+            write_image(pjoin(self.tmpdir, name), self.data[i], 'GTiff')
+
+        # The bands of the stack are taken from both layers of each file
+        self.sources = [('a.tif', 2), ('b.tif', 1), ('a.tif', 1),
+                        ('b.tif', 2)]
+        self.fname = pjoin(self.tmpdir, 'stack.vrt')
+        with open(self.fname, 'w') as src:
+            src.write('<VRTDataset rasterXSize="20" rasterYSize="30">\n')
+            for band, (fname, layer) in enumerate(self.sources):
+                src.write(VRT_BAND.format(band=band + 1, fname=fname,
+                                          layer=layer))
+            src.write('</VRTDataset>\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def expected(self, raster_bands):
+        index = [(0 if self.sources[b - 1][0] == 'a.tif' else 1,
+                  self.sources[b - 1][1] - 1) for b in raster_bands]
+        return numpy.array([self.data[i, j] for i, j in index])
+
+    def test_reads(self):
+        ds = StackedDataset(self.fname, source_threads=2)
+        vrt_ds = StackedDataset(self.fname)
+        self.assertFalse(ds.memmapped)
+
+        sources = [(pjoin(self.tmpdir, f), layer)
+                   for f, layer in self.sources]
+        self.assertEqual(ds._resolve_sources(), sources)
+        self.assertTrue(ds._use_sources())
+        self.assertFalse(vrt_ds._use_sources())
+
+        tile = ((5, 25), (2, 12))
+        for raster_bands in ([1, 2, 3, 4], [4, 1], [3]):
+            subset = ds.read_tile(tile, raster_bands)
+            npt.assert_array_equal(subset,
+                                   vrt_ds.read_tile(tile, raster_bands))
+            npt.assert_array_equal(subset,
+                                   self.expected(raster_bands)[:, 5:25,
+                                                               2:12])
+
+        npt.assert_array_equal(ds.read_tile_all_rasters(tile),
+                               vrt_ds.read_tile_all_rasters(tile))
+
+
+class TestTimeMajor(unittest.TestCase):
+
+    """
+    Test that reads served by a time-major cache match the band-major
+    source.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.data = numpy.random.randint(0, 1000, (6, 50, 40))
+        self.data = self.data.astype('int16')
+        self.fname = pjoin(self.tmpdir, 'stack')
+        write_image(self.fname, self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_round_trip(self):
+        cache_fname = pjoin(self.tmpdir, 'cache')
+        src = StackedDataset(self.fname, memmap=False)
+
+        # Chunks that don't divide the image
+        cache = src.build_time_major(cache_fname, xchunk=16, ychunk=12)
+        self.assertEqual((cache.samples, cache.lines), (40, 50))
+        cache = None
+
+        stats = IOStats()
+        ds = StackedDataset(self.fname, memmap=False, stats=stats)
+        ds.attach_time_major(cache_fname)
+        opened = stats.summary()['open']['count']
+
+        for xy in [(0, 0), (17, 23), (39, 49)]:
+            x, y = xy
+            npt.assert_array_equal(z_profile(ds, xy), self.data[:, y, x])
+        tile = ((5, 37), (10, 35))
+        npt.assert_array_equal(ds.read_tile(tile, [2, 5, 6]),
+                               self.data[[1, 4, 5], 5:37, 10:35])
+
+        # Every read was served by the cache, without opening the stack
+        self.assertEqual(stats.summary()['open']['count'], opened)
+
+        # A subset of the bands, built a single chunk at a time
+        subset_fname = pjoin(self.tmpdir, 'subset')
+        chunk_bytes = 12 * 16 * 2 * 2
+        subset = build_time_major(src, subset_fname, xchunk=16, ychunk=12,
+                                  raster_bands=[1, 3], max_bytes=chunk_bytes)
+        npt.assert_array_equal(subset.read_pixel(17, 23, [3]),
+                               self.data[[2], 23, 17])
+        npt.assert_array_equal(subset.read_tile(tile),
+                               self.data[[0, 2], 5:37, 10:35])
+
+    def test_dimensions(self):
+        cache_fname = pjoin(self.tmpdir, 'cache')
+        StackedDataset(self.fname, memmap=False).build_time_major(cache_fname)
+
+        fname = pjoin(self.tmpdir, 'small')
+        write_image(fname, self.data[:, :20])
+        with self.assertRaises(ValueError):
+            StackedDataset(fname, memmap=False).attach_time_major(cache_fname)
+
+
+class TestZAxisStats(unittest.TestCase):
+
+    """
+    Test the z-axis statistics of a stack against `bulk_stats`.
+    """
+
+    band_names = ['Sum',
+                  'Mean',
+                  'Valid Observations',
+                  'Variance',
+                  'Standard Deviation',
+                  'Skewness',
+                  'Kurtosis',
+                  'Max',
+                  'Min',
+                  'Median (non-interpolated value)',
+                  'Median Index (zero based index)',
+                  '1st Quantile (non-interpolated value)',
+                  '3rd Quantile (non-interpolated value)',
+                  'Geometric Mean']
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.data = numpy.random.randint(1, 1000, (6, 50, 40))
+        self.data = self.data.astype('int16')
+        self.data[2, 10:20, 5:15] = -999
+        self.data[4, 15:30, 0:10] = -999
+
+        self.fname = pjoin(self.tmpdir, 'stack')
+        driver = gdal.GetDriverByName('ENVI')
+        outds = driver.Create(self.fname, 40, 50, 6, gdal.GDT_Int16)
+        outds.SetGeoTransform((144.0, 0.00025, 0.0, -34.0, 0.0, -0.00025))
+        for i in range(6):
+            band = outds.GetRasterBand(i + 1)
+            band.SetNoDataValue(-999)
+            band.WriteArray(self.data[i])
+        band = None
+        outds = None
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_stats(self):
+        ds = StackedDataset(self.fname)
+        self.assertEqual(ds.no_data, -999)
+        ds.init_tiling(40, 7)
+
+        for workers in (1, 2):
+            out_fname = pjoin(self.tmpdir, 'stats_{}'.format(workers))
+            result = ds.z_axis_stats(out_fname, workers=workers)
+            self.assertEqual(result.bands, 14)
+
+            outds = gdal.Open(out_fname)
+            for i, name in enumerate(self.band_names):
+                band = outds.GetRasterBand(i + 1)
+                self.assertEqual(band.GetDescription(), name)
+                self.assertTrue(numpy.isnan(band.GetNoDataValue()))
+            band = None
+            outds = None
+
+            control = bulk_stats(self.data, no_data=-999)
+            npt.assert_allclose(result.read_tile_all_rasters(
+                ((0, 50), (0, 40))), control, rtol=1e-5)
+
+    def test_decimation(self):
+        geobox = StackedDataset(self.fname).get_geobox()
+        decimated = geobox.decimate(4)
+        self.assertEqual(decimated.shape, (13, 10))
+        self.assertEqual(decimated.origin, geobox.origin)
+        self.assertEqual(decimated.pixelsize, (0.001, 0.001))
+
+        results = []
+        for memmap in (True, False):
+            ds = StackedDataset(self.fname, memmap=memmap)
+            self.assertEqual(ds.memmapped, memmap)
+            out_fname = pjoin(self.tmpdir, 'quick_look_{}'.format(memmap))
+            result = ds.z_axis_stats(out_fname, decimation=4)
+            self.assertEqual((result.lines, result.samples), (13, 10))
+            npt.assert_allclose(result.geotransform,
+                                (144.0, 0.001, 0.0, -34.0, 0.0, -0.001))
+            results.append(result.read_tile_all_rasters(((0, 13),
+                                                         (0, 10))))
+
+        npt.assert_array_equal(results[0], results[1])
+
+    def test_raster_bands(self):
+        ds = StackedDataset(self.fname)
+        out_fname = pjoin(self.tmpdir, 'stats_subset')
+        result = ds.z_axis_stats(out_fname, raster_bands=[1, 3, 5])
+        control = bulk_stats(self.data[[0, 2, 4]], no_data=-999)
+        npt.assert_allclose(result.read_tile_all_rasters(((0, 50), (0, 40))),
+                            control, rtol=1e-5)
+
+
+class TestCoverageIndex(unittest.TestCase):
+
+    """
+    Test the coverage index built from a stack.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.fname = pjoin(self.tmpdir, 'stack')
+        data = numpy.full((4, 64, 48), -999, dtype='int16')
+        data[3, 40:48, 16:24] = 7
+
+        driver = gdal.GetDriverByName('ENVI')
+        outds = driver.Create(self.fname, 48, 64, 4, gdal.GDT_Int16)
+        for i in range(4):
+            band = outds.GetRasterBand(i + 1)
+            band.SetNoDataValue(-999)
+            band.WriteArray(data[i])
+        band = None
+        outds = None
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_coverage(self):
+        for memmap in (True, False):
+            ds = StackedDataset(self.fname, memmap=memmap)
+            coverage = ds.coverage_index(decimation=8)
+            self.assertEqual(coverage.mask.shape, (8, 6))
+
+            # The valid block, dilated by one low resolution pixel
+            expected = numpy.zeros((8, 6), dtype='bool')
+            expected[4:7, 1:4] = True
+            npt.assert_array_equal(coverage.mask, expected)
+
+            self.assertFalse(coverage.is_empty(((40, 48), (16, 24))))
+            self.assertTrue(coverage.is_empty(((0, 16), (0, 48))))
+            self.assertTrue(coverage.is_empty(((40, 48), (40, 48))))
+
+            tiles = [((0, 32), (0, 48)), ((32, 64), (0, 48))]
+            self.assertEqual(coverage.split(tiles), (tiles[1:], tiles[:1]))
+
+    def test_raster_bands(self):
+        ds = StackedDataset(self.fname)
+        coverage = ds.coverage_index(decimation=8, raster_bands=[1, 2])
+        self.assertFalse(coverage.mask.any())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -28,12 +28,20 @@ Matthew.Hoyles@ga.gov.au
 """
 
 from __future__ import absolute_import
+from os.path import exists
+from os.path import join as pjoin
+import pickle
 import random
+import shutil
+import tempfile
 import unittest
 
 import numpy
+import numpy.testing as npt
+import gdal
 
 from eotools import tiling
+from eotools.drivers.stacked_dataset import StackedDataset
 
 
 class TestGetTile3(unittest.TestCase):
@@ -91,6 +99,77 @@ class TestGetTile3(unittest.TestCase):
             self.assertRaises(ZeroDivisionError, tiling.generate_tiles,
                               samples, lines, xtile, ytile, False)
 
+    def test_halo(self):
+        """Test that core windows tile the array and read windows
+        add the clipped halo:"""
+        for (samples, lines, xtile, ytile) in self.normal_input:
+            pairs = tiling.generate_tiles(samples, lines, xtile, ytile,
+                                          False, halo=3)
+            cores = [core for _, core in pairs]
+            self.check_sizes(xtile, ytile, cores)
+            self.check_tiling(samples, lines, cores)
+            for window, core in pairs:
+                (rys, rye), (rxs, rxe) = window
+                (ys, ye), (xs, xe) = core
+                self.assertEqual(rys, max(ys - 3, 0))
+                self.assertEqual(rye, min(ye + 3, lines))
+                self.assertEqual(rxs, max(xs - 3, 0))
+                self.assertEqual(rxe, min(xe + 3, samples))
+
+    def test_order(self):
+        """Test that every order covers the array, and that the Hilbert
+        order only steps between neighbouring tiles:"""
+        for (samples, lines, xtile, ytile) in self.normal_input:
+            rows = tiling.generate_tiles(samples, lines, xtile, ytile, False)
+            for order in tiling.TILE_ORDERS:
+                tiles_list = tiling.generate_tiles(samples, lines, xtile,
+                                                   ytile, False, order=order)
+                self.assertEqual(sorted(tiles_list), sorted(rows))
+                self.assertEqual(tiling.order_tiles(rows, order), tiles_list)
+
+        rows, cols = tiling.tile_order(16, 16, 'hilbert')
+        steps = numpy.abs(numpy.diff(rows)) + numpy.abs(numpy.diff(cols))
+        self.assertTrue((steps == 1).all())
+
+        rows, cols = tiling.tile_order(2, 2, 'morton')
+        self.assertEqual(list(zip(rows, cols)),
+                         [(0, 0), (0, 1), (1, 0), (1, 1)])
+
+        self.assertRaises(ValueError, tiling.generate_tiles, 10, 10,
+                          order='spiral')
+
+    def test_plan_tile_size(self):
+        """Test that planned tiles are block aligned and within budget:"""
+        # Strips of whole lines
+        self.assertEqual(tiling.plan_tile_size(8624, 7567, 400, 'int16',
+                                               2**30, 5.0, (8624, 1),
+                                               workers=4), (8624, 3))
+
+        # Three 256x256 blocks of 10 float32 bands, and their working copy
+        budget = 3 * 256 * 256 * 10 * 8
+        xtile, ytile = tiling.plan_tile_size(4000, 4000, 10, 'float32',
+                                             budget, 1.0, (256, 256))
+        self.assertEqual((xtile, ytile), (768, 256))
+
+        # The whole image
+        self.assertEqual(tiling.plan_tile_size(4000, 4000, 10, 'float32',
+                                               2**40, 1.0, (256, 256)),
+                         (4000, 4000))
+
+        # A halo is included within the budget
+        xtile, ytile = tiling.plan_tile_size(100, 100, 1, 'uint8', 5000,
+                                             halo=2)
+        self.assertTrue((xtile + 4) * (ytile + 4) * 5 <= 5000)
+
+        self.assertRaises(ValueError, tiling.plan_tile_size, 100, 100, 1,
+                          'uint8', 1)
+
+    def test_decimate_halo(self):
+        """Test that both windows of a pair are decimated:"""
+        pair = (((0, 11), (0, 11)), ((0, 10), (0, 10)))
+        self.assertEqual(tiling.decimate_tile(pair, 2, 100, 15),
+                         (((0, 15), (0, 22)), ((0, 15), (0, 20))))
+
     def do_test(self, test_input):
         """Check sizes and coverage for a list of test input."""
         for (samples, lines, xtile, ytile) in test_input:
@@ -143,6 +222,369 @@ class TestGetTile3(unittest.TestCase):
                           'Tile overlap detected at ' + repr(index))
 
 
+class TestTiledOutput(unittest.TestCase):
+
+    """Unit tests for the tiling.TiledOutput class."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.data = numpy.random.randint(0, 1000, (5, 37, 41))
+        self.data = self.data.astype('int16')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, fname, **kwargs):
+        """Write the test data tile by tile and read it back."""
+        bands, lines, samples = self.data.shape
+        outds = tiling.TiledOutput(fname, samples, lines, bands,
+                                   dtype=gdal.GDT_Int16, **kwargs)
+        for tile in tiling.generate_tiles(samples, lines, 10, 7):
+            (ys, ye), (xs, xe) = tile
+            outds.write_tile(self.data[:, ys:ye, xs:xe], tile)
+        outds.close()
+        self.assertTrue(outds.closed)
+
+        return gdal.Open(fname).ReadAsArray()
+
+    def test_batched(self):
+        """Test multi-band writes:"""
+        img = self.write(pjoin(self.tmpdir, 'batched'))
+        npt.assert_array_equal(img, self.data)
+
+    def test_flush_interval(self):
+        """Test periodic flushing:"""
+        img = self.write(pjoin(self.tmpdir, 'flushed'), flush_interval=3)
+        npt.assert_array_equal(img, self.data)
+
+    def test_async_write(self):
+        """Test background writes, with a private and a shared writer:"""
+        img = self.write(pjoin(self.tmpdir, 'async'), async_write=True)
+        npt.assert_array_equal(img, self.data)
+
+        writer = tiling.BackgroundWriter(max_bytes=4096)
+        img = self.write(pjoin(self.tmpdir, 'shared'), writer=writer)
+        writer.close()
+        npt.assert_array_equal(img, self.data)
+
+    def test_interleave(self):
+        """Test band, line and pixel interleaved outputs:"""
+        for interleave in ('BSQ', 'BIL', 'BIP'):
+            fname = pjoin(self.tmpdir, interleave)
+            options = ['INTERLEAVE={}'.format(interleave)]
+            img = self.write(fname, options=options)
+            npt.assert_array_equal(img, self.data)
+
+    def test_memmap(self):
+        """Test direct writes via a memmap, including attached writers:"""
+        for interleave in ('BSQ', 'BIP'):
+            fname = pjoin(self.tmpdir, 'memmap_' + interleave)
+            options = ['INTERLEAVE={}'.format(interleave)]
+            img = self.write(fname, options=options, memmap=True)
+            npt.assert_array_equal(img, self.data)
+
+        bands, lines, samples = self.data.shape
+        fname = pjoin(self.tmpdir, 'attached')
+        outds = tiling.TiledOutput(fname, samples, lines, bands,
+                                   dtype=gdal.GDT_Int16, memmap=True)
+        self.assertTrue(outds.memmapped)
+        writer = pickle.loads(pickle.dumps(outds.attach()))
+        for tile in tiling.generate_tiles(samples, lines, 10, 7):
+            (ys, ye), (xs, xe) = tile
+            writer.write_tile(self.data[:, ys:ye, xs:xe], tile)
+        writer.close()
+        outds.close()
+        npt.assert_array_equal(gdal.Open(fname).ReadAsArray(), self.data)
+
+        self.assertRaises(ValueError, tiling.TiledOutput,
+                          pjoin(self.tmpdir, 'memmap.tif'), samples, lines,
+                          fmt='GTiff', memmap=True)
+
+    def test_cog(self):
+        """Test a compressed COG with overviews built from the tiles:"""
+        fname = pjoin(self.tmpdir, 'cog.tif')
+        img = self.write(fname, fmt='GTiff', overviews=[2, 4],
+                         options=['COMPRESS=DEFLATE'], cog=True)
+        npt.assert_array_equal(img, self.data)
+
+        ds = gdal.Open(fname)
+        band = ds.GetRasterBand(1)
+        self.assertEqual(band.GetOverviewCount(), 2)
+        for i, factor in enumerate([2, 4]):
+            ys = tiling.decimated_index(0, 37, factor)
+            xs = tiling.decimated_index(0, 41, factor)
+            npt.assert_array_equal(band.GetOverview(i).ReadAsArray(),
+                                   self.data[0][numpy.ix_(ys, xs)])
+        self.assertEqual(ds.GetMetadataItem('COMPRESSION',
+                                            'IMAGE_STRUCTURE'), 'DEFLATE')
+
+    def test_nearest_overviews(self):
+        """Test that overviews sample the pixels of a decimated read:"""
+        fname = pjoin(self.tmpdir, 'overviews.tif')
+        self.write(fname, fmt='GTiff', overviews=[2, 4])
+
+        # Without overviews, GDAL decimates the image on the fly
+        stack_fname = pjoin(self.tmpdir, 'stack')
+        self.write(stack_fname)
+
+        ds = gdal.Open(fname)
+        for memmap in (True, False):
+            stack = StackedDataset(stack_fname, memmap=memmap)
+            for i, factor in enumerate([2, 4]):
+                for band in range(1, 6):
+                    overview = ds.GetRasterBand(band).GetOverview(i)
+                    npt.assert_array_equal(
+                        overview.ReadAsArray(),
+                        stack.read_raster_band(band, decimation=factor))
+        ds = None
+
+    def test_close(self):
+        """Test closing twice, and a COG whose writes failed:"""
+        bands, lines, samples = self.data.shape
+        fname = pjoin(self.tmpdir, 'twice')
+        outds = tiling.TiledOutput(fname, samples, lines, bands,
+                                   dtype=gdal.GDT_Int16)
+        outds.write_tile(self.data, ((0, lines), (0, samples)))
+        outds.close()
+        outds.close()
+        self.assertTrue(outds.closed)
+        npt.assert_array_equal(gdal.Open(fname).ReadAsArray(), self.data)
+
+        # A queued write fails, so the COG is never finalised
+        fname = pjoin(self.tmpdir, 'failed.tif')
+        outds = tiling.TiledOutput(fname, samples, lines, bands,
+                                   dtype=gdal.GDT_Int16, fmt='GTiff',
+                                   cog=True, async_write=True)
+        outds.write_tile(self.data[0], ((0, lines), (0, samples)),
+                         raster_band=bands + 1)
+        self.assertRaises(Exception, outds.close)
+        self.assertTrue(outds.closed)
+        self.assertFalse(exists(fname + '.tmp.tif'))
+        self.assertFalse(exists(fname))
+
+    def test_average_tile_size(self):
+        """Test misaligned averaged overviews are rejected on creation:"""
+        bands, lines, samples = self.data.shape
+        fname = pjoin(self.tmpdir, 'average.tif')
+        self.assertRaises(ValueError, tiling.TiledOutput, fname, samples,
+                          lines, fmt='GTiff', overviews=[2, 4],
+                          overview_resampling='AVERAGE', tile_size=(7, 10))
+        self.assertFalse(exists(fname))
+
+        outds = tiling.TiledOutput(fname, samples, lines, bands,
+                                   dtype=gdal.GDT_Int16, fmt='GTiff',
+                                   overviews=[2, 4],
+                                   overview_resampling='AVERAGE',
+                                   tile_size=(8, 12))
+        for tile in tiling.generate_tiles(samples, lines, 12, 8):
+            (ys, ye), (xs, xe) = tile
+            outds.write_tile(self.data[:, ys:ye, xs:xe], tile)
+        outds.close()
+        npt.assert_array_equal(gdal.Open(fname).ReadAsArray(), self.data)
+
+    def test_average_block(self):
+        """Test averaged overview blocks:"""
+        tile = ((0, 37), (0, 41))
+        data, xoff, yoff = tiling.average_block(self.data, tile, 4, 41, 37)
+        self.assertEqual(data.shape, (5, 10, 11))
+        expected = numpy.round(self.data[:, :4, :4].mean(axis=(1, 2)))
+        npt.assert_array_equal(data[:, 0, 0], expected)
+        self.assertRaises(ValueError, tiling.average_block, self.data,
+                          ((2, 39), (0, 41)), 4, 41, 39)
+
+
+class TestMultiTiledOutput(unittest.TestCase):
+
+    """Unit tests for the tiling.MultiTiledOutput class."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.data = numpy.random.randint(0, 1000, (5, 37, 41))
+        self.data = self.data.astype('int16')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_write(self):
+        """Test fanning out tiles to outputs of differing bands and
+        datatypes, synchronously and in the background:"""
+        bands, lines, samples = self.data.shape
+        for async_write in (False, True):
+            outds = tiling.MultiTiledOutput(samples, lines,
+                                            async_write=async_write)
+            stack = pjoin(self.tmpdir, 'stack_{}'.format(async_write))
+            mask = pjoin(self.tmpdir, 'mask_{}'.format(async_write))
+            outds.create('stack', stack, bands, gdal.GDT_Int16)
+            outds.create('mask', mask, dtype=gdal.GDT_Byte)
+            for tile in tiling.generate_tiles(samples, lines, 10, 7):
+                (ys, ye), (xs, xe) = tile
+                subset = self.data[:, ys:ye, xs:xe]
+                outds.write_tile({'stack': subset,
+                                  'mask': (subset[0] > 500)}, tile)
+            outds.close()
+            self.assertTrue(outds.closed)
+            self.assertTrue(outds['stack'].closed)
+
+            npt.assert_array_equal(gdal.Open(stack).ReadAsArray(),
+                                   self.data)
+            npt.assert_array_equal(gdal.Open(mask).ReadAsArray(),
+                                   self.data[0] > 500)
+
+        self.assertRaises(KeyError, outds.write_tile,
+                          {'other': self.data}, ((0, 37), (0, 41)))
+
+    def test_close(self):
+        """Test closing twice:"""
+        bands, lines, samples = self.data.shape
+        outds = tiling.MultiTiledOutput(samples, lines, async_write=True)
+        stack = pjoin(self.tmpdir, 'stack')
+        outds.create('stack', stack, bands, gdal.GDT_Int16)
+        outds.write_tile({'stack': self.data}, ((0, lines), (0, samples)))
+        outds.close()
+        outds.close()
+        self.assertTrue(outds.closed)
+        npt.assert_array_equal(gdal.Open(stack).ReadAsArray(), self.data)
+
+        # The outputs are only closed by the first close
+        closes = []
+
+        class Output(object):
+            def close(self):
+                closes.append(self)
+
+        outds = tiling.MultiTiledOutput(samples, lines)
+        outds.add('output', Output())
+        outds.close()
+        outds.close()
+        self.assertEqual(len(closes), 1)
+
+
+class TestBackgroundWriter(unittest.TestCase):
+
+    """Unit tests for the tiling.BackgroundWriter class."""
+
+    def test_errors(self):
+        """Test that errors surface on the next call:"""
+        def fail():
+            raise IOError("write failed")
+
+        writer = tiling.BackgroundWriter()
+        writer.submit(self, fail)
+        self.assertRaises(IOError, writer.wait, self)
+
+        results = []
+        writer.submit(self, results.append, (1,))
+        writer.close()
+        self.assertEqual(results, [1])
+
+
+class TestTileIndex(unittest.TestCase):
+
+    """Unit tests for the tiling.TileIndex class."""
+
+    def setUp(self):
+        self.index = tiling.TileIndex.from_grid(50, 37, 10, 7)
+
+    def test_generate_tiles(self):
+        """Test that the index matches generate_tiles:"""
+        for order in tiling.TILE_ORDERS:
+            for halo in (0, 2):
+                index = tiling.TileIndex.from_grid(50, 37, 10, 7, order,
+                                                   halo)
+                tiles_list = tiling.generate_tiles(50, 37, 10, 7, False,
+                                                   halo=halo, order=order)
+                self.assertEqual(index.tolist(), tiles_list)
+                self.assertEqual(len(index), len(tiles_list))
+
+        rebuilt = tiling.TileIndex.from_tiles(self.index.tolist(), 50, 37)
+        self.assertEqual(rebuilt, self.index)
+
+    def test_indexing(self):
+        """Test indexing, slicing, shuffling and partitioning:"""
+        self.assertEqual(self.index[0], ((0, 7), (0, 10)))
+        self.assertEqual(self.index[-1], ((35, 37), (40, 50)))
+        subset = self.index[1:3]
+        self.assertTrue(isinstance(subset, tiling.TileIndex))
+        self.assertEqual(subset.tolist(), [((0, 7), (10, 20)),
+                                           ((0, 7), (20, 30))])
+
+        shuffled = self.index.shuffle(seed=1)
+        self.assertEqual(sorted(shuffled), sorted(self.index))
+        self.assertNotEqual(shuffled, self.index)
+
+        parts = shuffled.partition(4)
+        self.assertEqual([len(part) for part in parts], [8, 8, 7, 7])
+        self.assertEqual(sum([part.tolist() for part in parts], []),
+                         shuffled.tolist())
+
+    def test_tile_of(self):
+        """Test the lookup of the tile containing a pixel:"""
+        for index in (self.index, self.index.shuffle(seed=2)):
+            position = index.tile_of(15, 8)
+            self.assertEqual(index[position], ((7, 14), (10, 20)))
+
+        positions = self.index.tile_of(numpy.array([0, 49, 50, -1]),
+                                       numpy.array([0, 36, 0, 0]))
+        npt.assert_array_equal(positions, [0, 29, -1, -1])
+
+        # A pixel between the tiles of a subset
+        subset = self.index[[0, 2]]
+        self.assertEqual(subset.tile_of(12, 1), -1)
+        self.assertEqual(subset.tile_of(25, 1), 1)
+
+
+class TestCoverageIndex(unittest.TestCase):
+
+    """Unit tests for the tiling.CoverageIndex class."""
+
+    def setUp(self):
+        # Valid data within a single low resolution pixel at (3, 5)
+        mask = numpy.zeros((10, 10), dtype='bool')
+        mask[3, 5] = True
+        self.coverage = tiling.CoverageIndex(mask, 8, 80, 75)
+
+    def test_is_empty(self):
+        """Test that only tiles near the valid data are kept:"""
+        self.assertFalse(self.coverage.is_empty(((24, 32), (40, 48))))
+        # The mask is dilated by a single low resolution pixel
+        self.assertFalse(self.coverage.is_empty(((32, 40), (48, 56))))
+        self.assertTrue(self.coverage.is_empty(((40, 48), (40, 48))))
+        self.assertTrue(self.coverage.is_empty(((0, 16), (0, 80))))
+
+    def test_generate_tiles(self):
+        """Test that empty tiles are skipped by generate_tiles:"""
+        tiles = tiling.generate_tiles(80, 75, 16, 16, False)
+        kept = tiling.generate_tiles(80, 75, 16, 16, False,
+                                     coverage=self.coverage)
+        valid, empty = self.coverage.split(tiles)
+        self.assertEqual(kept, valid)
+        self.assertEqual(len(valid) + len(empty), len(tiles))
+        self.assertEqual(kept, [((16, 32), (32, 48)), ((16, 32), (48, 64)),
+                                ((32, 48), (32, 48)), ((32, 48), (48, 64))])
+
+    def test_fill_tile(self):
+        """Test that skipped tiles are filled with no data:"""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            fname = pjoin(tmpdir, 'filled')
+            outds = tiling.TiledOutput(fname, 80, 75, 2, nodata=-1,
+                                       dtype=gdal.GDT_Int16)
+            for tile in tiling.generate_tiles(80, 75, 16, 16):
+                if self.coverage.is_empty(tile):
+                    outds.fill_tile(tile)
+                else:
+                    (ys, ye), (xs, xe) = tile
+                    outds.write_tile(numpy.ones((2, ye - ys, xe - xs),
+                                                dtype='int16'), tile)
+            outds.close()
+
+            img = gdal.Open(fname).ReadAsArray()
+            self.assertTrue((img[:, 16:48, 32:64] == 1).all())
+            self.assertEqual((img == -1).sum(), 2 * (80 * 75 - 32 * 32))
+        finally:
+            shutil.rmtree(tmpdir)
+
+
 def generate_tile_tags(tiles_list):
     """Generate a random tag for each tile.
 
@@ -182,6 +624,16 @@ def the_suite():
     """Returns a test suite of all the tests in this module."""
 
     suite = unittest.defaultTestLoader.loadTestsFromTestCase(TestGetTile3)
+    suite.addTests(
+        unittest.defaultTestLoader.loadTestsFromTestCase(TestTiledOutput))
+    suite.addTests(
+        unittest.defaultTestLoader.loadTestsFromTestCase(TestBackgroundWriter))
+    suite.addTests(
+        unittest.defaultTestLoader.loadTestsFromTestCase(TestCoverageIndex))
+    suite.addTests(
+        unittest.defaultTestLoader.loadTestsFromTestCase(TestTileIndex))
+    suite.addTests(
+        unittest.defaultTestLoader.loadTestsFromTestCase(TestMultiTiledOutput))
 
     return suite
 